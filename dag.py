@@ -8,6 +8,9 @@ from pathlib import Path
 import pythoncom
 import win32com.client as win32
 
+from schemas import header_aliases, normalize_header
+from staging import stage
+
 # ----------------------------
 # НАСТРОЙКИ
 # ----------------------------
@@ -95,23 +98,9 @@ def make_unique_dest_path(dest_dir: str, base_filename: str) -> str:
 # ----------------------------
 # Excel helpers
 # ----------------------------
-def normalize_header(x) -> str:
-    if x is None:
-        return ""
-    s = str(x).strip()
-    s = re.sub(r"\s+", " ", s)
-    return s
-
-
 def build_alias_map():
-    return {
-        "Клиент.Новый клиент сезона": "Новый клиент сезона",
-        "Новый клиент сезона": "Новый клиент сезона",
-        "Контрагент.Сокращенное наименование": "Контрагент.Сокращенное юр. наименование",
-        "Контрагент.Сокращенное юр. наименование": "Контрагент.Сокращенное юр. наименование",
-        "Общая дебиторская задолженность,руб": "Общая дебиторская задолженность, руб",
-        "Общая дебиторская задолженность, руб": "Общая дебиторская задолженность, руб",
-    }
+    # Синонимы заголовков выгрузки 1С ведутся в реестре схем (schemas.py)
+    return header_aliases("ДЗ_1С")
 
 
 def remap_header(h: str, alias_map: dict) -> str:
@@ -190,7 +179,7 @@ def main():
         ws_t = wb_target.Worksheets(SHEET_NAME)
 
         log("Открываю источник данных (считать и закрыть)...")
-        wb_data = excel.Workbooks.Open(DATA_FILE, UpdateLinks=0, ReadOnly=True)
+        wb_data = excel.Workbooks.Open(stage(DATA_FILE), UpdateLinks=0, ReadOnly=True)
         ws_s = wb_data.Worksheets(SHEET_NAME)
 
         alias = build_alias_map()
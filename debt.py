@@ -0,0 +1,998 @@
+# Пакетный расчёт процентов по графикам оплат.
+# Работает сразу по всем заказам (строкам) из schedules.Schedules
+# (проценты по просрочкам и коммерческий кредит юр. отдела):
+# FIFO-распределение фактов по планам — один проход слиянием по плоским
+# массивам, дальше проценты считаются по массивам событий без цикла по заказам.
+# Суммы внутри движков — целые копейки int64 (money.py): распределение и
+# остатки точные, план закрыт, когда остаток <= 0, без допусков. Графики с
+# суммами float переводятся в копейки на входе (Schedules.kopeks). Проценты —
+# тоже копейки: точная сумма кусков итога и одно округление (money.interest_kopeks).
+
+import os
+import pickle
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from money import fifo_allocate, from_kopeks, interest_kopeks, rate_units
+from rates import RateCalendar
+from schedules import Schedules, cumulative_at
+from sharding import map_shards
+
+
+# ---------- FIFO-распределение ----------
+
+def _starts(groups) -> np.ndarray:
+    # True на первом элементе каждой группы (группы идут подряд)
+    out = np.ones(len(groups), dtype=bool)
+    out[1:] = groups[1:] != groups[:-1]
+    return out
+
+
+def _running_remaining(start, groups, applied):
+    """
+    Остаток перед каждым событием группы: start[g] минус applied предыдущих событий
+    группы (группы идут подряд, суммы — копейки, поэтому накопленной суммой точно).
+    Возвращает (остаток перед событием, остаток каждой группы после всех её событий).
+    """
+    final = start.copy()
+    if not len(groups):
+        return start[groups], final
+    first = _starts(groups)
+    done = np.cumsum(applied) - applied
+    done -= done[first][np.cumsum(first) - 1]
+    before = start[groups] - done
+    last = np.append(first[1:], True)
+    final[groups[last]] = before[last] - applied[last]
+    return before, final
+
+
+def allocate_fifo(plans: Schedules, facts: Schedules):
+    """
+    FIFO-распределение фактов по планам для всех строк сразу (money.fifo_allocate).
+    Предоплата разрешена, но платёж не "перепрыгивает" незакрытый план:
+    план с остатком <= 0 пропускается, неположительные факты ничего не гасят.
+    Возвращает dict массивов, отсортированных по (строка, план, факт):
+      plan — глобальный номер плановой записи в plans,
+      fact — глобальный номер фактической записи в facts,
+      applied — распределённая сумма (копейки);
+    и положение FIFO после всех фактов:
+      rem — остаток каждой плановой записи, ptr — текущий план строки (номер внутри
+      строки: первый план с остатком > 0, все до него закрыты).
+    """
+    plans, facts = plans.kopeks(), facts.kopeks()
+    a = fifo_allocate(plans, facts)
+    idx_in_row = np.arange(len(plans.amount)) - np.repeat(plans.offsets[:-1], plans.counts)
+    ptr = plans.counts.copy()
+    open_ = a["rem"] > 0
+    np.minimum.at(ptr, plans.row_ids()[open_], idx_in_row[open_])
+    a["ptr"] = ptr
+    return a
+
+
+# ---------- Начисление по кускам ----------
+# Проценты линейны по ставке, поэтому движки ставку не применяют: они отдают
+# "куски" начисления — остаток base (копейки) и число дней days каждого периода,
+# строку куска. Ставка применяется в конце: для каждого итога (строки) точная
+# сумма base * ставка * days его кусков и одно округление до копейки
+# (money.interest_kopeks). Несколько ставок (сценарии 18% / 28% / ключевая)
+# считаются по тем же кускам, без повторного FIFO — столбец на ставку.
+# Кусок знает и своё место во времени: since — день перед началом начисления
+# (дни куска — since+1 .. since+days), поэтому вместо числа можно подставить
+# календарь ставок (rates.RateCalendar): сумма ставок за эти дни.
+
+def rate_days(rate, days, since=None, basis: int = 365):
+    """
+    Сумма ставок (миллионные доли) за дни кусков и basis для money.interest_kopeks.
+    rate — число или массив по кускам (годовая ставка при basis=365, дневная при
+    basis=1) либо RateCalendar (нужен since; basis — календаря).
+    """
+    days = np.asarray(days, dtype=np.int64)
+    if isinstance(rate, RateCalendar):
+        return rate.unit_days(since, days), rate.basis
+    return rate_units(rate) * days, basis
+
+
+def interest_at(rows, base, days, since, n: int, rate) -> np.ndarray:
+    """
+    Проценты по строкам в копейках (int64), base — копейки. rate — годовая ставка:
+    число, RateCalendar или список из них (сценарии — результат формы (n, k),
+    столбец на ставку).
+    """
+    if isinstance(rate, (list, tuple)):
+        if not rate:
+            return np.zeros((n, 0), dtype=np.int64)
+        return np.column_stack([interest_at(rows, base, days, since, n, r) for r in rate])
+    rd, basis = rate_days(rate, days, since)
+    return interest_kopeks(rows, base, rd, n, basis)
+
+
+def accrue_lists(pieces, rate) -> np.ndarray:
+    """
+    interest_at для кусков, собранных построчно списками:
+    pieces[i] = [(base, days, since), ...]; rate — как в interest_at.
+    """
+    rows = np.repeat(np.arange(len(pieces)), [len(p) for p in pieces])
+    base = np.array([b for p in pieces for b, _, _ in p], dtype=np.int64)
+    days = np.array([d for p in pieces for _, d, _ in p], dtype=np.int64)
+    since = np.array([s for p in pieces for _, _, s in p], dtype=np.int64)
+    return interest_at(rows, base, days, since, len(pieces), rate)
+
+
+# ---------- "Проценты, руб." — excel-логика ----------
+# Расчёт разбит на две части:
+#   excel_state    — всё, что не зависит от даты расчёта и ставки: FIFO, предоплаты,
+#                    carry, остатки и куски начисления за уже прошедшие платежи;
+#   state_pieces   — куски на дату today (добавляются хвосты до today);
+#   state_interest — проценты по ставке (или нескольким ставкам сразу).
+# Состояние можно сохранить и на следующий день только дописать новые факты
+# (advance_state) — см. инкрементальный режим ниже.
+
+def excel_state(plans: Schedules, facts: Schedules) -> dict:
+    """
+    Состояние excel-расчёта по всем строкам; суммы состояния — копейки int64.
+    По плановым записям: day, amount, rem (остаток в FIFO), pre_total, carry,
+    remaining (остаток после платежей начиная с даты плана), has_post.
+    По строкам: offsets (CSR плановых записей), ptr (текущий план FIFO).
+    Куски за платежи после даты плана: term_plan (глобальный номер плана), term_base,
+    term_days — по порядку расчёта (платёж в дату плана — кусок с нулём дней).
+    """
+    plans, facts = plans.kopeks(), facts.kopeks()
+    n_plans = len(plans.amount)
+    a = allocate_fifo(plans, facts)
+    plan, applied = a["plan"], a["applied"]
+    p_day = plans.day.astype(np.int64)
+    f_day = facts.day.astype(np.int64)[a["fact"]]
+    idx_in_row = np.arange(n_plans) - np.repeat(plans.offsets[:-1], plans.counts)
+
+    # предоплаты идут в начале распределения каждого плана (факты по возрастанию дат)
+    pre = f_day < p_day[plan]
+    pre_total = np.zeros(n_plans, dtype=np.int64)
+    np.add.at(pre_total, plan[pre], applied[pre])
+    # последняя предоплата плана: следующее распределение — другой план или не предоплата
+    next_starts = np.append(_starts(plan)[1:], True)
+    last_pre = pre & (next_starts | ~np.append(pre[1:], False))
+    carry = np.zeros(n_plans, dtype=np.int64)
+    carry[plan[last_pre]] = applied[last_pre]
+    remaining0 = np.maximum(0, plans.amount - pre_total)
+
+    # события после даты плана: остаток перед событием и "первое" событие
+    post = ~pre
+    pp, pa, pd_ = plan[post], applied[post], f_day[post]
+    rem_before, remaining = _running_remaining(remaining0, pp, pa)
+    first = _starts(pp)
+    use_carry = first & (carry[pp] > 0) & (idx_in_row[pp] > 0)
+    base = np.where(use_carry, carry[pp], rem_before)
+    days = pd_ - p_day[pp]
+    has_post = np.zeros(n_plans, dtype=bool)
+    has_post[pp] = True
+
+    return {
+        "offsets": plans.offsets.copy(),
+        "day": p_day,
+        "amount": plans.amount.copy(),
+        "rem": a["rem"],
+        "ptr": a["ptr"],
+        "pre_total": pre_total,
+        "carry": carry,
+        "remaining": remaining,
+        "has_post": has_post,
+        "term_plan": pp,
+        "term_base": np.where(days > 0, base, 0),
+        "term_days": np.maximum(days, 0),
+    }
+
+
+def state_pieces(st: dict, today: int):
+    """
+    Куски начисления на дату today: (строка, base, days, since), base — копейки.
+    План за планом; внутри плана — платежи, затем хвост
+    (непогашенный остаток до today); начисление любого куска плана идёт со дня
+    после даты плана (since — дата плана).
+    """
+    offsets, day, amount = st["offsets"], st["day"], st["amount"]
+    rem_final = np.where(st["has_post"], st["remaining"], np.maximum(0, amount - st["pre_total"]))
+    tail = (amount > 0) & (rem_final > 0) & (day < today)
+    term_plan = np.concatenate((st["term_plan"], np.flatnonzero(tail)))
+    base = np.concatenate((st["term_base"], rem_final[tail]))
+    days = np.concatenate((st["term_days"], today - day[tail]))
+    order = np.argsort(term_plan, kind="stable")
+    term_plan = term_plan[order]
+    rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    return rows[term_plan], base[order], days[order], day[term_plan]
+
+
+def state_interest(st: dict, today: int, rate) -> np.ndarray:
+    """
+    Проценты по каждой строке состояния на дату today, копейки (interest_at).
+    rate — годовая ставка, RateCalendar или список из них (тогда результат формы (n, k)).
+    """
+    rows, base, days, since = state_pieces(st, today)
+    return interest_at(rows, base, days, since, len(st["offsets"]) - 1, rate)
+
+
+def excel_interest(plans: Schedules, facts: Schedules, today: int, rate) -> np.ndarray:
+    """
+    Проценты по каждой строке в копейках, today — номер дня.
+    Для каждой плановой строки:
+      - предоплаты (факт < даты плана) уменьшают остаток на дату плана;
+      - за каждый платёж с датой > даты плана: base * (дата платежа - дата плана) * rate/365,
+        где base — "хвост" последней предоплаты (carry) для первого такого события
+        начиная со 2-й плановой строки, иначе текущий остаток;
+      - непогашенный остаток > 0 — проценты до today.
+    Слагаемые строки складываются точно и округляются один раз (interest_at).
+    rate — годовая ставка, RateCalendar или список из них (результат формы (n, k)).
+    """
+    return state_interest(excel_state(plans, facts), today, rate)
+
+
+# ---------- Инкрементальный режим ----------
+# Отчёт строится каждый день по свежей выгрузке, а меняется в ней немногое.
+# Состояние excel_state сохраняется по ключу заказа вместе с отпечатками
+# графиков. На следующий день:
+#   - план не менялся, факты только дописаны в конец — FIFO продолжается
+#     с сохранённой позиции только по новым платежам (advance_state);
+#   - новых фактов нет — состояние берётся как есть, досчитываются хвосты до today;
+#   - план изменился или изменились уже учтённые факты — полный пересчёт строки.
+# Результат совпадает с полным пересчётом до последнего бита: сохраняются сами
+# куски начисления и остатки, а не готовые суммы. Ставка в состояние не входит —
+# её смена пересчёта не требует. Тем же способом (_continue_state) продолжается
+# FIFO отчёта президенту — overdue_fifo_incremental.
+
+STATE_VERSION = 3
+
+
+def schedule_hashes(sched: Schedules) -> np.ndarray:
+    """
+    Отпечатки префиксов графиков: для события k строки — хэш событий 0..k этой строки.
+    Хэш префикса длины m строки r: out[offsets[r] + m - 1] (для m = 0 — 0).
+    """
+    pos = np.arange(len(sched.day)) - np.repeat(sched.offsets[:-1], sched.counts)
+    h = pd.util.hash_array(sched.amount.view(np.uint64))
+    h = pd.util.hash_array(h ^ ((sched.day.astype(np.uint64) << np.uint64(32)) | pos.astype(np.uint64)))
+    cs = np.cumsum(h, dtype=np.uint64)
+    start = np.repeat(np.r_[np.uint64(0), cs][sched.offsets[:-1]], sched.counts)
+    return cs - start
+
+
+def _prefix_hash(sched: Schedules, hashes: np.ndarray, m: np.ndarray) -> np.ndarray:
+    # хэш первых m событий каждой строки (m <= длины строки)
+    idx = sched.offsets[:-1] + m - 1
+    return np.where(m > 0, hashes[np.maximum(idx, 0)] if len(hashes) else 0, 0).astype(np.uint64)
+
+
+def _take_state(st: dict, rows) -> dict:
+    # состояние выбранных строк (в заданном порядке)
+    rows = np.asarray(rows, dtype=np.int64)
+    counts = np.diff(st["offsets"])[rows]
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    idx = np.repeat(st["offsets"][rows] - offsets[:-1], counts) + np.arange(offsets[-1])
+    # новые номера плановых записей для post-слагаемых выбранных строк
+    new_pos = np.full(len(st["day"]), -1, dtype=np.int64)
+    new_pos[idx] = np.arange(len(idx))
+    keep = new_pos[st["term_plan"]] >= 0
+    out = {k: st[k][idx] for k in ("day", "amount", "rem", "pre_total", "carry", "remaining", "has_post")}
+    out.update({
+        "offsets": offsets,
+        "ptr": st["ptr"][rows],
+        "term_plan": new_pos[st["term_plan"][keep]],
+        "term_base": st["term_base"][keep],
+        "term_days": st["term_days"][keep],
+    })
+    return out
+
+
+def _concat_states(parts) -> dict:
+    # состояния частей подряд: строки и плановые записи нумеруются заново
+    offsets, term_plan = [np.zeros(1, dtype=np.int64)], []
+    shift = 0
+    for p in parts:
+        offsets.append(p["offsets"][1:] + shift)
+        term_plan.append(p["term_plan"] + shift)
+        shift += p["offsets"][-1]
+    out = {"offsets": np.concatenate(offsets), "term_plan": np.concatenate(term_plan)}
+    for k in ("day", "amount", "rem", "pre_total", "carry", "remaining", "has_post", "ptr",
+              "term_base", "term_days"):
+        out[k] = np.concatenate([p[k] for p in parts])
+    return out
+
+
+def advance_state(st: dict, rows, facts: Schedules, start, stop=None) -> None:
+    """
+    Дописывает в состояние новые факты строк rows (на месте).
+    facts — графики фактов тех же строк состояния, start[k] — сколько фактов строки rows[k]
+    уже учтено в состоянии, stop[k] — до какого факта дописывать (по умолчанию — все).
+    Арифметика та же, что в allocate_fifo/excel_state (копейки).
+    """
+    facts = facts.kopeks()
+    offsets = st["offsets"].tolist()
+    day, amount = st["day"].tolist(), st["amount"].tolist()
+    rem, pre_total, carry = st["rem"].tolist(), st["pre_total"].tolist(), st["carry"].tolist()
+    remaining, has_post = st["remaining"].tolist(), st["has_post"].tolist()
+    ptr = st["ptr"].tolist()
+    new_plan, new_base, new_days = [], [], []
+    rows = np.asarray(rows, dtype=np.int64)
+    stop = facts.counts[rows] if stop is None else np.asarray(stop)
+    for r, m, e in zip(rows.tolist(), np.asarray(start).tolist(), stop.tolist()):
+        base_i, end = offsets[r], offsets[r + 1]
+        i = base_i + ptr[r]
+        f_day, f_amt = facts[r]
+        for fd, amt in zip(f_day[m:e].tolist(), f_amt[m:e].tolist()):
+            while amt > 0 and i < end:
+                if rem[i] <= 0:
+                    i += 1
+                    continue
+                applied = min(rem[i], amt)
+                if fd < day[i]:
+                    # предоплата: план ещё не получал платежей после своей даты
+                    pre_total[i] += applied
+                    carry[i] = applied
+                else:
+                    first = not has_post[i]
+                    if first:
+                        remaining[i] = max(0, amount[i] - pre_total[i])
+                        has_post[i] = True
+                    days = fd - day[i]
+                    use_carry = first and carry[i] > 0 and i > base_i
+                    base = carry[i] if use_carry else remaining[i]
+                    new_plan.append(i)
+                    new_base.append(base if days > 0 else 0)
+                    new_days.append(max(days, 0))
+                    remaining[i] -= applied
+                rem[i] -= applied
+                amt -= applied
+                if rem[i] <= 0:
+                    i += 1
+        ptr[r] = i - base_i
+    st.update({
+        "rem": np.array(rem, dtype=np.int64), "pre_total": np.array(pre_total, dtype=np.int64),
+        "carry": np.array(carry, dtype=np.int64), "remaining": np.array(remaining, dtype=np.int64),
+        "has_post": np.array(has_post, dtype=bool),
+        "ptr": np.array(ptr, dtype=np.int64),
+    })
+    # новые слагаемые встают после прежних слагаемых того же плана
+    term_plan = np.concatenate((st["term_plan"], np.array(new_plan, dtype=np.int64)))
+    order = np.argsort(term_plan, kind="stable")
+    st["term_plan"] = term_plan[order]
+    st["term_base"] = np.concatenate((st["term_base"], np.array(new_base, dtype=np.int64)))[order]
+    st["term_days"] = np.concatenate((st["term_days"], np.array(new_days, dtype=np.int64)))[order]
+
+
+def load_state(path):
+    """Сохранённое состояние или None (нет файла, другой формат)."""
+    try:
+        saved = pd.read_pickle(path)
+    except (OSError, ValueError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+    if not isinstance(saved, dict) or saved.get("version") != STATE_VERSION:
+        return None
+    return saved
+
+
+def save_state(path, saved: dict) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    pd.to_pickle(dict(saved, version=STATE_VERSION), tmp)
+    os.replace(tmp, path)
+
+
+def _continue_state(keys, plans: Schedules, facts: Schedules, path, build, take, concat, advance):
+    """
+    Состояние по всем строкам с продолжением из файла path (общая часть инкрементальных
+    расчётов). Строка продолжается из сохранённого состояния, только если совпадают
+    ключ, весь план и уже учтённые факты; иначе — build по строке заново.
+    build(plans, facts) -> состояние; take(st, rows) — строки состояния; concat(parts) —
+    состояния подряд; advance(st, rows, facts, start) — дописать факты с номера start.
+    Возвращает (состояние в порядке строк, dict со счётчиками строк: full / advanced / reused).
+    """
+    keys = pd.Index(np.asarray(keys, dtype=object))
+    n = len(plans)
+    p_hash = schedule_hashes(plans)
+    f_hash = schedule_hashes(facts)
+    plan_fp = _prefix_hash(plans, p_hash, plans.counts)
+    fact_counts = facts.counts
+
+    prev = load_state(path)
+    src = np.full(n, -1, dtype=np.int64)
+    if prev is not None and not keys.has_duplicates:
+        src = pd.Index(prev["keys"]).get_indexer(keys)
+        ok = src >= 0
+        s = np.maximum(src, 0)
+        seen = prev["n_facts"][s]
+        ok &= prev["plan_fp"][s] == plan_fp
+        ok &= seen <= fact_counts
+        ok &= prev["fact_fp"][s] == _prefix_hash(facts, f_hash, np.minimum(seen, fact_counts))
+        src = np.where(ok, src, -1)
+
+    cont = np.flatnonzero(src >= 0)
+    full = np.flatnonzero(src < 0)
+    parts, order = [], []
+    if len(cont):
+        st_c = take(prev["state"], src[cont])
+        seen = prev["n_facts"][src[cont]]
+        adv = np.flatnonzero(seen < fact_counts[cont])
+        if len(adv):
+            advance(st_c, adv, facts.take(cont), seen[adv])
+        parts.append(st_c)
+        order.append(cont)
+    else:
+        adv = np.zeros(0, dtype=np.int64)
+    if len(full):
+        parts.append(build(plans.take(full), facts.take(full)))
+        order.append(full)
+
+    if parts:
+        st = concat(parts)
+        rows = np.concatenate(order)
+    else:
+        st = build(plans, facts)
+        rows = np.arange(n)
+    # вернуть строки в исходный порядок
+    inv = np.empty(n, dtype=np.int64)
+    inv[rows] = np.arange(n)
+    st = take(st, inv)
+
+    save_state(path, {
+        "keys": np.asarray(keys, dtype=object),
+        "plan_fp": plan_fp,
+        "n_facts": fact_counts,
+        "fact_fp": _prefix_hash(facts, f_hash, fact_counts),
+        "state": st,
+    })
+    return st, {"full": len(full), "advanced": len(adv), "reused": len(cont) - len(adv)}
+
+
+def excel_interest_incremental(keys, plans: Schedules, facts: Schedules, today: int, rate, path):
+    """
+    То же, что excel_interest, но с сохранённым состоянием в файле path.
+    keys — ключ каждой строки (например, номер заказа); строка продолжается из состояния,
+    только если совпадают ключ, весь план и уже учтённые факты.
+    Возвращает (проценты по строкам, dict со счётчиками строк: full / advanced / reused).
+    """
+    plans, facts = plans.kopeks(), facts.kopeks()
+    st, stats = _continue_state(keys, plans, facts, path, excel_state, _take_state, _concat_states,
+                                advance_state)
+    return state_interest(st, today, rate), stats
+
+
+# ---------- Задача президенту: дни просрочки и проценты ----------
+# FIFO отчёта президенту — money.fifo_allocate (план с суммой <= 0 пропускается,
+# пороги — строго 0) с одним отличием: отрицательный факт не пропускается, а
+# увеличивает остаток плана, до которого дошла очередь (так считал построчный
+# расчёт). Такой факт удлиняет этот план на оси накопленных сумм, поэтому сначала
+# находится его план, а потом распределяются положительные факты по удлинённым
+# планам. Каждый план просматривает факты строки с начала графика: уже погашенные
+# гасят 0, но если они позже даты плана, их дни всё равно прибавляются к дням
+# просрочки. Поэтому дни плана = сумма (дата факта - дата плана, если > 0) по всем
+# просмотренным им фактам — от начала графика строки до последнего, который он
+# гасил, — плюс хвост до today. Всё — массивами по всем строкам.
+
+def _before_in_row(values, offsets) -> np.ndarray:
+    # сумма предыдущих значений той же строки (CSR offsets), точно для int64
+    cum = np.concatenate(([0], np.cumsum(values)))
+    return cum[:-1] - np.repeat(cum[offsets[:-1]], np.diff(offsets))
+
+
+def _overdue_events(plans: Schedules, facts: Schedules):
+    """
+    FIFO отчёта президенту (суммы — копейки). Возвращает события распределения
+    ev_plan, ev_fact, ev_applied (глобальные номера; по планам, внутри — по фактам;
+    отрицательный факт — событие с отрицательной суммой) и rem — остаток каждого
+    плана (0 у планов с суммой <= 0).
+    """
+    p_amt = np.maximum(plans.amount, 0)
+    f_amt = facts.amount
+    n_plans = len(p_amt)
+    p_end = np.cumsum(p_amt)
+    row_base = np.concatenate(([0], p_end))[plans.offsets[:-1]]
+    total = np.concatenate(([0], p_end))[plans.offsets[1:]] - row_base
+
+    # отрицательные факты: очередь на факте j — первый план строки, чей конец на
+    # оси (с удлинениями от прежних отрицательных фактов) больше оплаченного до j
+    neg = np.flatnonzero(f_amt < 0)
+    g = facts.row_ids()[neg]
+    x = (_before_in_row(np.maximum(f_amt, 0), facts.offsets)[neg]
+         - _before_in_row(np.maximum(-f_amt, 0), facts.offsets)[neg])
+    # все планы строки погашены — факт не доходит ни до какого плана, как и все после него
+    closed = x >= total[g]
+    if len(neg):
+        first = _starts(g)
+        c = np.cumsum(closed)
+        closed = c - (c - closed)[first][np.cumsum(first) - 1] > 0
+    neg, g, x = neg[~closed], g[~closed], x[~closed]
+    # очередь не идёт назад: планы до текущего уже закрыты
+    neg_plan = np.maximum.accumulate(np.searchsorted(p_end, row_base[g] + np.maximum(x, 0), side="right"))
+    longer = p_amt + np.bincount(neg_plan, weights=-f_amt[neg], minlength=n_plans).astype(np.int64)
+
+    a = fifo_allocate(Schedules(plans.offsets, plans.day, longer),
+                      Schedules(facts.offsets, facts.day, np.maximum(f_amt, 0)))
+    ev_plan = np.concatenate((a["plan"], neg_plan))
+    ev_fact = np.concatenate((a["fact"], neg))
+    order = np.lexsort((ev_fact, ev_plan))
+    ev_applied = np.concatenate((a["applied"], f_amt[neg]))[order]
+    return ev_plan[order], ev_fact[order], ev_applied, np.where(plans.amount > 0, a["rem"], 0)
+
+
+def _overdue_pairs(plans: Schedules, facts: Schedules, ev_plan, ev_fact, ev_applied, rem) -> dict:
+    """
+    События _overdue_events плюс active (план с суммой > 0) и пары (план, просмотренный
+    факт) pair_plan, pair_fact с днями просрочки late (дата факта - дата плана, если > 0).
+    """
+    n_plans = len(plans.amount)
+    # план с остатком просматривает все факты строки, погашенный — до последнего своего
+    active = plans.amount > 0
+    p_row = plans.row_ids()
+    seen = facts.offsets[1:][p_row].copy()
+    done = active & (rem <= 0)
+    last = np.full(n_plans, -1, dtype=np.int64)
+    np.maximum.at(last, ev_plan, ev_fact)
+    seen[done] = last[done] + 1
+
+    p_day = plans.day.astype(np.int64)
+    f_day = facts.day.astype(np.int64)
+    first = facts.offsets[:-1][p_row]
+    cnt = np.where(active, seen - first, 0)
+    pair_plan = np.repeat(np.arange(n_plans), cnt)
+    pair_fact = np.repeat(first - (np.cumsum(cnt) - cnt), cnt) + np.arange(cnt.sum())
+    return {
+        "ev_plan": ev_plan,
+        "ev_fact": ev_fact,
+        "ev_applied": ev_applied,
+        "rem": rem,
+        "active": active,
+        "pair_plan": pair_plan,
+        "pair_fact": pair_fact,
+        "late": np.maximum(f_day[pair_fact] - p_day[pair_plan], 0),
+    }
+
+
+def _overdue_alloc(plans: Schedules, facts: Schedules) -> dict:
+    # распределение и просмотренные пары отчёта президенту
+    return _overdue_pairs(plans, facts, *_overdue_events(plans, facts))
+
+
+def overdue_fifo(plans: Schedules, facts: Schedules, today: int) -> dict:
+    """
+    Дни просрочки и куски начисления процентов по всем строкам за один проход FIFO.
+    Графики — по дате, затем по сумме. Возвращает:
+      overdue_days — int64 (n,), сумма дней просрочки строки;
+      rows, base, days, since — куски (оплачено с опозданием; не оплачено к today)
+      в порядке построчного расчёта, для interest_at (base — копейки).
+    """
+    plans, facts = plans.kopeks(), facts.kopeks()
+    return _overdue_at(plans, facts, _overdue_alloc(plans, facts), today)
+
+
+def _overdue_at(plans: Schedules, facts: Schedules, a: dict, today: int) -> dict:
+    # дни просрочки и куски на дату today по распределению a (_overdue_alloc)
+    p_day = plans.day.astype(np.int64)
+    f_day = facts.day.astype(np.int64)
+    p_row = plans.row_ids()
+    rem = a["rem"]
+    n = len(plans)
+
+    # дни: все просмотренные факты + хвост до today
+    tail = a["active"] & (rem > 0) & (p_day < today)
+    overdue_days = (np.bincount(p_row[a["pair_plan"]], weights=a["late"], minlength=n)
+                    + np.bincount(p_row[tail], weights=today - p_day[tail], minlength=n)).astype(np.int64)
+
+    # куски: платежи позже даты плана, затем хвост плана (по порядку планов)
+    ev_plan, ev_applied = a["ev_plan"], a["ev_applied"]
+    ev_days = f_day[a["ev_fact"]] - p_day[ev_plan]
+    is_late = ev_days > 0
+    tail_plan = np.flatnonzero(tail)
+    plan = np.concatenate((ev_plan[is_late], tail_plan))
+    order = np.argsort(plan * 2 + np.repeat([0, 1], [is_late.sum(), len(tail_plan)]), kind="stable")
+    plan = plan[order]
+    return {
+        "overdue_days": overdue_days,
+        "rows": p_row[plan],
+        "base": np.concatenate((ev_applied[is_late], rem[tail_plan]))[order],
+        "days": np.concatenate((ev_days[is_late], today - p_day[tail_plan]))[order],
+        "since": p_day[plan],
+    }
+
+
+def overdue_as_of(plans: Schedules, facts: Schedules, days) -> dict:
+    """
+    overdue_fifo на каждую дату days — как если бы отчёт строился в день D
+    (известны факты с датой <= D). FIFO проходит все факты один раз: факты строки
+    отсортированы по дате, поэтому распределение на D — начало общего распределения,
+    а дни просрочки, оплаченная часть плана и куски на любую дату — ступенчатые
+    функции по дате факта (schedules.cumulative_at), все даты — сразу.
+    Возвращает overdue_days (n, k) и куски rows, base, days, since, где rows — номер
+    пары строка * k + номер даты (для interest_at(..., n * k, ...)).
+    """
+    plans, facts = plans.kopeks(), facts.kopeks()
+    a = _overdue_alloc(plans, facts)
+    days = np.asarray(days, dtype=np.int64)
+    n, k = len(plans), len(days)
+    p_day = plans.day.astype(np.int64)
+    f_day = facts.day.astype(np.int64)
+    p_row = plans.row_ids()
+    ev_plan, ev_fact, ev_applied = a["ev_plan"], a["ev_fact"], a["ev_applied"]
+
+    # дни: просмотренные факты с датой <= D + хвост до D
+    late_at = cumulative_at(p_row[a["pair_plan"]], f_day[a["pair_fact"]], a["late"], n, days)
+    paid_at = cumulative_at(ev_plan, f_day[ev_fact], ev_applied, len(p_day), days)
+    rem = np.where(a["active"][:, None], plans.amount[:, None] - paid_at, 0)
+    tp, tj = np.nonzero((rem > 0) & (p_day[:, None] < days[None, :]))
+    tail_days = days[tj] - p_day[tp]
+    overdue_days = late_at + np.bincount(p_row[tp] * k + tj, weights=tail_days,
+                                         minlength=n * k).astype(np.int64).reshape(n, k)
+
+    # куски на дату D: платежи с датой <= D позже даты плана, затем хвост плана
+    ev_days = f_day[ev_fact] - p_day[ev_plan]
+    late_ev = np.flatnonzero(ev_days > 0)
+    le, lj = np.nonzero(f_day[ev_fact[late_ev], None] <= days[None, :])
+    ev = late_ev[le]
+    plan = np.concatenate((ev_plan[ev], tp))
+    jj = np.concatenate((lj, tj))
+    order = np.lexsort((np.concatenate((ev, np.zeros(len(tp), dtype=np.int64))),
+                        np.repeat([0, 1], [len(ev), len(tp)]), plan, jj))
+    plan, jj = plan[order], jj[order]
+    return {
+        "overdue_days": overdue_days,
+        "rows": p_row[plan] * k + jj,
+        "base": np.concatenate((ev_applied[ev], rem[tp, tj]))[order],
+        "days": np.concatenate((ev_days[ev], tail_days))[order],
+        "since": p_day[plan],
+    }
+
+
+# ---------- Задача президенту: инкрементальный режим ----------
+# Как у excel-логики (_continue_state): по ключу строки сохраняются остатки планов
+# и события распределения FIFO. На следующий день FIFO строки продолжается с
+# сохранённых остатков только по новым фактам (advance_overdue_state); строки с
+# изменённым планом или уже учтёнными фактами считаются заново. Дни просрочки и
+# куски процентов на today строятся из событий (_overdue_pairs, _overdue_at) —
+# результат тот же, что у overdue_fifo.
+
+def _csr_take(offsets, rows):
+    # (новые offsets, номера элементов) строк rows CSR offsets, в заданном порядке
+    rows = np.asarray(rows, dtype=np.int64)
+    counts = np.diff(offsets)[rows]
+    new = np.concatenate(([0], np.cumsum(counts)))
+    return new, np.repeat(offsets[rows] - new[:-1], counts) + np.arange(new[-1])
+
+
+def overdue_state(plans: Schedules, facts: Schedules) -> dict:
+    """
+    Состояние FIFO отчёта президенту: offsets (CSR планов), rem — остаток каждого плана;
+    события распределения по строкам (CSR ev_offsets): ev_plan, ev_fact — номера плана
+    и факта внутри строки, ev_applied — копейки.
+    """
+    plans, facts = plans.kopeks(), facts.kopeks()
+    ev_plan, ev_fact, ev_applied, rem = _overdue_events(plans, facts)
+    rows = plans.row_ids()[ev_plan]
+    return {
+        "offsets": plans.offsets.copy(),
+        "rem": rem,
+        "ev_offsets": np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=len(plans))))),
+        "ev_plan": ev_plan - plans.offsets[rows],
+        "ev_fact": ev_fact - facts.offsets[rows],
+        "ev_applied": ev_applied,
+    }
+
+
+def _take_overdue_state(st: dict, rows) -> dict:
+    # состояние выбранных строк (в заданном порядке)
+    offsets, idx = _csr_take(st["offsets"], rows)
+    ev_offsets, ev_idx = _csr_take(st["ev_offsets"], rows)
+    out = {k: st[k][ev_idx] for k in ("ev_plan", "ev_fact", "ev_applied")}
+    out.update({"offsets": offsets, "rem": st["rem"][idx], "ev_offsets": ev_offsets})
+    return out
+
+
+def _concat_overdue_states(parts) -> dict:
+    # состояния частей подряд (номера внутри строк не меняются)
+    out = {k: np.concatenate([p[k] for p in parts]) for k in ("rem", "ev_plan", "ev_fact", "ev_applied")}
+    for k in ("offsets", "ev_offsets"):
+        out[k] = np.concatenate(([0], np.cumsum(np.concatenate([np.diff(p[k]) for p in parts]))))
+    return out
+
+
+def advance_overdue_state(st: dict, rows, facts: Schedules, start) -> None:
+    """
+    Дописывает в состояние отчёта президенту факты строк rows начиная с start[k]
+    (на месте); facts — графики фактов тех же строк состояния. FIFO продолжается
+    с сохранённых остатков: они — планы для _overdue_events по новым фактам.
+    """
+    facts = facts.kopeks()
+    rows = np.asarray(rows, dtype=np.int64)
+    start = np.asarray(start, dtype=np.int64)
+    p_off, p_idx = _csr_take(st["offsets"], rows)
+    counts = facts.counts[rows] - start
+    f_off = np.concatenate(([0], np.cumsum(counts)))
+    f_idx = np.repeat(facts.offsets[rows] + start - f_off[:-1], counts) + np.arange(f_off[-1])
+    left = Schedules(p_off, np.zeros(len(p_idx)), st["rem"][p_idx])
+    ev_plan, ev_fact, ev_applied, rem = _overdue_events(
+        left, Schedules(f_off, facts.day[f_idx], facts.amount[f_idx]))
+    st["rem"][p_idx] = rem
+    # прежние и новые события — по строке, плану, факту
+    k = left.row_ids()[ev_plan]
+    n = len(st["ev_offsets"]) - 1
+    ev_row = np.concatenate((np.repeat(np.arange(n), np.diff(st["ev_offsets"])), rows[k]))
+    ev_p = np.concatenate((st["ev_plan"], ev_plan - p_off[k]))
+    ev_f = np.concatenate((st["ev_fact"], ev_fact - f_off[k] + start[k]))
+    order = np.lexsort((ev_f, ev_p, ev_row))
+    st.update({
+        "ev_offsets": np.concatenate(([0], np.cumsum(np.bincount(ev_row, minlength=n)))),
+        "ev_plan": ev_p[order],
+        "ev_fact": ev_f[order],
+        "ev_applied": np.concatenate((st["ev_applied"], ev_applied))[order],
+    })
+
+
+def overdue_fifo_incremental(keys, plans: Schedules, facts: Schedules, today: int, path):
+    """
+    То же, что overdue_fifo, но с сохранённым состоянием FIFO в файле path.
+    keys — ключ каждой строки; строка продолжается из состояния, только если совпадают
+    ключ, весь план и уже учтённые факты.
+    Возвращает (результат overdue_fifo, dict со счётчиками строк: full / advanced / reused).
+    """
+    plans, facts = plans.kopeks(), facts.kopeks()
+    st, stats = _continue_state(keys, plans, facts, path, overdue_state, _take_overdue_state,
+                                _concat_overdue_states, advance_overdue_state)
+    rows = np.repeat(np.arange(len(plans)), np.diff(st["ev_offsets"]))
+    a = _overdue_pairs(plans, facts, plans.offsets[rows] + st["ev_plan"], facts.offsets[rows] + st["ev_fact"],
+                       st["ev_applied"], st["rem"])
+    return _overdue_at(plans, facts, a, today), stats
+
+
+# ---------- Оценка на несколько дат ----------
+# "На дату D" — как если бы отчёт строился в день D: известны только оплаты
+# с датой <= D, хвосты начисляются до D. Факты в строке отсортированы по дате,
+# поэтому известные на D факты — начало графика строки, и при переходе к
+# следующей дате состояние FIFO не пересчитывается, а дописывается новыми
+# фактами (advance_state): весь набор дат — один проход по фактам.
+
+def excel_interest_as_of(plans: Schedules, facts: Schedules, days, rate) -> np.ndarray:
+    """
+    excel_interest на каждую дату days (номера дней, в любом порядке).
+    rate — годовая ставка или RateCalendar. Результат — копейки формы (n, len(days)).
+    Столбец для даты D совпадает с excel_interest(plans, facts.head(facts.count_until(D)), D).
+    """
+    plans, facts = plans.kopeks(), facts.kopeks()
+    days = np.asarray(days, dtype=np.int64)
+    out = np.zeros((len(plans), len(days)), dtype=np.int64)
+    st, seen = None, None
+    for j in np.argsort(days, kind="stable"):
+        d = int(days[j])
+        known = facts.count_until(d)
+        if st is None:
+            st = excel_state(plans, facts.head(known))
+        else:
+            adv = np.flatnonzero(known > seen)
+            advance_state(st, adv, facts, seen[adv], known[adv])
+        seen = known
+        out[:, j] = state_interest(st, d, rate)
+    return out
+
+
+# ---------- Коммерческий кредит (юр. отдел) ----------
+# Правила те же, что были в построчном расчёте скрипта юр. отдела:
+#   - оплаты распределяются FIFO по УПД в порядке дат отгрузки; УПД с одинаковым
+#     номером в строке — один "слот" (общий список оплат, сумма — последнего по дате);
+#   - оплаты до или в день отгрузки — предоплата, процентов не дают;
+#   - дальше за каждый период base * daily_rate * дни, период — от дня после
+#     предыдущего среза до даты оплаты; вторая оплата в ту же дату пропускается;
+#   - непогашенный остаток — проценты до today;
+#   - если сумма всех оплат строки >= сумме отгрузок, КК строки = 0, а детализация
+#     заменяется нулевыми записями по каждому УПД.
+# Распределение — money.fifo_allocate по слотам; предоплата, пропуск оплат в ту же
+# дату и остатки (копейки, остаток <= 0 — погашено) — масками и накопленными суммами
+# по парам (УПД, распределение его слота), как в excel_state: без цикла по УПД.
+
+CC_DAILY_RATE = 0.003    # 0.3% в день, если ставка строки не задана
+
+
+def _cc_slots(upds: Schedules):
+    """
+    Слоты FIFO: уникальные (строка, номер УПД) в порядке дат отгрузки.
+    Возвращает (слот каждого УПД, сумма слота, offsets слотов по строкам).
+    """
+    rows = upds.row_ids()
+    order = np.lexsort((upds.day, rows))           # по строке, затем по дате (устойчиво)
+    slot_sorted = pd.DataFrame({"r": rows[order], "d": upds.doc[order]}).groupby(
+        ["r", "d"], sort=False).ngroup().to_numpy()
+    n_slots = int(slot_sorted.max()) + 1 if len(slot_sorted) else 0
+    slot = np.empty(len(rows), dtype=np.int64)
+    slot[order] = slot_sorted
+    # сумма слота — у последнего по дате УПД с этим номером (как в словаре по номерам)
+    _, last_rev = np.unique(slot_sorted[::-1], return_index=True)
+    amount = upds.amount[order][len(order) - 1 - last_rev]
+    first = np.unique(slot_sorted, return_index=True)[1]
+    slot_rows = rows[order][first]
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(slot_rows, minlength=len(upds)))))
+    return slot, amount, offsets, n_slots
+
+
+def cc_allocate(upds: Schedules, pays: Schedules):
+    """
+    FIFO-распределение оплат по слотам УПД для всех строк сразу (money.fifo_allocate):
+    оплата гасит слоты по порядку, пока не кончится; слоты с остатком <= 0
+    и неположительные оплаты пропускаются.
+    Возвращает (слот каждого УПД, dict массивов slot / day / amount, отсортированных
+    по (слот, дата оплаты)).
+    """
+    slot, amount, s_off, n_slots = _cc_slots(upds)
+    p_order = np.lexsort((pays.day, pays.row_ids()))      # оплаты по датам (устойчиво)
+    p_day = pays.day[p_order]
+    a = fifo_allocate(Schedules(s_off, np.zeros(n_slots), amount),
+                      Schedules(pays.offsets, p_day, pays.amount[p_order]))
+    return slot, {
+        "slot": a["plan"],
+        "day": p_day[a["fact"]].astype(np.int64),
+        "amount": a["applied"],
+        "n_slots": n_slots,
+    }
+
+
+def _cc_periods(upds: Schedules, slot, alloc, today: int):
+    """
+    Периоды начисления по каждому УПД (в порядке УПД, внутри — по времени):
+    upd, base (остаток, копейки), start, end (номера дней), days.
+    УПД, погашенный предоплатой, даёт запись с base 0 на дату отгрузки;
+    УПД, отгруженный сегодня, — запись с текущим остатком на следующий день.
+    Каждый УПД проходит распределения своего слота: пары (УПД, распределение)
+    развёрнуты в плоские массивы, остатки — накопленными суммами внутри УПД.
+    """
+    n_upd = len(upds.amount)
+    d0 = upds.day.astype(np.int64)
+    amount = upds.amount
+    counts = np.bincount(alloc["slot"], minlength=alloc["n_slots"])
+    a_off = np.concatenate(([0], np.cumsum(counts)))
+    m = counts[slot]
+    pair_off = np.concatenate(([0], np.cumsum(m)))
+    upd = np.repeat(np.arange(n_upd), m)
+    k = np.repeat(a_off[slot] - pair_off[:-1], m) + np.arange(pair_off[-1])
+    day, amt = alloc["day"][k], alloc["amount"][k]
+
+    # 1) предоплата: оплаты до или в день отгрузки (идут первыми — оплаты по датам)
+    pre = day <= d0[upd]
+    pre_sum = np.zeros(n_upd, dtype=np.int64)
+    np.add.at(pre_sum, upd[pre], amt[pre])
+    has_pre = np.bincount(upd[pre], minlength=n_upd) > 0
+    remaining = np.where(has_pre, np.maximum(0, amount - pre_sum), amount)
+    paid_pre = remaining == 0
+    # 2) отгружен сегодня или позже — проценты ещё не идут
+    not_yet = ~paid_pre & (d0 + 1 > today)
+    accrue = (remaining > 0) & ~not_yet
+
+    # 3) оплаты после отгрузки: первая оплата каждой даты; вторая в ту же дату пропускается
+    first = _starts(upd)
+    used = ~pre & (first | (day != np.append(-1, day[:-1])[:len(day)]))
+    used &= accrue[upd]
+    u_upd, u_day, u_amt = upd[used], day[used], amt[used]
+    u_first = _starts(u_upd)
+    base = remaining[u_upd] - _before_in_row(u_amt, np.concatenate(([0], np.cumsum(
+        np.bincount(u_upd, minlength=n_upd)))))
+    prev_day = np.where(u_first, d0[u_upd], np.append(-1, u_day[:-1])[:len(u_day)])
+    # остаток <= 0 — УПД погашен, дальше периодов нет
+    live = base > 0
+    p_upd, p_base, p_start, p_end = u_upd[live], base[live], prev_day[live] + 1, u_day[live]
+
+    # 4) остаток — до today
+    paid_post = np.zeros(n_upd, dtype=np.int64)
+    np.add.at(paid_post, u_upd, u_amt)
+    final = remaining - paid_post
+    last_day = d0.copy()                          # последняя использованная дата УПД
+    u_last = np.append(u_first[1:], True)[:len(u_first)]
+    last_day[u_upd[u_last]] = u_day[u_last]
+    tail = np.flatnonzero(accrue & (final > 0) & (last_day < today))
+
+    # заглушки: погашен предоплатой (дата отгрузки), отгружен сегодня (следующий день)
+    stub = np.flatnonzero(paid_pre | not_yet)
+    stub_day = np.where(paid_pre[stub], d0[stub], d0[stub] + 1)
+    rec_upd = np.concatenate((stub, p_upd, tail))
+    kind = np.repeat([0, 0, 1], [len(stub), len(p_upd), len(tail)])
+    order = np.lexsort((kind, rec_upd))
+    start = np.concatenate((stub_day, p_start, last_day[tail] + 1))[order]
+    end = np.concatenate((stub_day, p_end, np.full(len(tail), today, dtype=np.int64)))[order]
+    days = np.concatenate((np.zeros(len(stub), dtype=np.int64), p_end - p_start + 1,
+                           today - last_day[tail]))[order]
+    return {
+        "upd": rec_upd[order],
+        "base": np.concatenate((np.where(paid_pre[stub], 0, remaining[stub]), p_base, final[tail]))[order],
+        "start": start,
+        "end": end,
+        "days": days,
+    }
+
+
+def commercial_credit(upds: Schedules, pays: Schedules, daily_rate, today: int):
+    """
+    Коммерческий кредит по всем строкам.
+    upds — УПД (с номерами документов), pays — оплаты; события в порядке ячеек.
+    daily_rate — дневная ставка каждой строки (n,), k ставок строки (n, k), или список
+    вариантов, каждый — число, массив по строкам или RateCalendar (для дневных ставок
+    basis=1); today — номер дня.
+    Возвращает (КК по строкам, округлённый до копеек, формы (n,) или (n, k); dict детализации по
+    записям: row, doc_number, base, start, end, days, interest). Детализация уже
+    упорядочена как в отчёте: по строке, номеру УПД и дате начала (устойчиво);
+    interest в ней — по первой ставке.
+    """
+    upds, pays = upds.kopeks(), pays.kopeks()
+    n = len(upds)
+    u_rows = upds.row_ids()
+    slot, alloc = cc_allocate(upds, pays)
+    per = _cc_periods(upds, slot, alloc, today)
+    rec_row = u_rows[per["upd"]]
+    m = len(rec_row)
+    since = per["start"] - 1
+    columns, single = _cc_rate_columns(daily_rate)
+    # сумма дневных ставок за дни каждой записи (записи-заглушки — 0 дней), столбец на ставку
+    rd = [rate_days(r if isinstance(r, RateCalendar) else np.broadcast_to(r, (n,))[rec_row],
+                    per["days"], since, basis=1) for r in columns]
+
+    # КК строки — точная сумма всех записей её УПД и одно округление до копейки
+    # (построчный расчёт округлял КК каждого УПД, а потом их сумму — здесь округление одно);
+    # процент записи детализации — так же, одним округлением записи
+    if columns:
+        total = np.column_stack([interest_kopeks(rec_row, per["base"], d, n, basis) for d, basis in rd])
+        interest = interest_kopeks(np.arange(m), per["base"], rd[0][0], m, rd[0][1])
+    else:
+        total, interest = np.zeros((n, 0), dtype=np.int64), np.zeros(m, dtype=np.int64)
+
+    # всё оплачено — КК 0, детализация — нулевые записи по УПД
+    paid = pays.totals() >= upds.totals()
+    total[paid] = 0
+    keep = ~paid[rec_row]
+    zero_upd = np.flatnonzero(paid[u_rows])
+    rec_upd = np.concatenate((per["upd"][keep], zero_upd))
+    zero_day = upds.day[zero_upd].astype(np.int64)
+    start = np.concatenate((per["start"][keep], zero_day))
+    # порядок отчёта: строка, номер УПД, дата начала; при равенстве — порядок расчёта
+    _, doc_rank = np.unique(upds.doc[rec_upd], return_inverse=True)
+    order = np.lexsort((start, doc_rank.ravel(), u_rows[rec_upd]))
+    rec_upd = rec_upd[order]
+    details = {
+        "row": u_rows[rec_upd],
+        "doc_number": upds.doc[rec_upd],
+        "base": from_kopeks(np.concatenate((per["base"][keep], np.zeros(len(zero_upd), dtype=np.int64)))[order]),
+        "start": start[order],
+        "end": np.concatenate((per["end"][keep], zero_day))[order],
+        "days": np.concatenate((per["days"][keep], np.zeros(len(zero_upd), dtype=np.int64)))[order],
+        "interest": from_kopeks(np.concatenate((interest[keep], np.zeros(len(zero_upd), dtype=np.int64)))[order]),
+    }
+    total = from_kopeks(total)
+    return (total[:, 0] if single else total), details
+
+
+def _cc_rate_columns(daily_rate):
+    # варианты ставки КК списком столбцов; single — результат одним столбцом (n,)
+    if isinstance(daily_rate, (list, tuple)):
+        return list(daily_rate), False
+    if isinstance(daily_rate, RateCalendar):
+        return [daily_rate], True
+    r = np.asarray(daily_rate, dtype=np.float64)
+    if r.ndim == 2:
+        return [r[:, j] for j in range(r.shape[1])], False
+    return [r], True
+
+
+def iter_commercial_credit(upds: Schedules, pays: Schedules, daily_rate, today: int, batch_upds=50_000,
+                           workers=1):
+    """
+    commercial_credit по пачкам строк (примерно batch_upds УПД в пачке):
+    в памяти одновременно только детализация одной пачки.
+    Выдаёт (номера строк пачки, КК строк, детализация с номерами строк всей таблицы);
+    пачки идут по порядку строк, поэтому детализация подряд — уже в порядке отчёта.
+    workers > 1 — пачки считаются в пуле процессов (sharding.map_shards), порядок
+    и результат те же.
+    """
+    n = len(upds)
+    columns, single = _cc_rate_columns(daily_rate)
+    # ставки пачки: календарь и общее число — как есть, ставки строк — срезом
+    columns = [r if isinstance(r, RateCalendar) or np.ndim(r) == 0 else np.asarray(r) for r in columns]
+    cuts = np.searchsorted(upds.offsets, np.arange(batch_upds, upds.offsets[-1], batch_upds))
+    bounds = np.unique(np.concatenate(([0], cuts, [n])))
+    for a, b, (total, det) in map_shards(
+        commercial_credit, (upds, pays), (columns[0] if single else columns, today),
+        per_row=(0,), workers=workers, bounds=bounds,
+    ):
+        det["row"] = det["row"] + a
+        yield np.arange(a, b), total, det
@@ -0,0 +1,423 @@
+# Общий слой загрузки исходных выгрузок.
+# Выгрузка 1С (ДЗ_1С_НОВЫЙ (XLSX).xlsx) разбирается один раз и
+# сохраняется в колоночный кэш (Parquet, если установлен pyarrow, иначе pickle).
+# Ключ кэша — размер файла + mtime + хэш содержимого: пока выгрузка не менялась,
+# повторные запуски читают уже типизированные столбцы из кэша.
+
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+from schemas import SCHEMAS, canonical_header
+from sharding import cpu_count
+from staging import file_hash, stage
+
+try:
+    import pyarrow  # noqa: F401  (нужен только для Parquet)
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+try:
+    import python_calamine  # быстрый разбор xlsx (Rust)
+    HAS_CALAMINE = True
+except ImportError:
+    HAS_CALAMINE = False
+
+# Свободный текст храним в Arrow-строках, если есть pyarrow
+TEXT_DTYPE = pd.StringDtype("pyarrow") if HAS_PYARROW else object
+
+CACHE_DIR = Path(__file__).with_name("_cache")
+CACHE_VERSION = 1          # увеличить, если меняется очистка данных при чтении
+
+
+# ---------- Отпечаток файла ----------
+
+def file_fingerprint(path, known=None) -> dict:
+    """
+    Отпечаток файла: размер, mtime и хэш содержимого.
+    Если размер и mtime совпадают с known, хэш берётся из known и файл не читается.
+    """
+    st = os.stat(path)
+    fp = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if known and known.get("size") == fp["size"] and known.get("mtime_ns") == fp["mtime_ns"]:
+        fp["hash"] = known["hash"]
+    else:
+        fp["hash"] = file_hash(path)
+    return fp
+
+
+# ---------- Хранение DataFrame в кэше ----------
+
+def write_frame(df: pd.DataFrame, path_base: Path) -> Path:
+    """
+    Пишет DataFrame в кэш. Parquet, если возможно; столбцы со смешанными типами
+    (например, ИНН то числом, то строкой) Parquet не принимает — тогда pickle.
+    Возвращает фактический путь файла.
+    """
+    path_base = Path(path_base)
+    if HAS_PYARROW:
+        path = path_base.with_suffix(".parquet")
+        try:
+            df.to_parquet(path)
+            return path
+        except (TypeError, ValueError, NotImplementedError):
+            path.unlink(missing_ok=True)
+    path = path_base.with_suffix(".pkl")
+    df.to_pickle(path)
+    return path
+
+
+def read_frame(path: Path) -> pd.DataFrame:
+    path = Path(path)
+    if path.suffix == ".parquet":
+        df = pd.read_parquet(path)
+        # Parquet возвращает пропуски в текстовых столбцах как None,
+        # а read_excel — как NaN (важно для astype(str) в скриптах).
+        for c in df.columns[df.dtypes == object]:
+            df[c] = df[c].where(df[c].notna(), np.nan)
+        return df
+    return pd.read_pickle(path)
+
+
+def _load_meta(meta_path: Path) -> dict:
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return meta if meta.get("version") == CACHE_VERSION else {}
+
+
+def _save_meta(meta_path: Path, meta: dict):
+    tmp = meta_path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, meta_path)
+
+
+# ---------- Выгрузка 1С ----------
+
+def read_1c_export(path, sheet_name=0, header=2, cache_dir=CACHE_DIR, schema="ДЗ_1С") -> pd.DataFrame:
+    """
+    Читает выгрузку 1С с той же очисткой, что и в скриптах:
+    header=2, обрезка пробелов в заголовках, удаление дублей столбцов.
+    Пока файл не изменился, данные берутся из колоночного кэша.
+    По схеме (schemas.SCHEMAS) синонимы заголовков приводятся к каноническим
+    именам и проверяется наличие обязательных столбцов.
+    Файл с сетевой папки сначала зеркалируется локально (staging.stage).
+    """
+    local = stage(path)
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    key_src = f"{os.path.abspath(path)}|{sheet_name}|{header}"
+    key = hashlib.blake2b(key_src.encode("utf-8"), digest_size=8).hexdigest()
+    meta_path = cache_dir / f"{key}.json"
+
+    meta = _load_meta(meta_path)
+    fp = file_fingerprint(local, meta.get("source"))
+    data_path = cache_dir / meta["data"] if meta.get("data") else None
+    if data_path and data_path.exists() and meta["source"]["hash"] == fp["hash"]:
+        if meta["source"] != fp:
+            # файл "потрогали", но содержимое то же — обновляем только mtime
+            meta["source"] = fp
+            _save_meta(meta_path, meta)
+        return _conform_export(read_frame(data_path), schema, path)
+
+    df = read_sheets(local, {sheet_name: None}, header=header)[sheet_name]
+    df.columns = df.columns.str.strip()
+    df = df.loc[:, ~df.columns.duplicated()]
+
+    if data_path and data_path.exists():
+        data_path.unlink()
+    data_path = write_frame(df, cache_dir / key)
+    _save_meta(meta_path, {
+        "version": CACHE_VERSION,
+        "path": str(path),
+        "source": fp,
+        "data": data_path.name,
+    })
+    return _conform_export(df, schema, path)
+
+
+def _conform_export(df, schema, path):
+    if schema is None:
+        return df
+    sch = SCHEMAS[schema]
+    aliases = sch.get("aliases", {})
+    if aliases:
+        df.columns = [canonical_header(c, aliases) for c in df.columns]
+        df = df.loc[:, ~df.columns.duplicated()]
+    missing = [c for c in sch["columns"] if c not in df.columns]
+    if missing:
+        raise ValueError(f"{path}: нет столбцов {missing} (схема '{schema}')")
+    return apply_schema(df, sch)
+
+
+# ---------- Бэкенды чтения xlsx ----------
+# Бэкенд открывает книгу и отдаёт строки листа кортежами значений Python
+# (пустая ячейка — None или ""). Дальнейший разбор общий (_read_ws), поэтому
+# все бэкенды дают одинаковый DataFrame; benchmark_backends это проверяет.
+
+EXCEL_ERRORS = {"#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A"}
+
+
+def _convert_cell(v):
+    # То же приведение, что делает pandas при чтении через openpyxl
+    if v is None:
+        return ""
+    if isinstance(v, float):
+        return int(v) if v.is_integer() else v
+    if isinstance(v, str) and v in EXCEL_ERRORS:
+        return np.nan
+    if type(v) is date:
+        # calamine отдаёт дату без времени, openpyxl — datetime
+        return datetime.combine(v, datetime.min.time())
+    return v
+
+
+def _openpyxl_open(path):
+    import openpyxl
+    return openpyxl.load_workbook(path, read_only=True, data_only=True, keep_links=False)
+
+
+def _openpyxl_rows(book, sheet, min_row, max_row=None, max_col=None):
+    ws = book.worksheets[sheet] if isinstance(sheet, int) else book[sheet]
+    ws.reset_dimensions()
+    return ws.iter_rows(min_row=min_row, max_row=max_row, max_col=max_col, values_only=True)
+
+
+def _calamine_open(path):
+    # Лист разбирается целиком при первом обращении, дальше берётся из sheets
+    return {"wb": python_calamine.CalamineWorkbook.from_path(str(path)), "sheets": {}}
+
+
+def _calamine_rows(book, sheet, min_row, max_row=None, max_col=None):
+    if sheet not in book["sheets"]:
+        wb = book["wb"]
+        sh = wb.get_sheet_by_index(sheet) if isinstance(sheet, int) else wb.get_sheet_by_name(sheet)
+        book["sheets"][sheet] = sh.to_python(skip_empty_area=False)
+    rows = book["sheets"][sheet][min_row - 1:max_row]
+    if max_col is not None:
+        return (r[:max_col] for r in rows)
+    return rows
+
+
+def _calamine_close(book):
+    book["wb"].close()
+
+
+# {имя: (открыть книгу, строки листа, закрыть книгу)}
+BACKENDS = {
+    "openpyxl": (_openpyxl_open, _openpyxl_rows, lambda wb: wb.close()),
+}
+if HAS_CALAMINE:
+    BACKENDS["calamine"] = (_calamine_open, _calamine_rows, _calamine_close)
+
+REFERENCE_BACKEND = "openpyxl"      # повторяет pd.read_excel(engine='openpyxl')
+BACKENDS_FILE = CACHE_DIR / "backends.json"
+
+
+def _read_ws(backend, book, sheet, usecols, header, required=(), aliases=None, max_col=None):
+    rows_of = BACKENDS[backend][1]
+    head = next(iter(rows_of(book, sheet, header + 1, header + 1)), ())
+    head = [_convert_cell(v) for v in head]
+    if max_col is not None:
+        head = head[:max_col]
+    if aliases is not None:
+        head = [canonical_header(h, aliases) if h != "" else "" for h in head]
+
+    pos = {}
+    for i, h in enumerate(head):
+        if h != "":
+            pos.setdefault(h, i)
+            pos.setdefault(str(h), i)
+    wanted = dict.fromkeys(list(required) + list(usecols or []))
+    missing = [c for c in wanted if c not in pos]
+    if missing:
+        raise ValueError(f"Лист '{sheet}': нет столбцов {missing}")
+    if usecols is None:
+        idx = list(range(len(head)))
+    else:
+        idx = sorted({pos[c] for c in usecols})
+    if not idx:
+        return pd.DataFrame()
+
+    width = idx[-1] + 1
+    data = [[head[i] if i < len(head) else "" for i in idx]]
+    last_row_with_data = 0
+    for row in rows_of(book, sheet, header + 2, None, width):
+        n = len(row)
+        converted = [_convert_cell(row[i]) if i < n else "" for i in idx]
+        data.append(converted)
+        if any(v != "" for v in converted):
+            last_row_with_data = len(data) - 1
+    data = data[:last_row_with_data + 1]
+
+    return TextParser(data, header=0, skip_blank_lines=False).read()
+
+
+def _read_spec(backend, book, key, spec, header):
+    if isinstance(spec, dict):
+        cols = list(spec["columns"])
+        df = _read_ws(
+            backend, book, spec["sheet"],
+            None if spec.get("keep_all") else cols,
+            spec.get("header", 0),
+            required=cols,
+            aliases=spec.get("aliases", {}),
+            max_col=spec.get("max_col"),
+        )
+        return apply_schema(df, spec)
+    return _read_ws(backend, book, key, spec, header)
+
+
+def _read_book(path, sheets, header, backend):
+    open_book, _, close_book = BACKENDS[backend]
+    book = open_book(path)
+    try:
+        return {key: _read_spec(backend, book, key, spec, header) for key, spec in sheets.items()}
+    finally:
+        close_book(book)
+
+
+# ---------- Выбор бэкенда по замеру ----------
+
+def _shape_key(path, sheets, header) -> str:
+    # "Форма" файла: какие листы читаем и порядок размера файла (степень двойки)
+    size_class = os.stat(path).st_size.bit_length()
+    parts = []
+    for key, spec in sheets.items():
+        if isinstance(spec, dict):
+            parts.append(f"{spec['sheet']}@{spec.get('header', 0)}")
+        else:
+            parts.append(f"{key}@{header}")
+    return f"{'|'.join(sorted(parts))}|2^{size_class}"
+
+
+def _frames_equal(a: dict, b: dict) -> bool:
+    try:
+        for key in a:
+            pd.testing.assert_frame_equal(a[key], b[key], check_exact=True)
+    except AssertionError:
+        return False
+    return True
+
+
+def benchmark_backends(path, sheets: dict, header=0) -> dict:
+    """
+    Читает листы всеми бэкендами и сравнивает с эталонным (openpyxl).
+    Годится только бэкенд, давший идентичные DataFrame (даты, NaN, заголовки).
+    Возвращает {"backend": самый быстрый годный, "seconds": {...},
+    "mismatch": [...], "frames": результат победителя}.
+    """
+    seconds, results = {}, {}
+    for name in BACKENDS:
+        t0 = time.perf_counter()
+        results[name] = _read_book(path, sheets, header, name)
+        seconds[name] = round(time.perf_counter() - t0, 4)
+
+    reference = results[REFERENCE_BACKEND]
+    mismatch = [n for n in BACKENDS if n != REFERENCE_BACKEND and not _frames_equal(reference, results[n])]
+    valid = [n for n in BACKENDS if n not in mismatch]
+    best = min(valid, key=seconds.get)
+    return {"backend": best, "seconds": seconds, "mismatch": mismatch, "frames": results[best]}
+
+
+def _choose_backend(path, sheets, header):
+    """Бэкенд для формы файла из backends.json; при первой встрече — замер."""
+    shape = _shape_key(path, sheets, header)
+    try:
+        with open(BACKENDS_FILE, encoding="utf-8") as f:
+            known = json.load(f)
+    except (OSError, ValueError):
+        known = {}
+    if shape in known and known[shape]["backend"] in BACKENDS:
+        return known[shape]["backend"], None
+
+    res = benchmark_backends(path, sheets, header)
+    known[shape] = {k: res[k] for k in ("backend", "seconds", "mismatch")}
+    BACKENDS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    _save_meta(BACKENDS_FILE, known)
+    print(f"Бэкенд чтения для {os.path.basename(path)}: {res['backend']} {res['seconds']}")
+    return res["backend"], res["frames"]
+
+
+# ---------- Чтение нескольких листов за одно открытие книги ----------
+
+def _read_sheet_job(path, key, spec, header, backend):
+    # Выполняется в отдельном процессе: своя книга на каждый лист
+    return _read_book(path, {key: spec}, header, backend)[key]
+
+
+def read_sheets(path, sheets: dict, header=0, parallel=False, backend="auto") -> dict:
+    """
+    Открывает книгу один раз и читает нужные листы потоково.
+    sheets: {имя или номер листа: список нужных столбцов или None — все столбцы}
+    либо {ключ: схема из schemas.SCHEMAS} — тогда лист, заголовок (skiprows),
+    столбцы (usecols, max_col для диапазона 'A:R') и даты (parse_dates)
+    берутся из схемы.
+    Материализуются только запрошенные столбцы; если столбца нет в заголовке,
+    сразу выбрасывается ValueError. Значения приводятся так же, как в
+    pd.read_excel(engine='openpyxl'); хвостовые строки, пустые во всех
+    запрошенных столбцах, отбрасываются.
+    backend: "openpyxl", "calamine" или "auto" — самый быстрый из бэкендов,
+    дающих идентичный результат, по замеру для данной формы файла.
+    parallel=True — листы разбираются одновременно в пуле процессов (разбор
+    упирается в CPU), общее время ≈ времени самого большого листа.
+    На одном ядре читается последовательно.
+    Вызывающий скрипт должен быть защищён `if __name__ == "__main__":`.
+    Возвращает {ключ: DataFrame} в порядке sheets.
+    """
+    path = stage(path)
+    if backend == "auto":
+        backend, frames = _choose_backend(path, sheets, header)
+        if frames is not None:
+            return frames
+
+    workers = min(len(sheets), cpu_count()) if parallel else 1
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {key: pool.submit(_read_sheet_job, path, key, spec, header, backend)
+                       for key, spec in sheets.items()}
+            return {key: f.result() for key, f in futures.items()}
+    return _read_book(path, sheets, header, backend)
+
+
+def read_schemas(path, *names, parallel=False) -> dict:
+    """Читает из одной книги листы по именам схем: {имя схемы: DataFrame}."""
+    return read_sheets(path, {name: SCHEMAS[name] for name in names}, parallel=parallel)
+
+# ---------- Приведение типов по схеме ----------
+
+def apply_schema(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """Приводит типы столбцов и заполняет пропуски по схеме (один проход)."""
+    dayfirst = schema.get("dayfirst", False)
+    for col, kind in schema["columns"].items():
+        if kind == "str":
+            df[col] = df[col].astype(str)
+        elif kind == "key":
+            df[col] = df[col].astype(str).astype("category")
+        elif kind == "category":
+            df[col] = df[col].astype("category")
+        elif kind == "text":
+            df[col] = df[col].astype(TEXT_DTYPE)
+        elif kind == "num":
+            try:
+                df[col] = pd.to_numeric(df[col])
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Столбец '{col}' (лист '{schema['sheet']}'): {e}") from None
+        elif kind == "date":
+            df[col] = pd.to_datetime(df[col], dayfirst=dayfirst)
+    fill = schema.get("fill")
+    if fill:
+        df = df.fillna(fill)
+    return df
@@ -0,0 +1,161 @@
+# Денежные суммы в целых копейках (int64).
+# Суммы выгрузок переводятся в копейки прямо из текста ("150 000,50" -> 15000050),
+# без промежуточного float; FIFO-распределение и остатки считаются точно на
+# массивах int64 — без допусков вида 1e-9 / 1e-6 и без копеечных "хвостов"
+# вычитаний (debt.py). Проценты начисляются на точные остатки: ставки — целые
+# миллионные доли, сумма кусков начисления каждого итога (строки отчёта, записи
+# детализации) считается точно в целых числах и округляется один раз — до копейки,
+# половина от нуля (interest_kopeks).
+# Всё — массивами по всем строкам сразу, без Decimal на строку.
+
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+import numpy as np
+import pandas as pd
+
+KOPEKS = 100              # копеек в рубле
+RATE_SCALE = 1_000_000    # ставка в миллионных долях: 0.18 -> 180000, 0.3% в день -> 3000
+_INT64 = np.iinfo(np.int64)
+
+_AMOUNT_RE = r"^\s*([+-]?)(\d*)(?:\.(\d*))?\s*$"
+
+
+# ---------- Перевод в копейки ----------
+
+def _decimal_kopeks(text):
+    # запасной разбор (экспонента и т.п.): Decimal, округление половина от нуля
+    try:
+        d = Decimal(str(text).strip())
+        k = int((d * KOPEKS).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    except (InvalidOperation, ValueError, OverflowError):
+        return None
+    # сумма вне int64 — неразборчива, как и нечисловой текст
+    return k if _INT64.min <= k <= _INT64.max else None
+
+
+def parse_kopeks(strings):
+    """
+    Суммы из текста ('1234.565', '-10', '.5'; разделитель — точка) в копейки.
+    Лишние знаки после копеек округляются половиной от нуля. Разбор по уникальным
+    строкам. Возвращает (копейки int64, признак успешного разбора).
+    """
+    codes, uniq = pd.factorize(pd.Series(strings, dtype=object))
+    uniq = pd.Series(uniq, dtype=object).astype(str)
+    parts = uniq.str.extract(_AMOUNT_RE)
+    ok = parts[1].notna() & ((parts[1].str.len() > 0) | (parts[2].str.len() > 0))
+    ok = ok.to_numpy() & (uniq.str.len().to_numpy() < 19)   # без переполнения int64
+    rub = pd.to_numeric(parts[1].where(ok, "0").replace("", "0")).to_numpy(dtype=np.int64)
+    frac = parts[2].where(ok).fillna("").str.ljust(3, "0")
+    kop = (rub * KOPEKS + pd.to_numeric(frac.str[:2]).to_numpy(dtype=np.int64)
+           + (pd.to_numeric(frac.str[2]).to_numpy(dtype=np.int64) >= 5))
+    kop = np.where(parts[0].to_numpy() == "-", -kop, kop)
+    for i in np.flatnonzero(~ok):
+        k = _decimal_kopeks(uniq.iat[i])
+        if k is not None:
+            kop[i], ok[i] = k, True
+    return kop[codes], ok[codes]
+
+
+def to_kopeks(values) -> np.ndarray:
+    """
+    Рубли float -> копейки: по десятичной записи числа (как Decimal(str(x))),
+    половина от нуля. Пропуски (NaN) — 0; бесконечность и суммы вне int64 — ValueError.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = np.where(np.isnan(values), 0.0, values)
+    kop, ok = parse_kopeks([repr(x) for x in values.tolist()])
+    if not ok.all():
+        raise ValueError(f"Суммы не переводятся в копейки int64: {values[~ok][:5].tolist()}")
+    return kop
+
+
+def from_kopeks(kop) -> np.ndarray:
+    """Копейки -> рубли float (для вывода в отчёт)."""
+    return np.asarray(kop, dtype=np.int64) / KOPEKS
+
+
+def split_rubles(kop):
+    """Копейки -> (рубли, копейки 0..99); для неотрицательных сумм."""
+    return divmod(kop, KOPEKS)
+
+
+# ---------- FIFO ----------
+
+def _segment_sums(values, offsets) -> np.ndarray:
+    # точные суммы int64 по строкам CSR
+    cum = np.concatenate(([0], np.cumsum(values)))
+    return cum[offsets[1:]] - cum[offsets[:-1]]
+
+
+def fifo_allocate(plans, facts) -> dict:
+    """
+    FIFO-распределение фактов по планам для всех строк сразу, точно в копейках.
+    plans, facts — schedules.Schedules с суммами int64 (parse_schedule(..., kopeks=True)).
+    План i строки занимает отрезок накопленной суммы планов [P(i-1), P(i)), факт j —
+    отрезок накопленной суммы фактов [F(j-1), F(j)); распределено — длина их пересечения.
+    Неположительные суммы ничего не требуют и не гасят, факты сверх планов строки
+    остаются нераспределёнными (как в debt.allocate_fifo).
+    Возвращает dict: plan, fact (глобальные номера записей), applied (int64) — по
+    (строка, план, факт); rem — остаток каждой плановой записи.
+    """
+    p = np.maximum(plans.amount, 0)
+    f = np.maximum(facts.amount, 0)
+    total = _segment_sums(p, plans.offsets)
+    base = np.concatenate(([0], np.cumsum(total)))[:-1]   # начало строки на общей оси
+    p_end = np.cumsum(p)
+    p_start = p_end - p
+    f_row = facts.row_ids()
+    f_cum = np.cumsum(f) - np.concatenate(([0], np.cumsum(f)))[facts.offsets[:-1]][f_row]
+    f_end = base[f_row] + np.minimum(f_cum, total[f_row])
+    f_start = base[f_row] + np.minimum(f_cum - f, total[f_row])
+
+    points = np.unique(np.concatenate((p_start, p_end, f_start, f_end)))
+    lo, hi = points[:-1], points[1:]
+    pi = np.searchsorted(p_end, lo, side="right")
+    fi = np.searchsorted(f_end, lo, side="right")
+    ok = (pi < len(p)) & (fi < len(f))
+    ok[ok] &= f_start[fi[ok]] <= lo[ok]
+    pi, fi, applied = pi[ok], fi[ok], (hi - lo)[ok]
+    # соседние отрезки одной пары (план, факт) — одна запись
+    if len(pi):
+        start = np.flatnonzero(np.concatenate(([True], (pi[1:] != pi[:-1]) | (fi[1:] != fi[:-1]))))
+        pi, fi, applied = pi[start], fi[start], np.add.reduceat(applied, start)
+    rem = plans.amount.copy()
+    np.subtract.at(rem, pi, applied)
+    return {"plan": pi, "fact": fi, "applied": applied, "rem": rem}
+
+
+# ---------- Проценты ----------
+
+def rate_units(rate) -> np.ndarray:
+    """Ставка (число или массив) -> целые миллионные доли (ближайшие)."""
+    return np.rint(np.asarray(rate, dtype=np.float64) * RATE_SCALE).astype(np.int64)
+
+
+def interest_kopeks(rows, base, rate_days, n: int, basis: int = 365) -> np.ndarray:
+    """
+    Проценты по строкам в копейках: сумма base * rate_days / (RATE_SCALE * basis)
+    кусков строки — точно, и одно округление до копейки, половина от нуля.
+      base      — остаток куска, копейки (m,);
+      rate_days — сумма ставок (миллионные доли) за дни куска, для постоянной ставки
+                  rate_units(r) * дни; (m,) или (m, k) — k ставок сразу.
+    Результат int64 формы (n,) или (n, k). Произведения раскладываются по модулю
+    RATE_SCALE * basis (целая часть и остаток складываются отдельно) — без переполнения int64.
+    """
+    den = RATE_SCALE * int(basis)
+    rows = np.asarray(rows, dtype=np.int64)
+    base = np.asarray(base, dtype=np.int64)
+    rate_days = np.asarray(rate_days, dtype=np.int64)
+    if rate_days.ndim == 2:
+        base = base[:, None]
+    q, r = np.divmod(rate_days, den)
+    bq, br = np.divmod(base, den)
+    fq, fr = np.divmod(br * r, den)
+    whole = np.zeros((n,) + rate_days.shape[1:], dtype=np.int64)
+    rest = np.zeros_like(whole)
+    np.add.at(whole, rows, base * q + bq * r + fq)
+    np.add.at(rest, rows, fr)
+    carry, rest = np.divmod(rest, den)
+    whole += carry
+    # итог = whole + rest / den, 0 <= rest < den; половина — от нуля
+    return whole + np.where(whole >= 0, 2 * rest >= den, 2 * rest > den)
@@ -0,0 +1,91 @@
+# Календарь ставок: ставка, меняющаяся во времени (например, история
+# ключевой ставки ЦБ). Таблица (действует с, годовая ставка) хранится с
+# накопленными суммами "ставка × дни" на дату каждого изменения, поэтому
+# сумма ставок за любой период считается двумя бинарными поисками, без цикла
+# по дням. Ставки — целые миллионные доли (money.rate_units), суммы — точные;
+# проценты куска долга = остаток * unit_days(период) / (RATE_SCALE * basis)
+# (money.interest_kopeks).
+
+import numpy as np
+import pandas as pd
+
+from money import RATE_SCALE, rate_units
+from schedules import EPOCH
+
+
+def _day_numbers(dates) -> np.ndarray:
+    d = pd.to_datetime(pd.Series(list(dates)), dayfirst=True).to_numpy().astype("datetime64[D]")
+    return (d - EPOCH).astype(np.int64)
+
+
+class RateCalendar:
+    """
+    Кусочно-постоянная ставка.
+      start — int64, номер дня начала действия ставки (по возрастанию)
+      units — int64, ставка в миллионных долях (money.rate_units)
+      basis — int, дней в году (дневная ставка = ставка / basis; 1 — ставки уже дневные)
+      cum   — int64, сумма units по дням от start[0] до start[i] (не включая)
+    До первой даты действует первая ставка, после последней — последняя.
+    """
+
+    __slots__ = ("start", "units", "basis", "cum")
+
+    def __init__(self, effective_from, annual_rates, basis=365):
+        start = _day_numbers(effective_from)
+        units = rate_units(annual_rates).reshape(-1)
+        if len(start) == 0 or len(start) != len(units):
+            raise ValueError("Календарь ставок: нужна хотя бы одна пара (дата, ставка).")
+        # по дате; при повторе даты действует последняя запись
+        order = np.argsort(start, kind="stable")
+        start, units = start[order], units[order]
+        last = np.append(start[1:] != start[:-1], True)
+        self.start, self.units, self.basis = start[last], units[last], int(basis)
+        self.cum = np.concatenate(([0], np.cumsum(self.units[:-1] * np.diff(self.start))))
+
+    @classmethod
+    def constant(cls, annual_rate, basis=365):
+        """Одна ставка на всё время."""
+        return cls([EPOCH.astype(object)], [annual_rate], basis)
+
+    def __len__(self):
+        return len(self.start)
+
+    def _k(self, day):
+        # номер действующей ставки для дня (до первой даты — первая)
+        return np.maximum(np.searchsorted(self.start, day, side="right") - 1, 0)
+
+    def _prefix(self, day):
+        # сумма units за дни [start[0], day)
+        k = self._k(day)
+        return self.cum[k] + self.units[k] * (day - self.start[k])
+
+    def rate_on(self, day):
+        """Дневная ставка на день (номер дня или массив)."""
+        return self.units[self._k(np.asarray(day, dtype=np.int64))] / (RATE_SCALE * self.basis)
+
+    def unit_days(self, since, days) -> np.ndarray:
+        """
+        Сумма ставок (миллионные доли) за дни since+1 .. since+days (since — день перед
+        началом начисления, как дата плана или отгрузки), int64. При постоянной ставке
+        r это rate_units(r) * days.
+        """
+        since = np.asarray(since, dtype=np.int64)
+        days = np.asarray(days, dtype=np.int64)
+        return self._prefix(since + days + 1) - self._prefix(since + 1)
+
+
+def read_rate_calendar(path, date_col="Дата", rate_col="Ставка", percent=True, basis=365, **read_kw):
+    """
+    Календарь из таблицы xlsx/csv: столбец даты начала действия и столбец ставки.
+    percent — ставка записана в процентах (16 -> 0.16), как публикует ЦБ.
+    """
+    path = str(path)
+    if path.lower().endswith(".csv"):
+        df = pd.read_csv(path, **read_kw)
+    else:
+        df = pd.read_excel(path, **read_kw)
+    df = df[[date_col, rate_col]].dropna()
+    rate = pd.to_numeric(df[rate_col].astype(str).str.replace(",", ".", regex=False).str.strip())
+    if percent:
+        rate = rate / 100.0
+    return RateCalendar(df[date_col], rate.to_numpy(), basis)
@@ -0,0 +1,186 @@
+# Общий справочник "Регион -> Дивизион".
+# Раньше словарь был скопирован в каждый скрипт (продажи, ДЗ, проценты,
+# задача президенту), а ABCD определял дивизион цепочкой if через
+# apply(axis=1). Теперь все берут соответствие отсюда.
+#
+# Столбец разрешается целиком: значения кодируются в категории
+# (pd.factorize), словарь применяется только к уникальным регионам,
+# а результат собирается по целым кодам — без Python-вызова на строку.
+
+import re
+
+import numpy as np
+import pandas as pd
+
+REGION_TO_DIVISION = {
+    "Азербайджан": "СНГ",
+    "Алтайский край": "Дивизион СИБИРЬ",
+    "Амурская область": "Дивизион ДАЛЬНИЙ ВОСТОК",
+    "Армения": "СНГ",
+    "Астраханская область": "Дивизион ЮГ",
+    "Беларусь": "СНГ",
+    "Белгородская область": "Дивизион ЦЕНТР",
+    "Белоруссия": "СНГ",
+    "Брянская область": "Дивизион ЦЕНТР",
+    "Владимирская область": "Дивизион ЦЕНТР",
+    "Волгоградская область": "Дивизион ЮГ",
+    "Воронежская область": "Дивизион ЦЕНТР",
+    "Грузия": "СНГ",
+    "ДНР": "Дивизион ЦЕНТР",
+    "Запорожье/Херсон": "Дивизион ЮГ",
+    "Иркутская область": "Дивизион СИБИРЬ",
+    "Казахстан": "СНГ",
+    "Калининградская область": "Дивизион ЦЕНТР",
+    "Кемеровская область": "Дивизион СИБИРЬ",
+    "Кировская область": "Дивизион ПОВОЛЖЬЕ",
+    "Краснодарский край": "Дивизион ЮГ",
+    "Красноярский край": "Дивизион СИБИРЬ",
+    "Курганская область": "Дивизион УРАЛ",
+    "Курская область": "Дивизион ЦЕНТР",
+    "ЛНР": "Дивизион ЦЕНТР",
+    "ЛНР/ДНР": "Дивизион ЦЕНТР",
+    "Липецкая область": "Дивизион ЦЕНТР",
+    "Московская область": "Дивизион ЦЕНТР",
+    "Нижегородская область": "Дивизион ПОВОЛЖЬЕ",
+    "Новосибирская область": "Дивизион СИБИРЬ",
+    "Омская область": "Дивизион СИБИРЬ",
+    "Оренбургская область": "Дивизион ПОВОЛЖЬЕ",
+    "Орловская область": "Дивизион ЦЕНТР",
+    "Пензенская область": "Дивизион ПОВОЛЖЬЕ",
+    "Приморский край": "Дивизион ДАЛЬНИЙ ВОСТОК",
+    "Республика Башкортостан": "Дивизион ПОВОЛЖЬЕ",
+    "Республика Дагестан": "Дивизион ЮГ",
+    "Республика Калмыкия": "Дивизион ЮГ",
+    "Республика Крым": "Дивизион ЮГ",
+    "Республика Мордовия": "Дивизион ПОВОЛЖЬЕ",
+    "Республика Татарстан": "Дивизион ПОВОЛЖЬЕ",
+    "Республика Чувашия": "Дивизион ПОВОЛЖЬЕ",
+    "Ростовская область": "Дивизион ЮГ",
+    "Рязанская область": "Дивизион ЦЕНТР",
+    "Самарская область": "Дивизион ПОВОЛЖЬЕ",
+    "Саратовская область": "Дивизион ПОВОЛЖЬЕ",
+    "Свердловская область": "Дивизион УРАЛ",
+    "Ставропольский край": "Дивизион ЮГ",
+    "Тамбовская область": "Дивизион ЦЕНТР",
+    "Томская область": "Дивизион СИБИРЬ",
+    "Тульская область": "Дивизион ЦЕНТР",
+    "Тюменская область": "Дивизион УРАЛ",
+    "Узбекистан": "СНГ",
+    "Ульяновская область": "Дивизион ПОВОЛЖЬЕ",
+    "Челябинская область": "Дивизион УРАЛ",
+}
+
+# Порядок обработки дивизионов в отчётах по продажам
+DIVISIONS_ORDER = [
+    "Дивизион ДАЛЬНИЙ ВОСТОК",
+    "Дивизион УРАЛ",
+    "Дивизион СИБИРЬ",
+    "Дивизион ПОВОЛЖЬЕ",
+    "Дивизион ЦЕНТР",
+    "Дивизион ЮГ",
+]
+
+# ABCD берёт дивизион из выгрузки и переопределяет его только для этих регионов
+# (как прежний get_division); остальные регионы справочника не трогает.
+ABCD_OVERRIDES = frozenset({
+    "Амурская область", "Приморский край",
+    "Челябинская область", "Тюменская область", "Курганская область", "Свердловская область",
+    "Республика Башкортостан", "Республика Татарстан",
+    "Алтайский край", "Кемеровская область", "Красноярский край",
+    "Новосибирская область", "Омская область", "Томская область",
+    "Тамбовская область",
+})
+
+# Из дивизиона ЮГ отчёты по продажам строятся только для этих регионов
+ALLOWED_YUG_REGIONS = {"Республика Крым", "Республика Дагестан"}
+
+# В 1С регион бывает разбит на части: "Алтайский край 1", "Краснодарский край 2"...
+_PART_RE = re.compile(r"^(.*\S)\s+[12]$")
+
+
+def region_base(name):
+    """Регион без номера части: 'Краснодарский край 2' -> 'Краснодарский край'."""
+    if not isinstance(name, str):
+        return name
+    m = _PART_RE.match(name)
+    if m and m.group(1) in REGION_TO_DIVISION:
+        return m.group(1)
+    return name
+
+
+def division_for(name, default=None):
+    """Дивизион одного региона (с учётом частей региона)."""
+    return REGION_TO_DIVISION.get(region_base(name), default)
+
+
+def _map_unique(values, func) -> pd.Series:
+    # func вызывается по одному разу на уникальное значение,
+    # строки собираются по целым кодам factorize
+    s = values if isinstance(values, pd.Series) else pd.Series(values)
+    codes, uniques = pd.factorize(s)
+    mapped = pd.Index([func(u) for u in uniques], dtype=object)
+    out_codes, out_cats = pd.factorize(mapped)
+    codes = np.where(codes >= 0, out_codes.take(codes, mode="clip"), -1)
+    cat = pd.Categorical.from_codes(codes, categories=out_cats)
+    return pd.Series(cat, index=s.index, name=s.name).cat.reorder_categories(sorted(out_cats))
+
+
+def merge_region_parts(regions, bases=("Алтайский край",)) -> pd.Series:
+    """
+    Склеивает части регионов ('Алтайский край 1/2' -> 'Алтайский край').
+    bases — какие регионы склеивать; отчёты ДЗ и ABCD склеивают только Алтайский край,
+    остальные части ('Краснодарский край 1/2', 'Ростовская область 1/2') остаются отдельными.
+    """
+    bases = set(bases)
+
+    def merge(r):
+        b = region_base(r)
+        return b if b in bases else r
+
+    return _map_unique(regions, merge)
+
+
+def division_of(regions, default=None, overrides=None) -> pd.Series:
+    """
+    Дивизион для всего столбца регионов (category).
+    Регион, которого нет в справочнике, получает default (по умолчанию — пропуск).
+    default может быть Series той же длины: тогда для неизвестных регионов берётся
+    значение из неё (например, дивизион из исходной выгрузки).
+    overrides — если задан, справочник применяется только к этим регионам
+    (точное совпадение имени), остальные получают default.
+    """
+    if overrides is None:
+        div = _map_unique(regions, division_for)
+    else:
+        div = _map_unique(regions, lambda r: division_for(r) if r in overrides else None)
+    if default is None:
+        return div
+    if isinstance(default, pd.Series):
+        if div.isna().any():
+            fallback = default.astype(str).where(default.notna())
+            div = div.astype(object).fillna(fallback).astype("category")
+        return div
+    if div.isna().any():
+        if default not in div.cat.categories:
+            div = div.cat.set_categories(sorted(list(div.cat.categories) + [default]))
+        div = div.fillna(default)
+    return div
+
+
+def report_regions(regions) -> list:
+    """
+    Регионы для отчётов по продажам: [(регион, дивизион), ...] без СНГ и без
+    регионов вне справочника; из ЮГа — только ALLOWED_YUG_REGIONS.
+    Порядок — по DIVISIONS_ORDER, внутри дивизиона — как в исходных данных.
+    """
+    result = []
+    for r in pd.unique(pd.Series(regions).dropna()):
+        div = division_for(r)
+        if div is None or div == "СНГ":
+            continue
+        if div == "Дивизион ЮГ" and r not in ALLOWED_YUG_REGIONS:
+            continue
+        result.append((r, div))
+    order = {d: i for i, d in enumerate(DIVISIONS_ORDER)}
+    result.sort(key=lambda rd: order.get(rd[1], len(DIVISIONS_ORDER)))
+    return result
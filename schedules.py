@@ -0,0 +1,375 @@
+# Разбор графиков оплат из многострочных ячеек выгрузок.
+# Ячейка вида
+#     01.03.2024; 150 000,00
+#     15.03.2024; 50 000,00
+# превращается в "длинную" таблицу событий: одна строка на запись графика
+# (row_id — номер строки исходного столбца, date, amount[, doc_number]).
+# Весь столбец разбирается за один проход строковыми операциями pandas
+# (split/explode), даты и суммы переводятся пачкой по уникальным значениям,
+# одинаковые тексты ячеек разбираются один раз. Суммы, мин./макс. даты и
+# FIFO-расчёты дальше читают эту таблицу, а не исходные строки.
+
+import numpy as np
+import pandas as pd
+
+from money import parse_kopeks, to_kopeks
+
+# ---------- Диалекты ячеек ----------
+# lines  — разделитель строк внутри ячейки (регулярное выражение)
+# br     — заменять ли '<br>' на перевод строки
+# split  — сколько раз делить строку по ';' (остаток — последнее поле)
+# date / amount / doc — номера полей
+# clean  — очистка текста суммы перед переводом в число
+DIALECTS = {
+    # Графики 1С "Оплаты по дням (план/факт)": 'ДД.ММ.ГГГГ; сумма'
+    # (строки как у str.splitlines, сумма — только цифры, точка, запятая, минус)
+    "days": {
+        "lines": r"\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]",
+        "br": False,
+        "split": 2,
+        "date": 0,
+        "amount": 1,
+        "doc": None,
+        "clean": "digits",
+    },
+    # УПД: 'ДД.ММ.ГГГГ; номер УПД; сумма'
+    "upd": {
+        "lines": r"\n",
+        "br": True,
+        "split": 3,
+        "date": 0,
+        "amount": 2,
+        "doc": 1,
+        "clean": "spaces",
+    },
+    # Фактические оплаты: 'ДД.ММ.ГГГГ; сумма' (сумма — всё после первой ';')
+    "payments": {
+        "lines": r"\n",
+        "br": True,
+        "split": 1,
+        "date": 0,
+        "amount": 1,
+        "doc": None,
+        "clean": "spaces",
+    },
+}
+
+DATE_FORMAT = "%d.%m.%Y"
+
+
+# ---------- Перевод полей ----------
+
+def _clean_amounts(s: pd.Series, how: str) -> pd.Series:
+    if how == "digits":
+        # как clean_amount_string: выбросить всё, кроме цифр, '.', ',' и '-'
+        return s.str.replace(r"[^0-9.,-]+", "", regex=True).str.replace(",", ".", regex=False)
+    s = s.str.strip().str.replace(" ", "", regex=False)
+    return s.str.replace(",", ".", regex=False).str.replace("\xa0", "", regex=False)
+
+
+def _to_float(strings: pd.Series):
+    """
+    Суммы по уникальным строкам: pd.to_numeric пачкой, а то, что он не принял,
+    проверяется float() (он же использовался при построчном разборе).
+    Возвращает (значения, признак успешного разбора).
+    """
+    codes, uniq = pd.factorize(strings)
+    uniq = pd.Series(uniq, dtype=object)
+    vals = pd.to_numeric(uniq, errors="coerce").to_numpy(dtype="float64")
+    ok = ~np.isnan(vals)
+    for i in np.flatnonzero(~ok):
+        try:
+            vals[i] = float(uniq.iat[i])
+            ok[i] = True
+        except (TypeError, ValueError):
+            pass
+    return vals[codes], ok[codes]
+
+
+def _to_dates(strings: pd.Series) -> np.ndarray:
+    """Даты 'ДД.ММ.ГГГГ' по уникальным строкам; неразобранные — NaT."""
+    codes, uniq = pd.factorize(strings)
+    dates = pd.to_datetime(pd.Series(uniq, dtype=object), format=DATE_FORMAT, errors="coerce")
+    return dates.to_numpy(dtype="datetime64[ns]")[codes]
+
+
+# ---------- Разбор столбца ----------
+
+def _parse_texts(texts: pd.Series, spec: dict, kopeks: bool = False) -> pd.DataFrame:
+    # texts — уникальные тексты ячеек; результат — события с номером текста (uid)
+    if spec["br"]:
+        texts = texts.str.replace("<br>", "\n", regex=False)
+    lines = texts.str.split(spec["lines"], regex=True).explode()
+    lines = lines[lines.str.contains(";", regex=False, na=False)]
+    n = spec["split"]
+    fields = lines.str.split(";", n=n, expand=True).reindex(columns=range(n + 1))
+    # запись принимается, только если в строке есть все нужные поля
+    need = max(spec["amount"], spec["doc"] or 0)
+    fields = fields[fields[need].notna()]
+
+    if kopeks:
+        amount, ok = parse_kopeks(_clean_amounts(fields[spec["amount"]], spec["clean"]))
+    else:
+        amount, ok = _to_float(_clean_amounts(fields[spec["amount"]], spec["clean"]))
+    date = _to_dates(fields[spec["date"]].str.strip())
+    ok &= ~np.isnat(date)
+
+    ev = pd.DataFrame({
+        "uid": fields.index.to_numpy()[ok],
+        "date": date[ok],
+        "amount": amount[ok],
+    })
+    if spec["doc"] is not None:
+        ev["doc_number"] = fields[spec["doc"]].str.strip().to_numpy()[ok]
+    return ev
+
+
+def parse_schedule(cells, dialect: str = "days", kopeks: bool = False) -> pd.DataFrame:
+    """
+    Разбирает столбец графиков в таблицу событий
+    (row_id, date, amount[, doc_number]) в порядке строк ячеек.
+    row_id — позиция ячейки в cells (0..len-1). Неразборчивые строки пропускаются,
+    как и при построчном разборе.
+    kopeks=True — amount в целых копейках int64, прямо из текста (money.parse_kopeks).
+    """
+    spec = DIALECTS[dialect]
+    cells = pd.Series(cells).reset_index(drop=True)
+    cells = cells[cells.notna()]
+    columns = ["row_id", "date", "amount"] + (["doc_number"] if spec["doc"] is not None else [])
+    if cells.empty:
+        return _empty(columns, kopeks)
+
+    # одинаковые тексты разбираем один раз
+    codes, uniq = pd.factorize(cells.astype(str))
+    ev = _parse_texts(pd.Series(uniq, dtype=object), spec, kopeks)
+    if ev.empty:
+        return _empty(columns, kopeks)
+
+    # развернуть события уникальных текстов обратно по строкам столбца
+    uid = ev["uid"].to_numpy()
+    count = np.bincount(uid, minlength=len(uniq))
+    start = np.concatenate(([0], np.cumsum(count)[:-1]))
+    per_row = count[codes]
+    total = int(per_row.sum())
+    row_start = np.repeat(np.cumsum(per_row) - per_row, per_row)
+    take = np.repeat(start[codes], per_row) + (np.arange(total) - row_start)
+
+    out = ev.iloc[take].drop(columns="uid").reset_index(drop=True)
+    out.insert(0, "row_id", np.repeat(cells.index.to_numpy(), per_row))
+    return out[columns]
+
+
+def _empty(columns, kopeks=False) -> pd.DataFrame:
+    out = pd.DataFrame({
+        "row_id": pd.Series(dtype="int64"),
+        "date": pd.Series(dtype="datetime64[ns]"),
+        "amount": pd.Series(dtype="int64" if kopeks else "float64"),
+    })
+    if "doc_number" in columns:
+        out["doc_number"] = pd.Series(dtype=object)
+    return out
+
+
+# ---------- Агрегаты по строкам ----------
+
+def schedule_totals(ev: pd.DataFrame, n: int, date_how: str = "min", until=None):
+    """
+    Сумма и крайняя дата (min или max) событий каждой строки.
+    until — учитывать только события с датой <= until.
+    Суммы складываются по порядку строк ячейки (как sum() при построчном разборе),
+    суммы в копейках — точно; строки без событий дают 0 и None.
+    Возвращает (np.ndarray float64 или int64 для копеек, np.ndarray object c datetime.date/None).
+    """
+    if until is not None:
+        ev = ev[ev["date"] <= pd.Timestamp(until)]
+    rows = ev["row_id"].to_numpy()
+    amount = ev["amount"].to_numpy()
+    if amount.dtype == np.int64:
+        totals = np.zeros(n, dtype=np.int64)
+        np.add.at(totals, rows, amount)
+    else:
+        totals = np.bincount(rows, weights=amount, minlength=n)
+    dates = np.full(n, None, dtype=object)
+    if len(ev):
+        agg = ev.groupby("row_id")["date"].agg(date_how)
+        dates[agg.index.to_numpy()] = agg.dt.date.to_numpy()
+    return totals, dates
+
+
+# ---------- Итоги на несколько дат ----------
+# Накопленная сумма событий строки — ступенчатая функция от даты. События
+# сортируются по (строка, день) один раз, накопленные суммы — одна cumsum, а
+# значение на любую дату D — разность накопленных сумм в позиции searchsorted
+# ключа (строка, D). Все строки и даты — одним вызовом searchsorted.
+
+_DAY_SHIFT = 1 << 31      # номер дня в ключе (строка, день) — неотрицательный
+
+
+def _step_index(groups, day, n: int, days):
+    """
+    Индекс ступенчатых функций: (порядок событий по (группа, день), начало группы (n,),
+    конец событий группы с днём <= D (n, k)) — в позициях отсортированных событий.
+    """
+    groups = np.asarray(groups, dtype=np.int64)
+    day = np.asarray(day, dtype=np.int64)
+    order = np.lexsort((day, groups))
+    key = (groups[order] << 32) + (day[order] + _DAY_SHIFT)
+    g = np.arange(n, dtype=np.int64)[:, None] << 32
+    start = np.searchsorted(key, g[:, 0], side="left")
+    pos = np.searchsorted(key, g + (np.asarray(days, dtype=np.int64)[None, :] + _DAY_SHIFT), side="right")
+    return order, start, pos
+
+
+def cumulative_at(groups, day, values, n: int, days) -> np.ndarray:
+    """
+    Сумма values событий каждой группы 0..n-1 с днём <= D для каждого D из days:
+    массив (n, len(days)). Суммы — разности накопленных сумм (для копеек — точно).
+    """
+    order, start, pos = _step_index(groups, day, n, days)
+    values = np.asarray(values)
+    cum = np.concatenate((np.zeros(1, dtype=values.dtype), np.cumsum(values[order])))
+    return cum[pos] - cum[start][:, None]
+
+
+def schedule_totals_at(ev: pd.DataFrame, n: int, days, date_how: str = "min"):
+    """
+    schedule_totals(ev, n, date_how, until=D) сразу для всех D из days (номера дней):
+    (суммы (n, k), даты (n, k) object c datetime.date/None). Суммы в копейках — точно.
+    """
+    rows = ev["row_id"].to_numpy()
+    day = (ev["date"].to_numpy().astype("datetime64[D]") - EPOCH).astype(np.int64)
+    amount = ev["amount"].to_numpy()
+    order, start, pos = _step_index(rows, day, n, days)
+    cum = np.concatenate((np.zeros(1, dtype=amount.dtype), np.cumsum(amount[order])))
+    totals = cum[pos] - cum[start][:, None]
+    day = day[order]
+    has = pos > start[:, None]
+    if date_how == "min":
+        edge = np.broadcast_to(start[:, None], pos.shape)
+    else:
+        edge = pos - 1
+    dates = np.full(pos.shape, None, dtype=object)
+    if has.any():
+        dates[has] = day_to_date(day[edge[has]])
+    return totals, dates
+
+
+# ---------- Компактное хранение графиков (CSR) ----------
+
+EPOCH = np.datetime64("1970-01-01", "D")
+
+
+def day_number(d) -> int:
+    """Номер дня от 1970-01-01 для date/datetime/Timestamp."""
+    return int((np.datetime64(pd.Timestamp(d).date(), "D") - EPOCH).astype(np.int64))
+
+
+def day_to_date(day):
+    """Обратно к datetime.date (день — число или массив чисел)."""
+    if np.ndim(day):
+        return (EPOCH + np.asarray(day, dtype="timedelta64[D]")).astype(object)
+    return (EPOCH + np.timedelta64(int(day), "D")).astype(object)
+
+
+class Schedules:
+    """
+    Графики всех строк в одном объекте (CSR):
+      offsets — int64, длина n+1: события строки i лежат в [offsets[i], offsets[i+1])
+      day     — int32, номер дня события (day_number)
+      amount  — float64, сумма события (int64 — в копейках, см. money.py)
+      doc     — номера документов (object) или None
+    Внутри строки события отсортированы так, как их передали в from_events.
+    sched[i] — пара (day, amount) для строки i (срезы массивов, без копий);
+    sched[[i, j, ...]] и sched[a:b] — новый Schedules из выбранных строк.
+    """
+
+    __slots__ = ("offsets", "day", "amount", "doc")
+
+    def __init__(self, offsets, day, amount, doc=None):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.day = np.asarray(day, dtype=np.int32)
+        kopeks = isinstance(amount, np.ndarray) and amount.dtype == np.int64
+        self.amount = amount if kopeks else np.asarray(amount, dtype=np.float64)
+        self.doc = None if doc is None else np.asarray(doc, dtype=object)
+
+    @classmethod
+    def from_events(cls, ev: pd.DataFrame, n: int, by=("date",)):
+        """
+        Из таблицы parse_schedule. Внутри строки события сортируются по by
+        (устойчиво: при равных ключах сохраняется порядок в ячейке).
+        """
+        ev = ev.sort_values(["row_id", *by], kind="stable")
+        return cls.from_arrays(
+            ev["row_id"].to_numpy(),
+            (ev["date"].to_numpy().astype("datetime64[D]") - EPOCH).astype(np.int32),
+            ev["amount"].to_numpy(),
+            n,
+            ev["doc_number"].to_numpy() if "doc_number" in ev else None,
+        )
+
+    @classmethod
+    def from_arrays(cls, rows, day, amount, n: int, doc=None):
+        """rows — номер строки каждого события, события уже сгруппированы по строкам."""
+        counts = np.bincount(np.asarray(rows, dtype=np.int64), minlength=n)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        return cls(offsets, day, amount, doc)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def counts(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def row_ids(self) -> np.ndarray:
+        """Номер строки для каждого события."""
+        return np.repeat(np.arange(len(self)), self.counts)
+
+    def __getitem__(self, i):
+        if isinstance(i, (int, np.integer)):
+            a, b = self.offsets[i], self.offsets[i + 1]
+            if self.doc is None:
+                return self.day[a:b], self.amount[a:b]
+            return self.day[a:b], self.amount[a:b], self.doc[a:b]
+        return self.take(np.arange(len(self))[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def take(self, rows) -> "Schedules":
+        """Подмножество строк в заданном порядке (строки могут повторяться)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        starts, counts = self.offsets[rows], self.counts[rows]
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        idx = np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])
+        doc = None if self.doc is None else self.doc[idx]
+        return Schedules(offsets, self.day[idx], self.amount[idx], doc)
+
+    def count_until(self, day) -> np.ndarray:
+        """Сколько событий каждой строки с днём <= day."""
+        return np.bincount(self.row_ids()[self.day <= day], minlength=len(self))
+
+    def head(self, counts) -> "Schedules":
+        """Первые counts[i] событий каждой строки (при сортировке по дате — известные на дату)."""
+        counts = np.minimum(np.asarray(counts, dtype=np.int64), self.counts)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        idx = np.repeat(self.offsets[:-1] - offsets[:-1], counts) + np.arange(offsets[-1])
+        doc = None if self.doc is None else self.doc[idx]
+        return Schedules(offsets, self.day[idx], self.amount[idx], doc)
+
+    def totals(self) -> np.ndarray:
+        """Сумма событий каждой строки (последовательно, в порядке хранения; копейки — точно)."""
+        if self.amount.dtype == np.int64:
+            cum = np.concatenate(([0], np.cumsum(self.amount)))
+            return cum[self.offsets[1:]] - cum[self.offsets[:-1]]
+        return np.bincount(self.row_ids(), weights=self.amount, minlength=len(self))
+
+    def kopeks(self) -> "Schedules":
+        """Те же графики с суммами в копейках int64 (money.to_kopeks); уже в копейках — как есть."""
+        if self.amount.dtype == np.int64:
+            return self
+        return Schedules(self.offsets, self.day, to_kopeks(self.amount), self.doc)
+
+    def nbytes(self) -> int:
+        return self.offsets.nbytes + self.day.nbytes + self.amount.nbytes
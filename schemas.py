@@ -0,0 +1,174 @@
+# Реестр схем исходных листов.
+# Для каждого источника: лист, строка заголовка, нужные столбцы с типами,
+# синонимы заголовков и значения для пропусков. ingest читает лист по схеме:
+# лишние столбцы не разбираются, типы приводятся один раз при чтении,
+# а отсутствующий столбец обнаруживается сразу по строке заголовка.
+#
+# Типы столбцов (политика типов: измерения — category, свободный текст —
+# строки Arrow, даты — datetime64; группировки идут по целым кодам):
+#   None       — оставить как прочитано
+#   "str"      — astype(str) (пропуски становятся 'nan', как в скриптах)
+#   "key"      — astype(str) + category: ключ группировки с небольшим числом значений
+#   "category" — category, пропуски остаются пропусками
+#   "text"     — строки в Arrow (string[pyarrow]), без pyarrow — object
+#   "num"      — pd.to_numeric, нечисловое значение сразу даёт ошибку
+#   "date"     — pd.to_datetime (dayfirst из схемы), datetime64
+
+import re
+
+# Синонимы заголовков выгрузки 1С (раньше жили в dag.py → build_alias_map)
+DZ_1C_ALIASES = {
+    "Клиент.Новый клиент сезона": "Новый клиент сезона",
+    "Контрагент.Сокращенное наименование": "Контрагент.Сокращенное юр. наименование",
+    "Общая дебиторская задолженность,руб": "Общая дебиторская задолженность, руб",
+}
+
+SCHEMAS = {
+    # ---------- Выгрузка 1С: ДЗ_1С_НОВЫЙ (XLSX).xlsx ----------
+    # Скрипты ДЗ пишут в отчёт все столбцы, поэтому keep_all: схема только
+    # проверяет обязательные столбцы и переименовывает синонимы.
+    "ДЗ_1С": {
+        "sheet": "TDSheet",
+        "header": 2,
+        "keep_all": True,
+        "columns": {
+            "Заказ клиента": None,
+            "Регион.Наименование": None,
+        },
+        "aliases": DZ_1C_ALIASES,
+    },
+
+    # ---------- ABCD: Управление клиентской базой ABC Исх.xlsx ----------
+    "ABCD.data_товар": {
+        "sheet": "data_товар",
+        "header": 0,
+        "columns": {
+            "Дивизион": "key",
+            "Регион.Наименование": "key",
+            "Торговый представитель": "key",
+            "Клиент": "key",
+            "Канал продаж": "category",
+            "Вид продаж": "category",
+            "Дата": "date",
+            "Сезон": None,
+            "Заказ клиента": "text",
+            "Номенклатура.Позиция классификатора": "category",
+            "Группа аналитического учета": "category",
+            "Цена": "num",
+            "Цена по прайсу": "num",
+            "Количество заказано": "num",
+            "Сумма заказанной номенклатуры": "num",
+        },
+    },
+    "ABCD.Исход_заказ_с_оплатами": {
+        "sheet": "Исход_заказ_с_оплатами",
+        "header": 0,
+        "dayfirst": True,
+        "columns": {
+            "Клиент": "key",
+            "Дата": "date",
+            "Канал продаж": "key",
+            "Посевные площади. Га (Общие)": "num",
+            "Сегмент по площадям (ШАНС)": None,
+        },
+    },
+    "ABCD.Исход_ДЗ": {
+        "sheet": "Исход_ДЗ",
+        "header": 0,
+        "columns": {
+            "Дивизион": "category",
+            "Регион.Наименование": "category",
+            "Клиент": "category",
+            "Сезон": None,
+            "Торговый представитель": "category",
+            "Вид продаж": "category",
+            "Отгрузка по дням (факт)": "str",
+        },
+    },
+    "ABCD.Ключи": {
+        "sheet": "Ключи",
+        "header": 0,
+        "columns": {
+            "ФИО": None,
+            "Должность": None,
+            "Стаж в Ко (годы)": None,
+        },
+    },
+
+    # ---------- Книга продаж: data_заказ / data_товар / планы ----------
+    "Бонусы.data_заказ": {
+        "sheet": "data_заказ",
+        "header": 0,
+        "columns": {
+            "Дата": "date",
+            "Сезон": None,
+            "Канал продаж": None,
+            "Вид продаж": None,
+            "Заказ клиента": None,
+            "Номер": None,
+            "Клиент": None,
+            "Торговый представитель (ЛИТ)": None,
+            "Состояние заказа": None,
+            "Заказано": "num",
+            "Отгружено": "num",
+            "Оплачено": "num",
+            "% АС1": "num",
+            "Сумма бонуса АС1": "num",
+        },
+        "fill": {"Заказано": 0, "Отгружено": 0, "Оплачено": 0, "% АС1": 0, "Сумма бонуса АС1": 0},
+    },
+    "Бонусы.data_товар": {
+        "sheet": "data_товар",
+        "header": 0,
+        "columns": {
+            "Сезон": None,
+            "Заказ клиента": None,
+            "Номер": None,
+            "Группа аналитического учета": None,
+            "Номенклатура.Позиция классификатора": None,
+            "Цена": "num",
+            "Цена по прайсу": "num",
+            "Количество заказано": "num",
+            "Количество отгружено": "num",
+            "Отгружено руб": "num",
+        },
+        "fill": {"Количество отгружено": 0, "Отгружено руб": 0},
+    },
+    # Планы для расчёта бонусов: лист целиком (как read_excel(skiprows=1)) —
+    # скрипт сам ищет столбцы по вхождению ('Торговый представитель', 'Канал',
+    # 'Сезон', 'Итого'/'План'), поэтому обязательных столбцов нет.
+    "Бонусы.Планы": {
+        "sheet": "Планы скорректированные в минус",
+        "header": 1,
+        "keep_all": True,
+        "columns": {},
+    },
+    # Планы для отчёта по продажам: заголовок во 2-й строке, берутся столбцы
+    # A:R (как usecols='A:R'). Отчёт выгружает план целиком, поэтому keep_all.
+    "Планы скорректированные в минус": {
+        "sheet": "Планы скорректированные в минус",
+        "header": 1,
+        "max_col": 18,
+        "keep_all": True,
+        "columns": {
+            "Сезон": None,
+        },
+    },
+}
+
+
+def normalize_header(x) -> str:
+    """Заголовок без лишних пробелов: обрезка краёв и схлопывание пробелов/переносов."""
+    if x is None:
+        return ""
+    return re.sub(r"\s+", " ", str(x).strip())
+
+
+def header_aliases(name: str) -> dict:
+    """Синонимы заголовков источника: {вариант заголовка: каноническое имя}."""
+    return dict(SCHEMAS[name].get("aliases", {}))
+
+
+def canonical_header(h, aliases: dict) -> str:
+    h0 = normalize_header(h)
+    return aliases.get(h0, h0)
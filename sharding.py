@@ -0,0 +1,117 @@
+# Расчёт по шардам строк в пуле процессов.
+# Проценты, дни просрочки и коммерческий кредит считаются по каждой строке
+# (заказу, договору) независимо от остальных, поэтому строки делятся на
+# непрерывные диапазоны — шарды — с примерно равным числом событий графиков,
+# и каждый шард считается в отдельном процессе тем же ядром, что и в одном
+# процессе. Результаты собираются по порядку шардов, т.е. в исходном порядке
+# строк, и совпадают с однопроцессным расчётом: суммы внутри строки идут в том
+# же порядке. В процессы передаются только срезы массивов Schedules и
+# аргументы ядра — DataFrame не сериализуются.
+#
+# Ядро — функция уровня модуля (в процесс передаётся по имени); вызывающий
+# скрипт должен быть защищён `if __name__ == "__main__":`.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from schedules import Schedules
+
+SHARDS_PER_WORKER = 4   # шардов на процесс: выравнивает загрузку при неравных строках
+
+
+def cpu_count() -> int:
+    # Доступные процессу ядра (на Windows sched_getaffinity нет)
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def resolve_workers(workers) -> int:
+    """Число процессов: None или 0 — по числу ядер."""
+    return cpu_count() if not workers else int(workers)
+
+
+def event_weights(*scheds: Schedules) -> np.ndarray:
+    """Вес строки — число событий всех её графиков (+1, чтобы делились и пустые строки)."""
+    return 1 + sum(s.counts for s in scheds)
+
+
+def shard_bounds(weights, shards: int) -> np.ndarray:
+    """
+    Границы шардов [0, b1, ..., n]: непрерывные диапазоны строк с примерно равной
+    суммой weights. Зависят только от weights и shards.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    n = len(weights)
+    cum = np.cumsum(weights)
+    total = cum[-1] if n else 0.0
+    cuts = np.searchsorted(cum, total * np.arange(1, shards) / shards, side="left") + 1
+    return np.unique(np.concatenate(([0], np.minimum(cuts, n), [n])))
+
+
+def take_rows(value, a: int, b: int):
+    """
+    Значение по строкам [a, b): Schedules и массивы — срезом по первой оси,
+    списки — поэлементно, остальное (числа, календари ставок) — как есть.
+    """
+    if isinstance(value, Schedules):
+        return value[a:b]
+    if isinstance(value, (list, tuple)):
+        return type(value)(take_rows(v, a, b) for v in value)
+    if isinstance(value, np.ndarray) and value.ndim > 0:
+        return value[a:b]
+    return value
+
+
+def _call(kernel, scheds, args):
+    # выполняется в процессе-работнике
+    return kernel(*scheds, *args)
+
+
+def map_shards(kernel, scheds, args=(), per_row=(), workers=1, bounds=None):
+    """
+    kernel(*scheds[a:b], *args) по шардам строк; выдаёт (a, b, результат) по порядку строк.
+    scheds — Schedules одной длины; per_row — номера аргументов в args, заданных
+    по строкам (режутся вместе со строками, см. take_rows).
+    workers — число процессов (1 — в текущем процессе, None/0 — по числу ядер).
+    bounds — свои границы шардов (например, пачки по памяти); по умолчанию при
+    workers > 1 — SHARDS_PER_WORKER шардов на процесс с равным числом событий,
+    при workers == 1 — все строки одним куском.
+    """
+    n = len(scheds[0])
+    workers = resolve_workers(workers)
+    if bounds is None:
+        bounds = [0, n] if workers <= 1 else shard_bounds(event_weights(*scheds), workers * SHARDS_PER_WORKER)
+    bounds = np.asarray(bounds).tolist()
+    jobs = list(zip(bounds[:-1], bounds[1:]))
+
+    def shard(a, b):
+        sub = [s[a:b] for s in scheds]
+        return sub, [take_rows(v, a, b) if i in per_row else v for i, v in enumerate(args)]
+
+    if workers <= 1 or len(jobs) <= 1:
+        for a, b in jobs:
+            # весь диапазон — без срезов, как при прямом вызове ядра
+            sub, sub_args = (scheds, args) if (a, b) == (0, n) else shard(a, b)
+            yield a, b, kernel(*sub, *sub_args)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        futures = [pool.submit(_call, kernel, *shard(a, b)) for a, b in jobs]
+        for (a, b), f in zip(jobs, futures):
+            yield a, b, f.result()
+
+
+def _concat(parts):
+    if isinstance(parts[0], tuple):
+        return tuple(_concat(list(p)) for p in zip(*parts))
+    return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+def run_sharded(kernel, scheds, args=(), per_row=(), workers=1):
+    """
+    map_shards с результатами, склеенными по строкам: ядро возвращает массив
+    по строкам (или кортеж таких массивов) — результат той же формы для всех строк.
+    """
+    return _concat([res for _, _, res in map_shards(kernel, scheds, args, per_row, workers)])
@@ -0,0 +1,236 @@
+# Этапы расчёта с кэшем промежуточных таблиц на диске.
+# Скрипт делится на именованные этапы: этап — функция, которая получает
+# таблицы предыдущих этапов и параметры и возвращает {имя: DataFrame}.
+# Результат этапа сохраняется в колоночный кэш (ingest.write_frame: Parquet,
+# если установлен pyarrow, иначе pickle) под ключом — хэшем имени этапа,
+# кода, параметров и ключей входных таблиц. Ключ источника — отпечаток файла
+# (размер, mtime, хэш содержимого).
+# Код в ключе: исходный текст функции этапа и всех функций и констант модуля
+# скрипта, до которых она доходит, плюс хэш содержимого загруженных локальных
+# модулей (regions, schemas, ingest, ...). Правка вспомогательной функции
+# пересчитывает только этапы, которые её используют; правка локального
+# модуля — все этапы.
+# Поэтому при правке параметра позднего этапа ранние этапы берутся из кэша,
+# а пересчитываются только этот этап и зависящие от него. Этапы ленивые:
+# считаются (или читаются из кэша) при первом обращении к их таблицам.
+
+import hashlib
+import inspect
+import json
+import os
+import sys
+import types
+from pathlib import Path
+
+import pandas as pd
+
+from ingest import CACHE_DIR, file_fingerprint, read_frame, write_frame
+from staging import stage as stage_file
+
+STAGE_DIR = CACHE_DIR / "stages"
+STAGE_KEEP = 4             # сколько последних вариантов этапа хранить на диске
+LOCAL_DIR = Path(__file__).resolve().parent
+
+
+def _digest(*parts) -> str:
+    h = hashlib.blake2b(digest_size=12)
+    for p in parts:
+        h.update(json.dumps(p, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _source(func) -> str:
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):
+        return func.__qualname__
+
+
+def _value(v):
+    # множества — в отсортированном виде: порядок их repr меняется между запусками
+    if isinstance(v, (set, frozenset)):
+        return sorted(map(repr, v))
+    return repr(v)
+
+
+def _code(func) -> str:
+    """
+    Хэш кода func: её исходный текст и всё, до чего она доходит в своём
+    модуле — функции (с умолчаниями аргументов) и значения констант.
+    Импортированные функции и модули сюда не входят (см. _local_modules).
+    """
+    module = func.__module__
+    names = func.__globals__
+    seen, parts, todo = set(), [], [func]
+    while todo:
+        obj = todo.pop()
+        if isinstance(obj, types.FunctionType):
+            if obj.__module__ != module:
+                continue
+            parts.append(_source(obj))
+            parts.append(_value(obj.__defaults__))
+            codes = [obj.__code__]
+            while codes:
+                code = codes.pop()
+                for name in code.co_names:
+                    if name in names and name not in seen:
+                        seen.add(name)
+                        todo.append(names[name])
+                codes.extend(c for c in code.co_consts if isinstance(c, types.CodeType))
+        elif isinstance(obj, type):
+            if obj.__module__ == module:
+                parts.append(_source(obj))
+        elif not isinstance(obj, types.ModuleType) and not callable(obj):
+            parts.append(_value(obj))
+    return _digest(parts)
+
+
+_file_hashes = {}
+
+
+def _local_modules(skip) -> str:
+    """Хэш содержимого загруженных модулей из папки скриптов, кроме skip."""
+    files = sorted(
+        str(Path(m.__file__).resolve()) for m in list(sys.modules.values())
+        if getattr(m, "__file__", None) and getattr(m, "__name__", None) != skip
+        and Path(m.__file__).resolve().parent == LOCAL_DIR
+    )
+    for f in files:
+        if f not in _file_hashes:
+            _file_hashes[f] = hashlib.blake2b(Path(f).read_bytes(), digest_size=12).hexdigest()
+    return _digest({Path(f).name: _file_hashes[f] for f in files})
+
+
+def _load_json(path: Path) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_json(path: Path, data: dict):
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+class Output:
+    """Таблица name результата этапа."""
+
+    __slots__ = ("stage", "name")
+
+    def __init__(self, stage, name):
+        self.stage = stage
+        self.name = name
+
+    @property
+    def key(self) -> str:
+        return f"{self.stage.key}:{self.name}"
+
+    def get(self) -> pd.DataFrame:
+        return self.stage.frames()[self.name]
+
+
+class Stage:
+    """
+    Результат этапа: ключ и таблицы. Таблицы считаются функцией этапа или
+    читаются из кэша при первом обращении (frames / stage[имя].get()).
+    """
+
+    def __init__(self, pipeline, name, key, compute, persist=True):
+        self.pipeline = pipeline
+        self.name = name
+        self.key = key
+        self._compute = compute
+        self._persist = persist
+        self._frames = None
+
+    def __getitem__(self, name) -> Output:
+        return Output(self, name)
+
+    def _meta_path(self) -> Path:
+        return self.pipeline.cache_dir / f"{self.name}-{self.key}.json"
+
+    def _cached(self):
+        meta = _load_json(self._meta_path())
+        files = {k: self.pipeline.cache_dir / v for k, v in meta.get("frames", {}).items()}
+        if not files or not all(p.exists() for p in files.values()):
+            return None
+        return {k: read_frame(p) for k, p in files.items()}
+
+    def _store(self, frames: dict):
+        cache_dir = self.pipeline.cache_dir
+        files = {k: write_frame(df, cache_dir / f"{self.name}-{self.key}-{k}").name for k, df in frames.items()}
+        _save_json(self._meta_path(), {"stage": self.name, "frames": files})
+        # старые варианты этапа: оставляем STAGE_KEEP последних
+        metas = sorted(cache_dir.glob(f"{self.name}-*.json"), key=lambda p: p.stat().st_mtime_ns, reverse=True)
+        for old in metas[STAGE_KEEP:]:
+            for name in _load_json(old).get("frames", {}).values():
+                (cache_dir / name).unlink(missing_ok=True)
+            old.unlink(missing_ok=True)
+
+    def frames(self) -> dict:
+        if self._frames is None:
+            frames = self._cached() if self._persist and self.pipeline.enabled else None
+            if frames is None:
+                if self._persist:
+                    print(f"Этап '{self.name}': расчёт")
+                frames = self._compute()
+                if self._persist and self.pipeline.enabled:
+                    self._store(frames)
+            self._frames = frames
+        return self._frames
+
+
+class Pipeline:
+    """
+    Набор этапов одного скрипта.
+      cache_dir — папка кэша этапов
+      enabled   — False: всё считается заново, кэш не читается и не пишется
+    """
+
+    def __init__(self, cache_dir=STAGE_DIR, enabled=True):
+        self.cache_dir = Path(cache_dir)
+        self.enabled = enabled
+        if enabled:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _file_fp(self, path) -> dict:
+        # отпечаток локальной копии; хэш пересчитывается, только если файл изменился
+        local = stage_file(path)
+        known_path = self.cache_dir / "sources.json"
+        known = _load_json(known_path) if self.enabled else {}
+        fp = file_fingerprint(local, known.get(local))
+        if self.enabled and known.get(local) != fp:
+            known[local] = fp
+            _save_json(known_path, known)
+        return fp
+
+    def source(self, name, path, load, params=None) -> Stage:
+        """
+        Исходный файл: load() -> {имя: DataFrame}. В кэш этапов не пишется и
+        читается, только если нужен пересчитываемому этапу; ключ — отпечаток
+        файла и params.
+        """
+        key = _digest("source", name, _local_modules(load.__module__), _code(load),
+                      self._file_fp(path)["hash"], params or {})
+        return Stage(self, name, key, load, persist=False)
+
+    def stage(self, name, func, inputs=None, params=None) -> Stage:
+        """
+        Этап name: func(**таблицы inputs, **params) -> {имя: DataFrame}.
+        inputs — {аргумент: Output}; params — JSON-совместимые значения.
+        Функция этапа не должна менять входные таблицы.
+        """
+        inputs = inputs or {}
+        params = params or {}
+        key = _digest(name, pd.__version__, _local_modules(func.__module__), _code(func), params,
+                      {arg: out.key for arg, out in inputs.items()})
+
+        def compute():
+            return func(**{arg: out.get() for arg, out in inputs.items()}, **params)
+
+        return Stage(self, name, key, compute)
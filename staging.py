@@ -0,0 +1,123 @@
+# Локальное зеркало входных файлов с сетевой папки (\\192.168.1.211\...).
+# Каждый нужный файл копируется в локальный кэш один раз и дальше все
+# читатели (pandas, openpyxl, Excel) работают с локальной копией.
+# Копия сверяется по размеру, mtime и хэшу: пока файл на сервере не менялся,
+# повторный запуск делает только stat() и ни одного чтения по сети.
+
+import fnmatch
+import hashlib
+import json
+import os
+from pathlib import Path
+
+MIRROR_DIR = Path(__file__).with_name("_cache") / "mirror"
+HASH_CHUNK = 1 << 20       # читаем файл блоками по 1 МБ
+
+# Уже подготовленные в этом запуске файлы: {абсолютный путь: локальная копия}
+_staged = {}
+
+
+def file_hash(path) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _copy_with_hash(src, dst) -> str:
+    # Одно чтение источника: копируем и считаем хэш в одном проходе
+    h = hashlib.blake2b(digest_size=16)
+    with open(src, "rb") as fi, open(dst, "wb") as fo:
+        for chunk in iter(lambda: fi.read(HASH_CHUNK), b""):
+            h.update(chunk)
+            fo.write(chunk)
+    return h.hexdigest()
+
+
+def _stat_dict(st) -> dict:
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _load_meta(meta_path: Path) -> dict:
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def stage(path, mirror_dir=MIRROR_DIR) -> str:
+    """
+    Возвращает путь к локальной копии файла path.
+    Копия обновляется, только если на источнике изменились размер или mtime;
+    после копирования хэш сверяется с прежним (файл могли просто "потрогать").
+    Локальная копия проверяется по размеру и mtime, а при расхождении — по хэшу.
+    Путь, который уже лежит в зеркале, возвращается как есть.
+    """
+    src = os.path.abspath(path)
+    if src in _staged:
+        return _staged[src]
+
+    mirror_dir = Path(mirror_dir)
+    if Path(src).is_relative_to(os.path.abspath(mirror_dir)):
+        return src
+    src_dir_key = hashlib.blake2b(os.path.dirname(src).encode("utf-8"), digest_size=6).hexdigest()
+    local_dir = mirror_dir / src_dir_key
+    local_dir.mkdir(parents=True, exist_ok=True)
+    local = local_dir / os.path.basename(src)
+    meta_path = local_dir / (local.name + ".json")
+
+    meta = _load_meta(meta_path)
+    src_st = _stat_dict(os.stat(src))
+    fresh = changed = False
+    if meta.get("source") == src_st and local.exists():
+        local_st = _stat_dict(os.stat(local))
+        if local_st == meta.get("local"):
+            fresh = True
+        elif local_st["size"] == src_st["size"] and file_hash(local) == meta.get("hash"):
+            # копию "потрогали" локально, содержимое то же
+            meta["local"] = local_st
+            fresh = changed = True
+
+    if not fresh:
+        tmp = local.with_name(local.name + ".part")
+        digest = _copy_with_hash(src, tmp)
+        # mtime копии = mtime источника: ниже по цепочке кэши смотрят на mtime
+        os.utime(tmp, ns=(src_st["mtime_ns"], src_st["mtime_ns"]))
+        os.replace(tmp, local)
+        if digest != meta.get("hash"):
+            print(f"Скопирован локально: {src} -> {local}")
+        meta = {"path": src, "source": src_st, "hash": digest, "local": _stat_dict(os.stat(local))}
+        changed = True
+
+    if changed:
+        tmp_meta = meta_path.with_suffix(".tmp")
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_meta, meta_path)
+
+    _staged[src] = _staged[os.path.abspath(local)] = str(local)
+    return str(local)
+
+
+def latest_file(folder, pattern, key="ctime"):
+    """
+    Самый новый файл в папке по маске (по времени создания или изменения).
+    Один проход os.scandir: на сетевой папке время берётся из листинга
+    каталога без отдельного stat() на каждый файл. Временные файлы Excel (~$)
+    пропускаются. Если подходящих файлов нет, возвращает None.
+    """
+    attr = "st_ctime" if key == "ctime" else "st_mtime"
+    best, best_t = None, None
+    with os.scandir(folder) as it:
+        for entry in it:
+            name = entry.name
+            if name.startswith("~$") or not fnmatch.fnmatch(name, pattern):
+                continue
+            if not entry.is_file():
+                continue
+            t = getattr(entry.stat(), attr)
+            if best_t is None or t > best_t:
+                best, best_t = entry.path, t
+    return best
@@ -0,0 +1,144 @@
+# Потоковая запись отчётов.
+# pd.ExcelWriter собирает лист целиком в памяти (DataFrame + дерево ячеек
+# openpyxl), поэтому большая детализация занимает память пропорционально
+# числу строк. Здесь книга открывается в режиме openpyxl write_only: каждый
+# лист пишется во временный файл пачками строк, в памяти держится только
+# текущая пачка. Листы можно заполнять в любом порядке — в книге они
+# идут в порядке создания.
+#
+# Рядом с книгой ту же таблицу можно писать "сайдкаром" — Parquet (если
+# установлен pyarrow) или CSV — тоже пачками.
+
+from pathlib import Path
+
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# Оформление заголовка — как у DataFrame.to_excel
+_THIN = Side(style="thin")
+HEADER_FONT = Font(bold=True)
+HEADER_BORDER = Border(left=_THIN, right=_THIN, top=_THIN, bottom=_THIN)
+HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="top")
+
+
+def _cell_values(batch: pd.DataFrame):
+    # строки пачки как списки значений; пропуски (NaN/NaT/None) — пустые ячейки
+    values = batch.astype(object).to_numpy()
+    values[pd.isna(values)] = None
+    return values.tolist()
+
+
+class SheetStream:
+    """Лист книги write_only: заголовок при создании, дальше — пачки строк (write)."""
+
+    def __init__(self, ws, columns):
+        self.ws = ws
+        self.columns = list(columns)
+        self.rows = 0
+        header = []
+        for name in self.columns:
+            cell = WriteOnlyCell(ws, value=name)
+            cell.font, cell.border, cell.alignment = HEADER_FONT, HEADER_BORDER, HEADER_ALIGNMENT
+            header.append(cell)
+        ws.append(header)
+
+    def write(self, batch: pd.DataFrame, chunk_rows=50_000):
+        # большой DataFrame переводится в значения ячеек частями
+        batch = batch[self.columns]
+        for start in range(0, len(batch), chunk_rows):
+            for row in _cell_values(batch.iloc[start:start + chunk_rows]):
+                self.ws.append(row)
+        self.rows += len(batch)
+
+
+class XlsxStream:
+    """
+    Книга xlsx с потоковой записью листов:
+        with XlsxStream(path) as book:
+            sheet = book.sheet("Детализация", columns)
+            for batch in ...:
+                sheet.write(batch)
+    Файл сохраняется при выходе из with (при ошибке — не сохраняется).
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.book = Workbook(write_only=True)
+
+    def sheet(self, title, columns) -> SheetStream:
+        return SheetStream(self.book.create_sheet(title), columns)
+
+    def write_frame(self, title, df: pd.DataFrame) -> SheetStream:
+        """Лист целиком из DataFrame (как df.to_excel(..., index=False))."""
+        sheet = self.sheet(title, df.columns)
+        sheet.write(df)
+        return sheet
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.book.save(self.path)
+        else:
+            self.book.close()
+
+
+class TableSidecar:
+    """
+    Та же таблица рядом с книгой: Parquet (группа строк на пачку), без pyarrow — CSV.
+    text — столбцы, которые пишутся строками (в выгрузках номера и названия
+    бывают то числом, то строкой, а Parquet требует один тип на столбец).
+    """
+
+    def __init__(self, path_base, text=()):
+        self.path_base = Path(path_base)
+        self.text = list(text)
+        self.path = self.path_base.with_suffix(".parquet" if HAS_PYARROW else ".csv")
+        self._writer = None
+        self._schema = None
+        self._started = False
+
+    def _prepare(self, batch: pd.DataFrame) -> pd.DataFrame:
+        if not self.text:
+            return batch
+        batch = batch.copy()
+        for c in self.text:
+            s = batch[c]
+            batch[c] = s.astype(str).where(s.notna(), None)
+        return batch
+
+    def write(self, batch: pd.DataFrame):
+        batch = self._prepare(batch)
+        if HAS_PYARROW:
+            table = pa.Table.from_pandas(batch, schema=self._schema, preserve_index=False)
+            if self._writer is None:
+                self._schema = table.schema
+                self._writer = pq.ParquetWriter(self.path, self._schema)
+            self._writer.write_table(table)
+        else:
+            batch.to_csv(
+                self.path, mode="a" if self._started else "w", header=not self._started,
+                index=False, encoding="utf-8" if self._started else "utf-8-sig",
+            )
+        self._started = True
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
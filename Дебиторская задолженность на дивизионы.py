@@ -1,4 +1,3 @@
-import pandas as pd
 import xlwings as xw
 import os
 import glob
@@ -7,6 +6,10 @@ import shutil  # для переноса старых файлов в архив
 from datetime import datetime
 from colorama import init, Fore  # для цветного вывода в консоль
 
+from ingest import read_sheets
+from regions import REGION_TO_DIVISION, division_of, merge_region_parts
+from staging import latest_file, stage
+
 # Инициализация colorama
 init(autoreset=True)
 
@@ -16,81 +19,25 @@ def payment_by_division():
 
     # --- Шаг 1. Находим последний сохранённый файл в папке ---
     folder_path = r"\\192.168.1.211\Аналитический центр\Отчёты\ДЗ\Контроль сроков оплаты"
-    list_of_files = glob.glob(os.path.join(folder_path, 'Отчет по ДЗ*.xlsx'))
-    source_file = max(list_of_files, key=os.path.getmtime)
+    source_file = latest_file(folder_path, 'Отчет по ДЗ*.xlsx', key='mtime')
+    if source_file is None:
+        raise FileNotFoundError(f"В папке нет файлов 'Отчет по ДЗ*.xlsx': {folder_path}")
     print(f"{Fore.GREEN}Выбранный файл для обработки: {source_file}")
+    # pandas и Excel работают с локальной копией файла
+    source_file = stage(source_file)
 
-    # --- Шаг 2. Словарь соответствия "Регион -> Дивизион" ---
-    region_division_map = {
-        "Азербайджан": "СНГ",
-        "Алтайский край": "Дивизион СИБИРЬ",
-        "Амурская область": "Дивизион ДАЛЬНИЙ ВОСТОК",
-        "Астраханская область": "Дивизион ЮГ",
-        "Белгородская область": "Дивизион ЦЕНТР",
-        "Белоруссия": "СНГ",
-        "Брянская область": "Дивизион ЦЕНТР",
-        "Владимирская область": "Дивизион ЦЕНТР",
-        "Волгоградская область": "Дивизион ЮГ",
-        "Воронежская область": "Дивизион ЦЕНТР",
-        "Грузия": "СНГ",
-        "ДНР": "Дивизион ЦЕНТР",
-        "Запорожье/Херсон": "Дивизион ЮГ",
-        "Иркутская область": "Дивизион СИБИРЬ",
-        "Казахстан": "СНГ",
-        "Калининградская область": "Дивизион ЦЕНТР",
-        "Кемеровская область": "Дивизион СИБИРЬ",
-        "Кировская область": "Дивизион ПОВОЛЖЬЕ",
-        "Краснодарский край 1": "Дивизион ЮГ",
-        "Краснодарский край 2": "Дивизион ЮГ",
-        "Красноярский край": "Дивизион СИБИРЬ",
-        "Курганская область": "Дивизион УРАЛ",
-        "Курская область": "Дивизион ЦЕНТР",
-        "Липецкая область": "Дивизион ЦЕНТР",
-        "ЛНР": "Дивизион ЦЕНТР",
-        "ЛНР/ДНР": "Дивизион ЦЕНТР",
-        "Московская область": "Дивизион ЦЕНТР",
-        "Нижегородская область": "Дивизион ПОВОЛЖЬЕ",
-        "Новосибирская область": "Дивизион СИБИРЬ",
-        "Омская область": "Дивизион СИБИРЬ",
-        "Оренбургская область": "Дивизион ПОВОЛЖЬЕ",
-        "Орловская область": "Дивизион ЦЕНТР",
-        "Пензенская область": "Дивизион ПОВОЛЖЬЕ",
-        "Приморский край": "Дивизион ДАЛЬНИЙ ВОСТОК",
-        "Республика Башкортостан": "Дивизион ПОВОЛЖЬЕ",
-        "Республика Дагестан": "Дивизион ЮГ",
-        "Республика Калмыкия": "Дивизион ЮГ",
-        "Республика Крым": "Дивизион ЮГ",
-        "Республика Мордовия": "Дивизион ПОВОЛЖЬЕ",
-        "Республика Татарстан": "Дивизион ПОВОЛЖЬЕ",
-        "Республика Чувашия": "Дивизион ПОВОЛЖЬЕ",
-        "Ростовская область 1": "Дивизион ЮГ",
-        "Ростовская область 2": "Дивизион ЮГ",
-        "Рязанская область": "Дивизион ЦЕНТР",
-        "Самарская область": "Дивизион ПОВОЛЖЬЕ",
-        "Саратовская область": "Дивизион ПОВОЛЖЬЕ",
-        "Свердловская область": "Дивизион УРАЛ",
-        "Ставропольский край": "Дивизион ЮГ",
-        "Тамбовская область": "Дивизион ЦЕНТР",
-        "Томская область": "Дивизион СИБИРЬ",
-        "Тульская область": "Дивизион ЦЕНТР",
-        "Тюменская область": "Дивизион УРАЛ",
-        "Ульяновская область": "Дивизион ПОВОЛЖЬЕ",
-        "Челябинская область": "Дивизион УРАЛ",
-        "Беларусь": "СНГ",
-        "Армения": "СНГ"
-    }
+    # --- Шаг 2. Соответствие "Регион -> Дивизион" берётся из общего справочника regions.py ---
 
     # --- Шаг 3. Читаем исходные данные в DataFrame ---
-    df = pd.read_excel(source_file, sheet_name='TDSheet', header=0)
+    df = read_sheets(source_file, {'TDSheet': None})['TDSheet']
     # Объединяем данные для Алтайского края 1 и Алтайского края 2
-    df['Регион.Наименование'] = df['Регион.Наименование'].replace(
-        {'Алтайский край 1': 'Алтайский край', 'Алтайский край 2': 'Алтайский край'})
+    df['Регион.Наименование'] = merge_region_parts(df['Регион.Наименование'])
     # Переопределяем "Дивизион" по словарю
-    df['Дивизион'] = df['Регион.Наименование'].map(region_division_map)
+    df['Дивизион'] = division_of(df['Регион.Наименование'])
     df = df.dropna(subset=['Дивизион'])
 
     # --- Шаг 4. Используем полный список дивизионов из словаря (кроме СНГ) ---
-    all_divisions = list(set(region_division_map.values()))
+    all_divisions = list(set(REGION_TO_DIVISION.values()))
     if "СНГ" in all_divisions:
         all_divisions.remove("СНГ")
 
@@ -1,42 +1,28 @@
+import numpy as np
 import pandas as pd
-import re
-from datetime import datetime, date, timedelta
-
-# Очистка суммы
-def clean_amount_string(amt_str):
-    amt_str = str(amt_str).replace("\u00A0", "").replace("\u2007", "").replace("\u202F", "")
-    amt_str = re.sub(r"[^0-9\.,-]+", "", amt_str)
-    return amt_str.replace(",", ".")
-
-# Парсинг оплаты
-def parse_payment_info(cell, mode="plan", filter_past=False, today=None):
-    if pd.isna(cell) or str(cell).strip() == "":
-        return 0, None
-    lines = str(cell).splitlines()
-    records = []
-    for line in lines:
-        parts = re.split(r"\s*;\s*", line)
-        if len(parts) < 2:
-            continue
-        date_str = parts[0].strip()
-        amt_str = clean_amount_string(parts[1].strip())
-        try:
-            dt = datetime.strptime(date_str, "%d.%m.%Y").date()
-            amt = float(amt_str)
-        except:
-            continue
-        records.append((dt, amt))
-    if mode == "plan" and filter_past:
-        valid = [(dt, amt) for dt, amt in records if dt and dt <= today]
-        total_amount = sum(amt for dt, amt in valid)
-        date_val = min([dt for dt, amt in valid], default=None)
-    else:
-        total_amount = sum(amt for dt, amt in records)
-        if mode == "plan":
-            date_val = min([dt for dt, amt in records if dt], default=None)
-        else:
-            date_val = max([dt for dt, amt in records if dt], default=None)
-    return total_amount, date_val
+from datetime import datetime
+
+from debt import interest_at, overdue_as_of, overdue_fifo, overdue_fifo_incremental
+from ingest import CACHE_DIR, read_1c_export
+from money import from_kopeks
+from regions import division_of
+from schedules import Schedules, day_number, parse_schedule, schedule_totals, schedule_totals_at
+from sharding import run_sharded
+
+# Столбцы графиков, по которым считаются проценты и дни просрочки
+PLAN_COL = "Оплаты по дням (план)"
+FACT_COL = "Оплата по дням (факт)"
+PRESIDENT_RATE = 0.28  # годовая ставка для процентов по просрочке
+# Даты оценки для листа "История": долг, дни просрочки, проценты и статус на каждую
+# дату — как если бы отчёт строился в этот день (оплаты позже даты ещё не известны).
+AS_OF_DATES = []       # например: ["31.01.2025", "28.02.2025"]
+# Дни просрочки и проценты считаются по шардам строк в WORKERS процессах
+# (sharding.py; 1 — в текущем процессе, 0 — по числу ядер), результат тот же
+WORKERS = 1
+# При INCREMENTAL состояние FIFO сохраняется в _cache, и на следующий день дописываются
+# только новые оплаты; строки с изменённым планом пересчитываются целиком
+INCREMENTAL = False
+STATE_FILE = CACHE_DIR / "overdue_state.pkl"
 
 # Поиск колонки
 def find_column_by_keywords(df, keywords):
@@ -46,190 +32,115 @@ def find_column_by_keywords(df, keywords):
         raise KeyError(f"Столбец с ключами {keywords} не найден.")
     return matches[0]
 
-# Дни просрочки
-def calculate_group_overdue_days(row):
-    try:
-        plan_text = row.get("Оплаты по дням (план)")
-        fact_text = row.get("Оплата по дням (факт)")
-        if pd.isna(plan_text) or not isinstance(plan_text, str):
-            return 0
-
-        # Плановые оплаты
-        plan_records = []
-        for line in plan_text.splitlines():
-            parts = re.split(r"\s*;\s*", line)
-            if len(parts) >= 2:
-                try:
-                    dt = datetime.strptime(parts[0].strip(), "%d.%m.%Y").date()
-                    amt = float(clean_amount_string(parts[1].strip()))
-                    plan_records.append([dt, amt])
-                except:
-                    continue
-
-        # Фактические оплаты
-        fact_records = []
-        if isinstance(fact_text, str):
-            for line in fact_text.splitlines():
-                parts = re.split(r"\s*;\s*", line)
-                if len(parts) >= 2:
-                    try:
-                        dt = datetime.strptime(parts[0].strip(), "%d.%m.%Y").date()
-                        amt = float(clean_amount_string(parts[1].strip()))
-                        fact_records.append([dt, amt])
-                    except:
-                        continue
-
-        plan_records.sort()
-        fact_records.sort()
-        total_days = 0
-
-        for plan_date, plan_amt in plan_records:
-            if plan_amt <= 0:
-                continue
-
-            remaining_amt = plan_amt
-            i = 0
-
-            while i < len(fact_records) and remaining_amt > 0:
-                pay_date, pay_amt = fact_records[i]
-                apply_amt = min(remaining_amt, pay_amt)
-
-                if pay_date <= plan_date:
-                    remaining_amt -= apply_amt  # вовремя — без просрочки
-                else:
-                    days = (pay_date - plan_date).days
-                    total_days += days  # оплачено с просрочкой
-                    remaining_amt -= apply_amt
-
-                fact_records[i][1] -= apply_amt
-                if fact_records[i][1] <= 0:
-                    i += 1
-
-            # если часть не оплачена вообще
-            if remaining_amt > 0 and plan_date < today:
-                days = (today - plan_date).days
-                total_days += days
-
-        return total_days
-    except:
-        return 0
-
-# Проценты по каждой просроченной дате (группировка)
-def calculate_group_percentage(row):
-    try:
-        plan_text = row.get("Оплаты по дням (план)")
-        fact_text = row.get("Оплата по дням (факт)")
-        if pd.isna(plan_text) or not isinstance(plan_text, str):
-            return 0
-
-        # Плановые оплаты
-        plan_records = []
-        for line in plan_text.splitlines():
-            parts = re.split(r"\s*;\s*", line)
-            if len(parts) >= 2:
-                try:
-                    dt = datetime.strptime(parts[0].strip(), "%d.%m.%Y").date()
-                    amt = float(clean_amount_string(parts[1].strip()))
-                    plan_records.append([dt, amt])
-                except:
-                    continue
-
-        # Фактические оплаты
-        fact_records = []
-        if isinstance(fact_text, str):
-            for line in fact_text.splitlines():
-                parts = re.split(r"\s*;\s*", line)
-                if len(parts) >= 2:
-                    try:
-                        dt = datetime.strptime(parts[0].strip(), "%d.%m.%Y").date()
-                        amt = float(clean_amount_string(parts[1].strip()))
-                        fact_records.append([dt, amt])
-                    except:
-                        continue
-
-        plan_records.sort()
-        fact_records.sort()
-        total_interest = 0
-
-        for plan_date, plan_amt in plan_records:
-            if plan_amt <= 0:
-                continue
-
-            remaining_amt = plan_amt
-            i = 0
-
-            while i < len(fact_records) and remaining_amt > 0:
-                pay_date, pay_amt = fact_records[i]
-                apply_amt = min(remaining_amt, pay_amt)
-
-                if pay_date <= plan_date:
-                    # Оплачено в срок — проценты не начисляем
-                    remaining_amt -= apply_amt
-                else:
-                    # Оплачено с просрочкой
-                    delay_days = (pay_date - plan_date).days
-                    interest = apply_amt * (0.28 / 365) * delay_days
-                    total_interest += interest
-                    remaining_amt -= apply_amt
-
-                fact_records[i][1] -= apply_amt
-                if fact_records[i][1] <= 0:
-                    i += 1
-
-            # Если осталась непогашенная сумма — считаем проценты до today
-            if remaining_amt > 0 and plan_date < today:
-                delay_days = (today - plan_date).days
-                interest = remaining_amt * (0.28 / 365) * delay_days
-                total_interest += interest
-
-        return round(total_interest, 2)
-    except:
-        return 0
-
-# Статус оплаты
-def aggregated_status(row):
-    try:
-        plan_date = row.get("PlanDatePast")
-        fact_date = row.get("FactDateMax")
-        plan_amt = row.get("PlanAmountPast", 0)
-        fact_amt = row.get("FactAmountTotal", 0)
-        overdue_days = row.get("Агрегированные дни просрочки", 0)
-        full_date = row.get("PlanDateFull")
-
-        if pd.isna(plan_date):
-            return "Плановая дата не наступила"
-
-        plan_date = pd.to_datetime(plan_date).date()
-
-        # Если дата плана = сегодня — ещё можно оплатить
-        if plan_date == today:
-            return "Плановая дата не наступила"
-
-        # Если дата плана > сегодня
-        if plan_date > today:
-            if fact_amt >= row.get("PlanAmountFull", 0):
-                return "Все оплачено в срок"
-            return "Плановая дата не наступила"
-
-        # Если факт = 0 и дата прошла — это долг
-        if fact_amt == 0 and plan_date < today:
-            return "Есть долг"
-
-        # Всё оплачено, без просрочек
-        if row["Агрегированный долг"] == 0 and overdue_days == 0:
-            return "Все оплачено в срок"
-
-        # Всё оплачено, но с просрочкой
-        if row["Агрегированный долг"] == 0 and overdue_days > 0:
-            return "Все оплачено, но с просрочкой"
-
-        # Частично оплачено, но дата прошла
-        if row["Агрегированный долг"] > 0 and full_date > today:
-            return "Не все оплачено, просрочка"
-
-        return "Есть долг"
-    except:
-        return "Ошибка в расчёте статуса"
+# Дни просрочки и проценты по каждой строке — один проход FIFO по всем строкам
+# (debt.overdue_fifo); проценты = сумма * ставка/365 * дни по кускам просрочки,
+# сумма кусков строки округляется до копейки один раз (debt.interest_at)
+def overdue_metrics(plans, facts, today_day):
+    od = overdue_fifo(plans, facts, today_day)
+    percentage = from_kopeks(interest_at(od["rows"], od["base"], od["days"], od["since"], len(plans), PRESIDENT_RATE))
+    return od["overdue_days"], percentage
+
+# То же с продолжением из сохранённого состояния (debt.overdue_fifo_incremental);
+# keys — ключ каждой строки
+def overdue_metrics_incremental(keys, plans, facts, today_day):
+    od, stats = overdue_fifo_incremental(keys, plans, facts, today_day, STATE_FILE)
+    print(f"Просрочка: полный расчёт {stats['full']}, дописано {stats['advanced']}, без изменений {stats['reused']}")
+    percentage = from_kopeks(interest_at(od["rows"], od["base"], od["days"], od["since"], len(plans), PRESIDENT_RATE))
+    return od["overdue_days"], percentage
+
+# То же сразу на все даты оценки days (debt.overdue_as_of): результаты формы (n, len(days))
+def overdue_metrics_as_of(plans, facts, days):
+    od = overdue_as_of(plans, facts, days)
+    n, k = len(plans), len(days)
+    percentage = from_kopeks(interest_at(od["rows"], od["base"], od["days"], od["since"], n * k, PRESIDENT_RATE))
+    return od["overdue_days"], percentage.reshape(n, k)
+
+# Статус оплаты на дату today — по всем строкам сразу; условия проверяются по порядку.
+# today — одна дата или столбец дат по строкам g (история на даты оценки)
+def aggregated_status(g, today):
+    today = pd.to_datetime(today)
+    plan_date = pd.to_datetime(g["PlanDatePast"])
+    full_date = pd.to_datetime(g["PlanDateFull"])
+    fact_amt = g["FactAmountTotal"]
+    debt = g["Агрегированный долг"]
+    overdue_days = g["Агрегированные дни просрочки"]
+
+    conditions = [
+        # плановой даты нет или она сегодня — ещё можно оплатить
+        plan_date.isna() | (plan_date == today),
+        # дата плана > сегодня
+        (plan_date > today) & (fact_amt >= g.get("PlanAmountFull", 0)),
+        plan_date > today,
+        # факт = 0 и дата прошла — это долг
+        fact_amt == 0,
+        # всё оплачено, без просрочек / с просрочкой
+        (debt == 0) & (overdue_days == 0),
+        (debt == 0) & (overdue_days > 0),
+        # частично оплачено, но дата прошла
+        (debt > 0) & (full_date > today),
+    ]
+    choices = [
+        "Плановая дата не наступила",
+        "Все оплачено в срок",
+        "Плановая дата не наступила",
+        "Есть долг",
+        "Все оплачено в срок",
+        "Все оплачено, но с просрочкой",
+        "Не все оплачено, просрочка",
+    ]
+    return np.select(conditions, choices, default="Есть долг")
+
+# Суммы графиков — в копейках (parse_schedule(kopeks=True)): итоги по заказу и долг
+# считаются точно, поэтому "долг == 0" в статусе не зависит от копеечных хвостов float;
+# в рубли переводятся после агрегации.
+def to_rubles(g, cols=("PlanAmountPast", "FactAmountTotal", "Агрегированный долг")):
+    for c in cols:
+        g[c] = from_kopeks(g[c])
+    return g
+
+# Метрики по заказам на даты оценки dates: план и оплаты с датой ≤ даты оценки,
+# дни просрочки, проценты и статус — по известным на эту дату оплатам.
+# Итоги строк — ступенчатые функции по дате (schedules.schedule_totals_at), дни и
+# проценты — один проход FIFO на все даты (debt.overdue_as_of); длинная таблица
+# (строка отчёта × дата) собирается одной группировкой по (заказ, дата).
+def as_of_metrics(df, plan_ev, fact_ev, plans, facts, dates):
+    n, k = len(df), len(dates)
+    days = [day_number(d) for d in dates]
+    plan_amt, plan_date = schedule_totals_at(plan_ev, n, days, "min")
+    fact_amt, fact_date = schedule_totals_at(fact_ev, n, days, "max")
+    overdue_days, percentage = run_sharded(overdue_metrics_as_of, (plans, facts), (days,), workers=WORKERS)
+
+    # на ранней дате у заказа бывают строки и с датой, и без (None) — min/max по object
+    # с None падает, поэтому даты агрегируются как datetime и возвращаются в date/None
+    t = pd.DataFrame({
+        "Заказ": np.repeat(df["Заказ"].to_numpy(), k),
+        "_j": np.tile(np.arange(k), n),
+        "PlanAmountPast": plan_amt.ravel(),
+        "FactAmountTotal": fact_amt.ravel(),
+        "PlanDatePast": pd.to_datetime(pd.Series(plan_date.ravel())),
+        "FactDateMax": pd.to_datetime(pd.Series(fact_date.ravel())),
+        "PlanDateFull": pd.to_datetime(pd.Series(np.repeat(schedule_totals(plan_ev, n, "min")[1], k))),
+    })
+    date_cols = ["PlanDatePast", "FactDateMax", "PlanDateFull"]
+    g = t.groupby(["Заказ", "_j"], as_index=False).agg({
+        "PlanAmountPast": "sum", "FactAmountTotal": "sum", "PlanDatePast": "min", "FactDateMax": "max",
+        "PlanDateFull": "max",
+    })
+    for c in date_cols:
+        g[c] = g[c].dt.date.astype(object).where(g[c].notna(), None)
+    g["Агрегированный долг"] = (g["PlanAmountPast"] - g["FactAmountTotal"]).clip(lower=0)
+
+    # строки отчёта — как на основном листе (заказы по порядку, внутри — строки выгрузки),
+    # у каждой — даты по возрастанию
+    g["_g"] = np.arange(len(g)) // k
+    g = g.merge(pd.DataFrame({"Заказ": df["Заказ"].to_numpy(), "_row": np.arange(n)}), on="Заказ", how="left")
+    g = g.sort_values(["_g", "_row", "_j"], kind="stable").reset_index(drop=True)
+    rows, j = g["_row"].to_numpy(), g["_j"].to_numpy()
+    g.insert(1, "Дата оценки", np.array(dates, dtype=object)[j])
+    g["Агрегированные дни просрочки"] = overdue_days[rows, j]
+    g["Агрегированные проценты"] = percentage[rows, j]
+    g["Агрегированный статус оплаты"] = aggregated_status(g, g["Дата оценки"])
+    return to_rubles(g.drop(columns=["_j", "_g", "_row"]))
 
 # === MAIN ===
 if __name__ == "__main__":
@@ -238,89 +149,41 @@ if __name__ == "__main__":
     input_file = r"\\192.168.1.211\дебиторская задолженность\Отчеты\Выгрузка 1С\ДЗ_1С_НОВЫЙ (XLSX).xlsx"
     output_file = r"C:\Users\nkazakov\Downloads\Должник по ДЗ.xlsx"
 
-    df = pd.read_excel(input_file, header=2)
-    df.columns = df.columns.str.strip()
-    df = df.loc[:, ~df.columns.duplicated()]
+    df = read_1c_export(input_file)
 
     df["Заказ"] = df["Заказ клиента"].astype(str).str.strip()
     col_plan_name = find_column_by_keywords(df, ["по дням", "план"])
     col_fact_name = find_column_by_keywords(df, ["по дням", "факт"])
 
-    df[["PlanAmountPast", "PlanDatePast"]] = df[col_plan_name].apply(
-        lambda x: pd.Series(parse_payment_info(x, "plan", True, today)))
-    df[["PlanAmountFull", "PlanDateFull"]] = df[col_plan_name].apply(
-        lambda x: pd.Series(parse_payment_info(x, "plan", False)))
-    df[["FactAmountTotal", "FactDateMax"]] = df[col_fact_name].apply(
-        lambda x: pd.Series(parse_payment_info(x, "fact")))
+    # Графики разбираются один раз на столбец: таблицы событий (row_id, date, amount).
+    # Проценты и дни просрочки берут графики из столбцов PLAN_COL / FACT_COL.
+    n = len(df)
+    events = {c: parse_schedule(df[c], kopeks=True)
+              for c in dict.fromkeys([col_plan_name, col_fact_name, PLAN_COL, FACT_COL]) if c in df.columns}
+    plan_ev, fact_ev = events[col_plan_name], events[col_fact_name]
+
+    df["PlanAmountPast"], df["PlanDatePast"] = schedule_totals(plan_ev, n, "min", until=today)
+    df["PlanAmountFull"], df["PlanDateFull"] = schedule_totals(plan_ev, n, "min")
+    df["FactAmountTotal"], df["FactDateMax"] = schedule_totals(fact_ev, n, "max")
+
+    # для FIFO графики сортируются по дате, затем по сумме (как list.sort() по [дата, сумма])
+    empty = Schedules(np.zeros(n + 1), [], np.zeros(0, dtype=np.int64))
+    plans = Schedules.from_events(events[PLAN_COL], n, by=("date", "amount")) if PLAN_COL in events else empty
+    facts = Schedules.from_events(events[FACT_COL], n, by=("date", "amount")) if FACT_COL in events else empty
+    today_day = day_number(today)
 
     df["Долг"] = (df["PlanAmountPast"] - df["FactAmountTotal"]).clip(lower=0)
     df["Оплата по днями (факт).руб."] = df["FactAmountTotal"]
-    df["Проценты"] = df.apply(calculate_group_percentage, axis=1)
+    if INCREMENTAL:
+        # ключ строки: заказ + номер строки внутри заказа
+        keys = df["Заказ"] + "#" + df.groupby("Заказ").cumcount().astype(str)
+        overdue_days, percentage = overdue_metrics_incremental(keys, plans, facts, today_day)
+    else:
+        overdue_days, percentage = run_sharded(overdue_metrics, (plans, facts), (today_day,), workers=WORKERS)
+    df["Проценты"] = percentage
 
-    # Привязка регионов к дивизионам
-    region_to_division = {
-        "Азербайджан": "СНГ",
-        "Алтайский край": "Дивизион СИБИРЬ",
-        "Амурская область": "Дивизион ДАЛЬНИЙ ВОСТОК",
-        "Астраханская область": "Дивизион ЮГ",
-        "Белгородская область": "Дивизион ЦЕНТР",
-        "Белоруссия": "СНГ",
-        "Беларусь": "СНГ",
-        "Брянская область": "Дивизион ЦЕНТР",
-        "Владимирская область": "Дивизион ЦЕНТР",
-        "Волгоградская область": "Дивизион ЮГ",
-        "Воронежская область": "Дивизион ЦЕНТР",
-        "Грузия": "СНГ",
-        "ДНР": "Дивизион ЦЕНТР",
-        "Запорожье/Херсон": "Дивизион ЮГ",
-        "Иркутская область": "Дивизион СИБИРЬ",
-        "Казахстан": "СНГ",
-        "Калининградская область": "Дивизион ЦЕНТР",
-        "Кемеровская область": "Дивизион СИБИРЬ",
-        "Кировская область": "Дивизион ПОВОЛЖЬЕ",
-        "Краснодарский край 1": "Дивизион ЮГ",
-        "Краснодарский край 2": "Дивизион ЮГ",
-        "Краснодарский край": "Дивизион ЮГ",
-        "Красноярский край": "Дивизион СИБИРЬ",
-        "Курганская область": "Дивизион УРАЛ",
-        "Курская область": "Дивизион ЦЕНТР",
-        "Липецкая область": "Дивизион ЦЕНТР",
-        "ЛНР": "Дивизион ЦЕНТР",
-        "ЛНР/ДНР": "Дивизион ЦЕНТР",
-        "Московская область": "Дивизион ЦЕНТР",
-        "Нижегородская область": "Дивизион ПОВОЛЖЬЕ",
-        "Новосибирская область": "Дивизион СИБИРЬ",
-        "Омская область": "Дивизион СИБИРЬ",
-        "Оренбургская область": "Дивизион ПОВОЛЖЬЕ",
-        "Орловская область": "Дивизион ЦЕНТР",
-        "Пензенская область": "Дивизион ПОВОЛЖЬЕ",
-        "Приморский край": "Дивизион ДАЛЬНИЙ ВОСТОК",
-        "Республика Башкортостан": "Дивизион ПОВОЛЖЬЕ",
-        "Республика Дагестан": "Дивизион ЮГ",
-        "Республика Калмыкия": "Дивизион ЮГ",
-        "Республика Крым": "Дивизион ЮГ",
-        "Республика Мордовия": "Дивизион ПОВОЛЖЬЕ",
-        "Республика Татарстан": "Дивизион ПОВОЛЖЬЕ",
-        "Республика Чувашия": "Дивизион ПОВОЛЖЬЕ",
-        "Ростовская область 1": "Дивизион ЮГ",
-        "Ростовская область 2": "Дивизион ЮГ",
-        "Ростовская область": "Дивизион ЮГ",
-        "Рязанская область": "Дивизион ЦЕНТР",
-        "Самарская область": "Дивизион ПОВОЛЖЬЕ",
-        "Саратовская область": "Дивизион ПОВОЛЖЬЕ",
-        "Свердловская область": "Дивизион УРАЛ",
-        "Ставропольский край": "Дивизион ЮГ",
-        "Тамбовская область": "Дивизион ЦЕНТР",
-        "Томская область": "Дивизион СИБИРЬ",
-        "Тульская область": "Дивизион ЦЕНТР",
-        "Тюменская область": "Дивизион УРАЛ",
-        "Ульяновская область": "Дивизион ПОВОЛЖЬЕ",
-        "Челябинская область": "Дивизион УРАЛ",
-        "Армения": "СНГ",
-        "Алтайский край 1": "Дивизион СИБИРЬ",
-        "Алтайский край 2": "Дивизион СИБИРЬ"
-    }
-    df["Дивизион"] = df["Регион.Наименование"].map(region_to_division).fillna("Неизвестно")
+    # Привязка регионов к дивизионам (общий справочник regions.py)
+    df["Дивизион"] = division_of(df["Регион.Наименование"], default="Неизвестно")
 
     grouped = df.groupby("Заказ", as_index=False).agg({
         "PlanAmountPast": "sum", "FactAmountTotal": "sum", "PlanDatePast": "min", "FactDateMax": "max",
@@ -331,10 +194,14 @@ if __name__ == "__main__":
     })
 
     grouped["Агрегированный долг"] = (grouped["PlanAmountPast"] - grouped["FactAmountTotal"]).clip(lower=0)
-    grouped = grouped.merge(df[["Заказ", col_plan_name, col_fact_name]], on="Заказ", how="left")
-    grouped["Агрегированные дни просрочки"] = grouped.apply(calculate_group_overdue_days, axis=1)
-    grouped["Агрегированные проценты"] = grouped.apply(calculate_group_percentage, axis=1)
-    grouped["Агрегированный статус оплаты"] = grouped.apply(aggregated_status, axis=1)
+    df["_row"] = range(n)
+    grouped = grouped.merge(df[["Заказ", "_row", col_plan_name, col_fact_name]], on="Заказ", how="left")
+    rows = grouped["_row"].to_numpy()
+    grouped["Агрегированные дни просрочки"] = overdue_days[rows]
+    grouped["Агрегированные проценты"] = percentage[rows]
+    grouped["Агрегированный статус оплаты"] = aggregated_status(grouped, today)
+    grouped = to_rubles(grouped, ("PlanAmountPast", "FactAmountTotal", "Оплата по днями (факт).руб.",
+                                  "Агрегированный долг"))
 
     final_columns = [
         "Дивизион", "Регион.Наименование", "Сезон", "Контрагент.Сокращенное юр. наименование", "Контрагент.ИНН",
@@ -345,5 +212,14 @@ if __name__ == "__main__":
     ]
 
     grouped = grouped[final_columns]
-    grouped.to_excel(output_file, index=False)
+
+    if not AS_OF_DATES:
+        grouped.to_excel(output_file, index=False)
+    else:
+        # строки — в порядке основного листа, у каждой — даты по возрастанию
+        dates = sorted(pd.to_datetime(pd.Series(AS_OF_DATES), dayfirst=True).dt.date)
+        history = as_of_metrics(df, plan_ev, fact_ev, plans, facts, dates)
+        with pd.ExcelWriter(output_file) as writer:
+            grouped.to_excel(writer, sheet_name="Sheet1", index=False)
+            history.to_excel(writer, sheet_name="История", index=False)
     print("✅ Файл успешно сохранён.")
@@ -1,5 +1,4 @@
 import os
-import glob
 import time
 import shutil
 import threading
@@ -13,6 +12,10 @@ from colorama import Fore, Style
 colorama.init(autoreset=True)
 
 import win32com.client as win32
+
+from ingest import read_sheets
+from regions import report_regions
+from staging import latest_file, stage
 import pythoncom
 
 
@@ -375,52 +378,20 @@ def validate_plan_sheet_by_region(sh_plan, region_name):
 def separate_div_reg():
     start_time = time.time()
 
-    divisions_order = [
-        "Дивизион ДАЛЬНИЙ ВОСТОК", "Дивизион УРАЛ", "Дивизион СИБИРЬ",
-        "Дивизион ПОВОЛЖЬЕ", "Дивизион ЦЕНТР", "Дивизион ЮГ"
-    ]
-    def get_division_order(d): return divisions_order.index(d) if d in divisions_order else len(divisions_order)
-
-    region_division_map = {
-        "Азербайджан":"СНГ","Узбекистан":"СНГ","Алтайский край":"Дивизион СИБИРЬ","Амурская область":"Дивизион ДАЛЬНИЙ ВОСТОК",
-        "Астраханская область":"Дивизион ЮГ","Белгородская область":"Дивизион ЦЕНТР","Белоруссия":"СНГ",
-        "Брянская область":"Дивизион ЦЕНТР","Владимирская область":"Дивизион ЦЕНТР",
-        "Волгоградская область":"Дивизион ЮГ","Воронежская область":"Дивизион ЦЕНТР","Грузия":"СНГ",
-        "ДНР":"Дивизион ЦЕНТР","Запорожье/Херсон":"Дивизион ЮГ","Иркутская область":"Дивизион СИБИРЬ",
-        "Казахстан":"СНГ","Калининградская область":"Дивизион ЦЕНТР","Кемеровская область":"Дивизион СИБИРЬ",
-        "Кировская область":"Дивизион ПОВОЛЖЬЕ","Краснодарский край 1":"Дивизион ЮГ",
-        "Краснодарский край 2":"Дивизион ЮГ","Красноярский край":"Дивизион СИБИРЬ",
-        "Курганская область":"Дивизион УРАЛ","Курская область":"Дивизион ЦЕНТР","Липецкая область":"Дивизион ЦЕНТР",
-        "ЛНР":"Дивизион ЦЕНТР","ЛНР/ДНР":"Дивизион ЦЕНТР","Московская область":"Дивизион ЦЕНТР",
-        "Нижегородская область":"Дивизион ПОВОЛЖЬЕ","Новосибирская область":"Дивизион СИБИРЬ",
-        "Омская область":"Дивизион СИБИРЬ","Оренбургская область":"Дивизион ПОВОЛЖЬЕ",
-        "Орловская область":"Дивизион ЦЕНТР","Пензенская область":"Дивизион ПОВОЛЖЬЕ",
-        "Приморский край":"Дивизион ДАЛЬНИЙ ВОСТОК","Республика Башкортостан":"Дивизион ПОВОЛЖЬЕ",
-        "Республика Дагестан":"Дивизион ЮГ","Республика Калмыкия":"Дивизион ЮГ","Республика Крым":"Дивизион ЮГ",
-        "Республика Мордовия":"Дивизион ПОВОЛЖЬЕ","Республика Татарстан":"Дивизион ПОВОЛЖЬЕ",
-        "Республика Чувашия":"Дивизион ПОВОЛЖЬЕ","Ростовская область 1":"Дивизион ЮГ",
-        "Ростовская область 2":"Дивизион ЮГ","Рязанская область":"Дивизион ЦЕНТР",
-        "Самарская область":"Дивизион ПОВОЛЖЬЕ","Саратовская область":"Дивизион ПОВОЛЖЬЕ",
-        "Свердловская область":"Дивизион УРАЛ","Ставропольский край":"Дивизион ЮГ",
-        "Тамбовская область":"Дивизион ЦЕНТР","Томская область":"Дивизион СИБИРЬ",
-        "Тульская область":"Дивизион ЦЕНТР","Тюменская область":"Дивизион УРАЛ",
-        "Ульяновская область":"Дивизион ПОВОЛЖЬЕ","Челябинская область":"Дивизион УРАЛ",
-        "Беларусь":"СНГ","Армения":"СНГ"
-    }
-    allowed_yug = {"Республика Крым", "Республика Дагестан"}
-
-    # Ищем исходный файл по маске (UNC)
-    pattern = r'\\192.168.1.211\Аналитический центр\Отчёты\Быстрый старт\Отчет по продажам *.xlsx'
-    files = glob.glob(pattern)
-    if not files:
-        print("Не найдено файлов по шаблону:", pattern)
+    # Ищем исходный файл по маске (UNC) и работаем с его локальной копией
+    folder = r'\\192.168.1.211\Аналитический центр\Отчёты\Быстрый старт'
+    mask = 'Отчет по продажам *.xlsx'
+    source_file = latest_file(folder, mask)
+    if source_file is None:
+        print("Не найдено файлов по шаблону:", os.path.join(folder, mask))
         return
-    filename = max(files, key=os.path.getctime)
-    print("Обрабатывается файл:", filename)
+    print("Обрабатывается файл:", source_file)
+    filename = stage(source_file)
 
-    # Читаем листы с данными
-    data_goods  = pd.read_excel(filename, sheet_name='data_товар', header=0)
-    data_orders = pd.read_excel(filename, sheet_name='data_заказ', header=0)
+    # Читаем листы с данными (параллельно, в пуле процессов)
+    sheets_in = read_sheets(filename, {'data_товар': None, 'data_заказ': None}, parallel=True)
+    data_goods  = sheets_in['data_товар']
+    data_orders = sheets_in['data_заказ']
 
     # Запускаем скрытый Excel
     app = xw.App(visible=False)
@@ -439,23 +410,14 @@ def separate_div_reg():
     plan_snapshot = snapshot_plan_tables(sh_plan)
 
     # Список регионов и маппинг дивизионов (исключаем СНГ и неразрешённые регионы Юга)
+    regions = report_regions(data_orders['Наименование'])
     div_regions_map = {}
-    for r in data_orders['Наименование'].unique():
-        div = region_division_map.get(r)
-        if div and div != "СНГ":
-            if div == "Дивизион ЮГ" and r not in allowed_yug:
-                continue
-            div_regions_map.setdefault(div, set()).add(r)
+    for r, div in regions:
+        div_regions_map.setdefault(div, set()).add(r)
 
     processed_regions_by_div = {div: set() for div in div_regions_map.keys()}
 
-    regions = [r for r in data_orders['Наименование'].unique()
-               if region_division_map.get(r) and region_division_map[r] != "СНГ"]
-    regions = [r for r in regions if not (region_division_map[r] == "Дивизион ЮГ" and r not in allowed_yug)]
-    regions.sort(key=lambda r: get_division_order(region_division_map[r]))
-
-    for region in regions:
-        division = region_division_map[region]
+    for region, division in regions:
         print(f"\n--- Обработка региона: {region} ({division}) ---")
 
         target_folder = os.path.join(r'\\192.168.1.211\торговый дом', division, region, 'Маркетинг')
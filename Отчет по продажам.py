@@ -2,13 +2,17 @@ import pandas as pd
 import xlwings as xw
 import os
 import shutil
-import glob
 import time
 from datetime import datetime
 
 import colorama
 from colorama import Fore, Style
 
+from ingest import read_sheets
+from regions import report_regions
+from schemas import SCHEMAS
+from staging import latest_file, stage
+
 colorama.init(autoreset=True)
 
 
@@ -73,94 +77,25 @@ def update_or_create_plan_table(sh_plan, table_name, filtered_df):
 def separate_div_reg():
     start_time = time.time()
 
-    # Порядок дивизионов для сортировки регионов
-    divisions_order = [
-        "Дивизион ДАЛЬНИЙ ВОСТОК",
-        "Дивизион УРАЛ",
-        "Дивизион СИБИРЬ",
-        "Дивизион ПОВОЛЖЬЕ",
-        "Дивизион ЦЕНТР",
-        "Дивизион ЮГ"
-    ]
-
-    def get_division_order(div_name):
-        return divisions_order.index(div_name) if div_name in divisions_order else len(divisions_order)
-
-    # Сопоставление регионов с дивизионами (СНГ не обрабатываем)
-    region_division_map = {
-        "Азербайджан": "СНГ",
-        "Алтайский край": "Дивизион СИБИРЬ",
-        "Амурская область": "Дивизион ДАЛЬНИЙ ВОСТОК",
-        "Астраханская область": "Дивизион ЮГ",
-        "Белгородская область": "Дивизион ЦЕНТР",
-        "Белоруссия": "СНГ",
-        "Брянская область": "Дивизион ЦЕНТР",
-        "Владимирская область": "Дивизион ЦЕНТР",
-        "Волгоградская область": "Дивизион ЮГ",
-        "Воронежская область": "Дивизион ЦЕНТР",
-        "Грузия": "СНГ",
-        "ДНР": "Дивизион ЦЕНТР",
-        "Запорожье/Херсон": "Дивизион ЮГ",
-        "Иркутская область": "Дивизион СИБИРЬ",
-        "Казахстан": "СНГ",
-        "Калининградская область": "Дивизион ЦЕНТР",
-        "Кемеровская область": "Дивизион СИБИРЬ",
-        "Кировская область": "Дивизион ПОВОЛЖЬЕ",
-        "Краснодарский край 1": "Дивизион ЮГ",
-        "Краснодарский край 2": "Дивизион ЮГ",
-        "Красноярский край": "Дивизион СИБИРЬ",
-        "Курганская область": "Дивизион УРАЛ",
-        "Курская область": "Дивизион ЦЕНТР",
-        "Липецкая область": "Дивизион ЦЕНТР",
-        "ЛНР": "Дивизион ЦЕНТР",
-        "ЛНР/ДНР": "Дивизион ЦЕНТР",
-        "Московская область": "Дивизион ЦЕНТР",
-        "Нижегородская область": "Дивизион ПОВОЛЖЬЕ",
-        "Новосибирская область": "Дивизион СИБИРЬ",
-        "Омская область": "Дивизион СИБИРЬ",
-        "Оренбургская область": "Дивизион ПОВОЛЖЬЕ",
-        "Орловская область": "Дивизион ЦЕНТР",
-        "Пензенская область": "Дивизион ПОВОЛЖЬЕ",
-        "Приморский край": "Дивизион ДАЛЬНИЙ ВОСТОК",
-        "Республика Башкортостан": "Дивизион ПОВОЛЖЬЕ",
-        "Республика Дагестан": "Дивизион ЮГ",
-        "Республика Калмыкия": "Дивизион ЮГ",
-        "Республика Крым": "Дивизион ЮГ",
-        "Республика Мордовия": "Дивизион ПОВОЛЖЬЕ",
-        "Республика Татарстан": "Дивизион ПОВОЛЖЬЕ",
-        "Республика Чувашия": "Дивизион ПОВОЛЖЬЕ",
-        "Ростовская область 1": "Дивизион ЮГ",
-        "Ростовская область 2": "Дивизион ЮГ",
-        "Рязанская область": "Дивизион ЦЕНТР",
-        "Самарская область": "Дивизион ПОВОЛЖЬЕ",
-        "Саратовская область": "Дивизион ПОВОЛЖЬЕ",
-        "Свердловская область": "Дивизион УРАЛ",
-        "Ставропольский край": "Дивизион ЮГ",
-        "Тамбовская область": "Дивизион ЦЕНТР",
-        "Томская область": "Дивизион СИБИРЬ",
-        "Тульская область": "Дивизион ЦЕНТР",
-        "Тюменская область": "Дивизион УРАЛ",
-        "Ульяновская область": "Дивизион ПОВОЛЖЬЕ",
-        "Челябинская область": "Дивизион УРАЛ",
-        "Беларусь": "СНГ",
-        "Армения": "СНГ"
-    }
-    # Для дивизиона ЮГ обрабатываем только "Республика Крым" и "Республика Дагестан"
-    allowed_yug_regions = {"Республика Крым", "Республика Дагестан"}
-
-    files_pattern = r'\\192.168.1.211\Аналитический центр\Отчёты\Быстрый старт\Отчет по продажам *.xlsx'
-    list_of_files = glob.glob(files_pattern)
-    if not list_of_files:
-        print("Не найдено файлов по шаблону:", files_pattern)
+    files_dir = r'\\192.168.1.211\Аналитический центр\Отчёты\Быстрый старт'
+    files_mask = 'Отчет по продажам *.xlsx'
+    source_file = latest_file(files_dir, files_mask)
+    if source_file is None:
+        print("Не найдено файлов по шаблону:", os.path.join(files_dir, files_mask))
         return
-    filename = max(list_of_files, key=os.path.getctime)
-    print(f"Обрабатывается файл: {filename}")
-
-    # Считываем исходные данные
-    data_goods = pd.read_excel(filename, sheet_name='data_товар', header=0)
-    data_orders = pd.read_excel(filename, sheet_name='data_заказ', header=0)
-    plan_50 = pd.read_excel(filename, sheet_name='Планы скорректированные в минус', usecols='A:R', header=1)
-    plan_shipment = pd.read_excel(filename, sheet_name='Планы скорректированные в минус', usecols='A:R', header=1)
+    print(f"Обрабатывается файл: {source_file}")
+    # Дальше всё (pandas и Excel) работает с локальной копией
+    filename = stage(source_file)
+
+    # Считываем исходные данные: листы разбираются параллельно в пуле процессов
+    sheets_in = read_sheets(filename, {
+        'data_товар': None,
+        'data_заказ': None,
+        'Планы скорректированные в минус': SCHEMAS['Планы скорректированные в минус'],
+    }, parallel=True)
+    data_goods = sheets_in['data_товар']
+    data_orders = sheets_in['data_заказ']
+    plan_50 = sheets_in['Планы скорректированные в минус']
 
     if 'ОП' in plan_50.columns:
         region_col = 'ОП'
@@ -185,21 +120,9 @@ def separate_div_reg():
         app_excel.kill()
         return
 
-    all_regions = data_orders['Наименование'].unique()
-    all_regions = [r for r in all_regions if
-                   region_division_map.get(r, None) is not None and region_division_map[r] != "СНГ"]
-    filtered_regions = []
-    for r in all_regions:
-        if region_division_map[r] == "Дивизион ЮГ":
-            if r in allowed_yug_regions:
-                filtered_regions.append(r)
-        else:
-            filtered_regions.append(r)
-    all_regions = filtered_regions
-    all_regions.sort(key=lambda reg: get_division_order(region_division_map[reg]))
-
-    for region in all_regions:
-        division = region_division_map[region]
+    # Регионы из общего справочника: без СНГ, из ЮГа — только "Республика Крым" и
+    # "Республика Дагестан"; порядок — по дивизионам
+    for region, division in report_regions(data_orders['Наименование']):
         region_start = time.time()
         print(f"\n--- Обработка региона: {region} (Дивизион: {division}) ---")
 
@@ -1,229 +1,58 @@
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
+from contextlib import ExitStack
+from datetime import datetime
+from pathlib import Path
 
-EPS = 1e-6  # допуск для сравнения с нулём
+from debt import CC_DAILY_RATE, iter_commercial_credit
+from schedules import Schedules, day_number, day_to_date, parse_schedule
+from writers import TableSidecar, XlsxStream
 
-###############################################################################
-# 1. Парсинг УПД
-###############################################################################
-def parse_upd(upd_str):
-    """
-    Парсит строку с УПД формата 'DD.MM.YYYY; НомерУПД; СУММА'.
-    Возвращает список словарей:
-      [{'date': date, 'doc_number': str, 'amount': float}, ...]
-    """
-    out = []
-    if pd.isna(upd_str):
-        return out
-    lines = str(upd_str).replace('<br>', '\n').split('\n')
-    for line in lines:
-        parts = line.split(';')
-        if len(parts) < 3:
-            continue
-        date_str = parts[0].strip()
-        doc_num = parts[1].strip()
-        amt_str = parts[2].strip()
-        try:
-            d = datetime.strptime(date_str, '%d.%m.%Y').date()
-            a = float(amt_str.replace(' ', '').replace(',', '.').replace('\xa0', ''))
-            out.append({
-                'date': d,
-                'doc_number': doc_num,
-                'amount': a
-            })
-        except:
-            continue
-    return out
+# Детализация дополнительно пишется рядом с книгой (Parquet, без pyarrow — CSV)
+DETAIL_SIDECAR = False
 
+# Пачки строк считаются в WORKERS процессах (1 — в текущем процессе,
+# 0 — по числу ядер); детализация и итог те же, порядок — тот же
+WORKERS = 1
 
-###############################################################################
-# 2. Парсинг платежей
-###############################################################################
-def parse_payments(pay_str):
-    """
-    Парсит строку с платежами формата 'DD.MM.YYYY; СУММА'.
-    Возвращает список словарей:
-      [{'date': date, 'amount': float}, ...]
-    """
-    out = []
-    if pd.isna(pay_str):
-        return out
-    lines = str(pay_str).replace('<br>', '\n').split('\n')
-    for line in lines:
-        if ';' not in line:
-            continue
-        date_str, amt_str = line.split(';', 1)
-        try:
-            d = datetime.strptime(date_str.strip(), '%d.%m.%Y').date()
-            a = float(amt_str.strip().replace(' ', '').replace(',', '.').replace('\xa0', ''))
-            out.append({
-                'date': d,
-                'amount': a
-            })
-        except:
-            continue
-    return out
+# КК по другим дневным ставкам (для всех строк) — отдельными столбцами сводного
+# отчёта: {заголовок: дневная ставка или календарь ставок}. Считается в том же
+# проходе, детализация — только по ставке строки. Календарь — rates.RateCalendar
+# (для дневных ставок basis=1) или rates.read_rate_calendar(файл, basis=1).
+RATE_SCENARIOS = {}   # например: {"КК при 0.1% в день": 0.001}
 
+DETAIL_COLUMNS = [
+    'row_index', 'doc_number', 'base', 'start_date', 'end_date', 'days', 'interest',
+    'Контрагент', 'Договор',
+]
 
 ###############################################################################
-# 3. Распределение оплат по УПД (FIFO)
+# Расчёт — пакетно по всем строкам (debt.commercial_credit):
+#   1) УПД и оплаты всех строк разбираются за один проход по столбцу;
+#   2) оплаты распределяются по УПД FIFO (по датам отгрузки) — пересечением отрезков
+#      накопленных сумм (money.fifo_allocate);
+#   3) периоды начисления и проценты — массивами по всем УПД сразу.
+# Правила начисления (предоплата, периоды, "если всё оплачено") — см. debt.py.
 ###############################################################################
-def distribute_payments(upds, payments):
+def read_schedules(df, col, dialect):
     """
-    Распределяет оплаты по УПД в порядке их даты (FIFO).
-    Возвращает словарь: {doc_number: [{'payment_date': date, 'amount': float}, ...]}
-
-    Логика:
-      1) Сортируем УПД по возрастанию даты.
-      2) Сортируем платежи по возрастанию даты.
-      3) Идём по каждому платежу, "закрывая" УПД по очереди, пока не израсходуем
-         весь платеж или не закончатся УПД.
+    Столбец графиков -> Schedules в порядке записей ячейки (пустой, если столбца нет);
+    суммы — в копейках.
     """
-    upds_sorted = sorted(upds, key=lambda x: x['date'])
-    payments_sorted = sorted(payments, key=lambda x: x['date'])
-
-    distribution = {upd['doc_number']: [] for upd in upds_sorted}
-    remaining_upds = {upd['doc_number']: upd['amount'] for upd in upds_sorted}
+    if col not in df.columns:
+        return Schedules(np.zeros(len(df) + 1), [], np.zeros(0, dtype=np.int64), [] if dialect == 'upd' else None)
+    return Schedules.from_events(parse_schedule(df[col], dialect, kopeks=True), len(df), by=())
 
-    for pay in payments_sorted:
-        pay_amount = pay['amount']
-        for upd in upds_sorted:
-            doc_num = upd['doc_number']
-            if remaining_upds[doc_num] > 0 and pay_amount > 0:
-                allocated = min(pay_amount, remaining_upds[doc_num])
-                distribution[doc_num].append({
-                    'payment_date': pay['date'],
-                    'amount': allocated
-                })
-                remaining_upds[doc_num] -= allocated
-                pay_amount -= allocated
-                if pay_amount <= 0:
-                    break
 
-    return distribution
+def row_values(df, col, default=''):
+    """Значения столбца по строкам (как row.get(col, default))."""
+    if col in df.columns:
+        return df[col].to_numpy(dtype=object)
+    return np.full(len(df), default, dtype=object)
 
 
 ###############################################################################
-# 4. Расчет коммерческого кредита (КК) для одного УПД
-###############################################################################
-def compute_cc_for_upd(upd_info, payments_for_upd, daily_rate, current_date):
-    """
-    Учитываем предоплату (платежи до или в день отгрузки):
-      1) Суммируем все платежи, у которых payment_date <= upd_date (предоплата),
-         и уменьшаем на них базу УПД (без начисления процентов).
-      2) Оставшуюся часть начинаем "процентовать" с upd_date+1.
-      3) Идём по платежам, которые приходят после даты отгрузки, и начисляем
-         проценты за период между предыдущим "срезом" и датой оплаты.
-      4) Если остаток > 0 в конце, начисляем проценты до current_date.
-
-    Параметры:
-      - upd_info = {'date': date, 'amount': float, 'doc_number': str}
-      - payments_for_upd = [{'payment_date': date, 'amount': float}, ...]
-      - daily_rate = дневная ставка (напр. 0.003 для 0.3%)
-      - current_date = текущая дата (конец периода)
-
-    Возвращает кортеж: (общая сумма процентов, список деталей по периодам).
-    """
-    upd_date = upd_info['date']
-    upd_amount = upd_info['amount']
-    doc_number = upd_info['doc_number']
-
-    # Сортируем платежи, чтобы шли по возрастанию даты
-    payments_for_upd = sorted(payments_for_upd, key=lambda x: x['payment_date'])
-
-    remaining = upd_amount
-    total_interest = 0.0
-    details = []
-
-    # 1) Предоплата: все платежи, дата которых <= upd_date
-    for pay in payments_for_upd:
-        if pay['payment_date'] <= upd_date:
-            allocated = min(remaining, pay['amount'])
-            remaining -= allocated
-            # Если уже весь УПД погашен предоплатой — проценты = 0
-            if remaining <= EPS:
-                remaining = 0.0
-                break
-
-    if abs(remaining) < EPS:
-        # Полностью погашено до или в день отгрузки, процентов нет
-        return (0.0, [{
-            'doc_number': doc_number,
-            'base': 0.0,
-            'start_date': upd_date,
-            'end_date': upd_date,
-            'days': 0,
-            'interest': 0.0
-        }])
-
-    # 2) Начинаем считать проценты с дня, следующего за отгрузкой
-    base_date = upd_date
-    accrual_start = base_date + timedelta(days=1)
-    if accrual_start > current_date:
-        # Если текущая дата раньше, чем accrual_start, то проценты не начисляются
-        return (0.0, [{
-            'doc_number': doc_number,
-            'base': round(remaining, 2),
-            'start_date': accrual_start,
-            'end_date': accrual_start,
-            'days': 0,
-            'interest': 0.0
-        }])
-
-    # 3) Обработка платежей, пришедших ПОСЛЕ даты отгрузки
-    for pay in payments_for_upd:
-        pay_date = pay['payment_date']
-        if pay_date <= upd_date:
-            # Эти платежи уже учли как предоплату
-            continue
-        if pay_date <= base_date:
-            # Если дата платежа не продвигает базовую дату, пропускаем
-            continue
-
-        # Если остаток уже 0, нет смысла продолжать
-        if remaining <= EPS:
-            break
-
-        # Кол-во дней: (pay_date - (base_date+1)) + 1
-        days_count = (pay_date - (base_date + timedelta(days=1))).days + 1
-        if days_count > 0:
-            interest = remaining * daily_rate * days_count
-            total_interest += interest
-            details.append({
-                'doc_number': doc_number,
-                'base': round(remaining, 2),
-                'start_date': base_date + timedelta(days=1),
-                'end_date': pay_date,
-                'days': days_count,
-                'interest': round(interest, 2)
-            })
-
-        # Уменьшаем остаток на сумму платежа
-        allocated = min(remaining, pay['amount'])
-        remaining -= allocated
-        # Сдвигаем базовую дату на день платежа
-        base_date = pay_date
-
-    # 4) Если после всех оплат остаток > 0, считаем проценты до current_date
-    if remaining > EPS and base_date < current_date:
-        days_count = (current_date - (base_date + timedelta(days=1))).days + 1
-        if days_count > 0:
-            interest = remaining * daily_rate * days_count
-            total_interest += interest
-            details.append({
-                'doc_number': doc_number,
-                'base': round(remaining, 2),
-                'start_date': base_date + timedelta(days=1),
-                'end_date': current_date,
-                'days': days_count,
-                'interest': round(interest, 2)
-            })
-
-    return (round(total_interest, 2), details)
-
-
-###############################################################################
-# 5. Основной скрипт
+# Основной скрипт
 ###############################################################################
 def main():
     # Пути к файлам (пример)
@@ -233,78 +62,60 @@ def main():
     # Читаем данные
     df = pd.read_excel(input_path, sheet_name='TDSheet', dtype={'ИНН': str})
 
-    all_debug_records = []
-
-    for idx, row in df.iterrows():
-        # (A) Парсим данные
-        upd_list = parse_upd(row.get('УПД'))
-        fact_list = parse_payments(row.get('Фактические оплаты по датам'))
-
-        # (B) Определяем ставку коммерческого кредита
-        raw_rate = row.get('Процент коммерческого кредита')
-        if pd.isna(raw_rate):
-            daily_rate = 0.003  # 0.3% в день по умолчанию
-        else:
-            daily_rate = float(raw_rate) / 100.0
-
-        # (C) Распределяем оплаты по УПД (FIFO)
-        distribution = distribute_payments(upd_list, fact_list)
-
-        # Текущая дата (дата запуска скрипта)
-        current_date = datetime.today().date()
-
-        total_cc = 0.0
-
-        # (D) Считаем коммерческий кредит для каждого УПД
-        for upd_info in upd_list:
-            payments_for_upd = distribution.get(upd_info['doc_number'], [])
-            cc_val, det_list = compute_cc_for_upd(
-                upd_info,
-                payments_for_upd,
-                daily_rate,
-                current_date
-            )
-            total_cc += cc_val
-
-            # Добавляем детализацию с дополнительной информацией
-            for seg in det_list:
-                seg['row_index'] = idx
-                seg['Контрагент'] = row.get('Контрагент', '')
-                seg['Договор'] = row.get('Договор', '')
-            all_debug_records.extend(det_list)
-
-        # (E) Если сумма оплат >= сумме отгрузки – обнуляем КК (логика "если всё оплачено")
-        total_shipped = sum(upd['amount'] for upd in upd_list)
-        total_paid = sum(p['amount'] for p in fact_list)
-        if total_paid >= total_shipped:
-            total_cc = 0.0
-            # Удаляем старую детализацию
-            all_debug_records = [rec for rec in all_debug_records if rec['row_index'] != idx]
-            # Добавляем запись, что процентов нет
-            for upd in upd_list:
-                all_debug_records.append({
-                    'row_index': idx,
-                    'doc_number': upd['doc_number'],
-                    'base': 0,
-                    'start_date': upd['date'],
-                    'end_date': upd['date'],
-                    'days': 0,
-                    'interest': 0.0,
-                    'Контрагент': row.get('Контрагент', ''),
-                    'Договор': row.get('Договор', '')
-                })
-
-        # Записываем итоговый коммерческий кредит в датафрейм
-        df.at[idx, 'Коммерческий кредит'] = round(total_cc, 2)
-
-    # (F) Формируем таблицу детализации
-    df_debug = pd.DataFrame(all_debug_records)
-    df_debug.sort_values(by=['row_index', 'doc_number', 'start_date'], inplace=True)
-
-    # (G) Сохраняем результат
-    with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Сводный отчет', index=False)
-        df_debug.to_excel(writer, sheet_name='Детализация', index=False)
+    # (A) Парсим данные: каждый столбец разбирается один раз целиком
+    upds = read_schedules(df, 'УПД', 'upd')
+    pays = read_schedules(df, 'Фактические оплаты по датам', 'payments')
+
+    # (B) Ставка коммерческого кредита строки, по умолчанию 0.3% в день
+    raw_rate = row_values(df, 'Процент коммерческого кредита', np.nan)
+    daily_rate = np.array([CC_DAILY_RATE if pd.isna(r) else float(r) / 100.0 for r in raw_rate])
+    if RATE_SCENARIOS:
+        daily_rate = [daily_rate, *RATE_SCENARIOS.values()]
+
+    # Текущая дата (дата запуска скрипта)
+    current_date = datetime.today().date()
+
+    # (C-G) КК и детализация пачками строк: детализация сразу пишется в книгу
+    # (и в сайдкар), итоговый КК — на лист "Сводный отчет" в конце
+    total_cc = np.zeros((len(df), 1 + len(RATE_SCENARIOS)))
+    kontr, dogovor = row_values(df, 'Контрагент'), row_values(df, 'Договор')
+    labels = df.index.to_numpy()
+    summary_columns = list(df.columns)
+    for name in ['Коммерческий кредит', *RATE_SCENARIOS]:
+        if len(df) and name not in summary_columns:
+            summary_columns.append(name)
+    with XlsxStream(output_path) as book, ExitStack() as stack:
+        summary = book.sheet('Сводный отчет', summary_columns)
+        detail = book.sheet('Детализация', DETAIL_COLUMNS)
+        sidecar = None
+        if DETAIL_SIDECAR:
+            sidecar = stack.enter_context(TableSidecar(
+                Path(output_path).with_name(Path(output_path).stem + '_детализация'),
+                text=('doc_number', 'Контрагент', 'Договор'),
+            ))
+        for rows, total, det in iter_commercial_credit(upds, pays, daily_rate, day_number(current_date),
+                                                     workers=WORKERS):
+            total_cc[rows] = total.reshape(len(rows), -1)
+            r = det['row']
+            batch = pd.DataFrame({
+                'row_index': labels[r],
+                'doc_number': det['doc_number'],
+                'base': det['base'],
+                'start_date': day_to_date(det['start']),
+                'end_date': day_to_date(det['end']),
+                'days': det['days'],
+                'interest': det['interest'],
+                'Контрагент': kontr[r],
+                'Договор': dogovor[r],
+            })
+            detail.write(batch)
+            if sidecar is not None:
+                sidecar.write(batch)
+
+        if len(df):
+            for j, name in enumerate(['Коммерческий кредит', *RATE_SCENARIOS]):
+                df[name] = total_cc[:, j]
+        summary.write(df)
 
     print("Файл сохранён:", output_path)
 
@@ -11,59 +11,47 @@
 #              * во всех прочих случаях — текущий остаток на момент события;
 #        - затем уменьшаем остаток на applied;
 #        - если после всех событий остаток > 0 — проценты до today.
+#   Считается пакетно по всем заказам сразу (debt.excel_interest).
+#   При INCREMENTAL состояние расчёта сохраняется в _cache, и на следующий день
+#   дописываются только новые оплаты; изменившиеся заказы пересчитываются целиком.
+#   Полный расчёт и "на текущий момент" при WORKERS > 1 идут в пуле процессов
+#   по шардам заказов (sharding.py) — результат тот же, что в одном процессе.
 # "Проценты на текущий момент, руб." — старая логика: проценты только на текущие остатки (факты ≤ today).
+# При AS_OF_DATES на лист "История" выводятся долг и проценты на каждую дату оценки —
+# как если бы отчёт строился в этот день (оплаты позже даты ещё не известны);
+# все даты считаются за один проход по оплатам (debt.excel_interest_as_of,
+# current_interest_as_of), итоги — по ступенчатым функциям (schedules.schedule_totals_at).
+# Суммы графиков разбираются сразу в копейки (money.py): итоги, долг и FIFO
+# считаются точно; проценты строки — точная сумма кусков и одно округление до
+# копейки, половина от нуля (money.interest_kopeks). В рубли — только для отчёта.
 # Заголовки — русские.
 
+import numpy as np
 import pandas as pd
-import re
-from datetime import datetime, date
+from datetime import date
+
+from debt import accrue_lists, excel_interest, excel_interest_as_of, excel_interest_incremental
+from ingest import CACHE_DIR, read_1c_export
+from money import from_kopeks
+from regions import division_of
+from schedules import Schedules, day_number, parse_schedule, schedule_totals, schedule_totals_at
+from sharding import run_sharded
 
 INTEREST_RATE = 0.18  # годовая ставка
+# Ставка, меняющаяся во времени (история ключевой ставки), задаётся календарём:
+#   INTEREST_RATE = rates.read_rate_calendar(r"...\Ключевая ставка.xlsx")
+# (столбцы "Дата" — начало действия, "Ставка" — в процентах). Так же можно
+# задать и сценарии RATE_SCENARIOS.
+# Те же проценты по другим ставкам — отдельными столбцами после "Проценты, руб."
+# ({заголовок: годовая ставка}); считаются по тем же кускам начисления, без повторного FIFO
+RATE_SCENARIOS = {}   # например: {"Проценты при 28%, руб.": 0.28}
+INCREMENTAL = False   # True — продолжать расчёт с сохранённого состояния (файл в _cache)
+STATE_FILE = CACHE_DIR / "interest_state.pkl"
+AS_OF_DATES = []      # даты оценки для листа "История", например ["31.01.2025", "28.02.2025"]
+WORKERS = 1           # процессов для расчёта по заказам (1 — в текущем процессе, 0 — по числу ядер)
 
 # ---------- Утилиты ----------
 
-def clean_amount_string(s: str) -> str:
-    s = str(s).replace("\u00A0", "").replace("\u2007", "").replace("\u202F", "")
-    s = re.sub(r"[^0-9\.,-]+", "", s)
-    return s.replace(",", ".")
-
-def parse_payment_lines(cell):
-    recs = []
-    if pd.isna(cell) or str(cell).strip() == "":
-        return recs
-    for line in str(cell).splitlines():
-        parts = re.split(r"\s*;\s*", line)
-        if len(parts) < 2:
-            continue
-        try:
-            d = datetime.strptime(parts[0].strip(), "%d.%m.%Y").date()
-            a = float(clean_amount_string(parts[1].strip()))
-            recs.append([d, a])
-        except:
-            continue
-    return sorted(recs, key=lambda x: x[0])
-
-def parse_payment_info(cell, mode="plan", filter_past=False, today=None):
-    if pd.isna(cell) or str(cell).strip() == "":
-        return 0, None
-    recs = []
-    for line in str(cell).splitlines():
-        parts = re.split(r"\s*;\s*", line)
-        if len(parts) < 2:
-            continue
-        try:
-            d = datetime.strptime(parts[0].strip(), "%d.%m.%Y").date()
-            a = float(clean_amount_string(parts[1].strip()))
-            recs.append((d, a))
-        except:
-            continue
-    if mode == "plan" and filter_past:
-        valid = [(d, a) for d, a in recs if d <= today]
-        return sum(a for d, a in valid), min((d for d, a in valid), default=None)
-    if mode == "plan":
-        return sum(a for d, a in recs), min((d for d, a in recs), default=None)
-    return sum(a for d, a in recs), max((d for d, a in recs), default=None)
-
 def find_column_by_keywords(df, keywords):
     kws = [k.lower().strip() for k in keywords]
     m = [c for c in df.columns if all(w in c.lower() for w in kws)]
@@ -71,99 +59,102 @@ def find_column_by_keywords(df, keywords):
         raise KeyError(f"Столбец с ключами {keywords} не найден.")
     return m[0]
 
-# ---------- FIFO-распределение фактов по планам ----------
+# ---------- "Проценты на текущий момент, руб." — старая логика ----------
+
+def _pay(rem, i, amt):
+    # FIFO с предоплатами: платёж amt гасит остатки rem начиная с плана i; новый i
+    while amt > 0 and i < len(rem):
+        applied = min(rem[i], amt)
+        rem[i] -= applied
+        amt -= applied
+        if rem[i] <= 0:
+            i += 1
+    return i
+
 
-def allocate_fifo(plans, facts):
+def _open_pieces(plan_days, rem, today):
+    # куски по непогашенным планам с датой < today (остаток — копейки)
+    return [(remain, today - pd0, pd0) for pd0, remain in zip(plan_days, rem) if remain > 0 and pd0 < today]
+
+
+def current_overdue_pieces(plan, fact, today):
     """
-    plans: [(plan_date, plan_amount), ...]   — по возрастанию дат
-    facts: [(fact_date, fact_amount), ...]   — по возрастанию дат
-    return: allocations — список по планам,
-            allocations[i] = [(fact_date, applied_amount), ...]
-    Предоплата разрешена, но платёж не "перепрыгивает" незакрытый план.
+    Куски начисления "на текущий момент": (непогашенный остаток плана с датой < today,
+    дни до today, дата плана). Проценты = остаток * ставка/365 * дни (debt.accrue_lists).
+    Суммы графиков и остаток в куске — копейки.
     """
-    allocations = [[] for _ in plans]
+    plan_day, plan_amt = plan
+    fact_day, fact_amt = fact
+    rem = plan_amt.tolist()
     i = 0
-    rem = [float(a) for _, a in plans]
-    for fd, fa in facts:
-        amt = float(fa)
-        while amt > 0 and i < len(plans):
-            if rem[i] <= 1e-9:
-                i += 1
-                continue
-            applied = min(rem[i], amt)
-            allocations[i].append((fd, applied))
-            rem[i] -= applied
-            amt -= applied
-            if rem[i] <= 1e-9:
-                i += 1
-    return allocations
-
-# ---------- "Проценты, руб." — excel-логика ----------
-
-def calculate_interest_excel_style(row, today):
-    plans = parse_payment_lines(row[col_plan])   # [(pdate, pamt), ...]
-    facts = parse_payment_lines(row[col_fact])   # [(fdate, famt), ...]
-    if not plans:
-        return 0.0
-
-    alloc = allocate_fifo(plans, facts)
-    r_day = INTEREST_RATE / 365.0
-    total = 0.0
-
-    for idx, ((pdate, pamt), a_list) in enumerate(zip(plans, alloc)):
-        if pamt <= 0:
-            continue
-
-        # предоплаты и остаток на дату плана
-        pre  = [(fd, a) for (fd, a) in a_list if fd < pdate]
-        post = sorted([(fd, a) for (fd, a) in a_list if fd >= pdate], key=lambda x: x[0])
-        pre_total = sum(a for _, a in pre)
-        carry     = pre[-1][1] if pre else 0.0     # хвост последнего платежа ДО даты плана (если был)
-        remaining = max(0.0, pamt - pre_total)     # остаток на дату плана
-
-        first = True
-        for fd, applied in post:
-            days = (fd - pdate).days
-            if days > 0:
-                # ВАЖНО: carry применяем ТОЛЬКО начиная со 2-й плановой строки (idx > 0).
-                base = carry if (first and carry > 0 and idx > 0) else remaining
-                total += base * r_day * days
-            remaining -= applied
-            first = False
-
-        # остаток до today
-        if remaining > 1e-9 and pdate < today:
-            days = (today - pdate).days
-            if days > 0:
-                total += remaining * r_day * days
-
-    return round(total, 2)
+    for amt in fact_amt[fact_day <= today].tolist():
+        i = _pay(rem, i, amt)
+    return _open_pieces(plan_day.tolist(), rem, today)
 
-# ---------- "Проценты на текущий момент, руб." — старая логика ----------
 
-def calculate_current_overdue_interest(row, today):
-    plans = parse_payment_lines(row[col_plan])
-    facts_all = parse_payment_lines(row[col_fact])
-    facts = [[d, a] for d, a in facts_all if d <= today]
+def current_interest(plans, facts, today):
+    """Проценты "на текущий момент" по всем строкам графиков (ядро для sharding.run_sharded)."""
+    pieces = [current_overdue_pieces(plans[i], facts[i], today) for i in range(len(plans))]
+    return from_kopeks(accrue_lists(pieces, INTEREST_RATE))
 
-    # FIFO с предоплатами
-    rem = [float(a) for _, a in plans]
-    i = 0
-    for fd, fa in facts:
-        amt = float(fa)
-        while amt > 0 and i < len(rem):
-            applied = min(rem[i], amt)
-            rem[i] -= applied
-            amt -= applied
-            if rem[i] <= 1e-9:
-                i += 1
-
-    r_day = INTEREST_RATE / 365.0
-    cur = 0.0
-    for (pd0, _), remain in zip(plans, rem):
-        if remain > 1e-9 and pd0 < today:
-            cur += remain * r_day * (today - pd0).days
-    return round(cur, 2)
+
+def current_interest_as_of(plans, facts, days):
+    """
+    current_interest на каждую дату days (номера дней): результат формы (n, len(days)).
+    Факты строки отсортированы по дате, поэтому FIFO проходит их один раз, а на каждой
+    дате (по возрастанию) снимаются куски по текущим остаткам.
+    """
+    days = np.asarray(days, dtype=np.int64)
+    k = len(days)
+    pieces = [None] * (len(plans) * k)
+    for r in range(len(plans)):
+        plan_day, plan_amt = plans[r]
+        fact_day, fact_amt = facts[r]
+        plan_day, fact_day, fact_amt = plan_day.tolist(), fact_day.tolist(), fact_amt.tolist()
+        rem = plan_amt.tolist()
+        i = f = 0
+        for j in np.argsort(days, kind="stable").tolist():
+            d = int(days[j])
+            while f < len(fact_day) and fact_day[f] <= d:
+                i = _pay(rem, i, fact_amt[f])
+                f += 1
+            pieces[r * k + j] = _open_pieces(plan_day, rem, d)
+    return from_kopeks(accrue_lists(pieces, INTEREST_RATE)).reshape(len(plans), k)
+
+# ---------- История на даты оценки ----------
+
+def history_table(df, grouped, plan_ev, fact_ev, plans, facts, first_row, pair_of_row, dates):
+    """
+    Длинная таблица: строка отчёта × дата оценки. На дату D — план и оплаты с датой ≤ D,
+    долг, проценты (excel-логика) и проценты на текущий момент, посчитанные на день D.
+    Все даты — сразу: итоги строк — ступенчатые функции по дате, проценты — один
+    проход по оплатам.
+    """
+    n, k = len(df), len(dates)
+    days = [day_number(d) for d in dates]
+    pair_plans, pair_facts = plans.take(first_row), facts.take(first_row)
+    interest = from_kopeks(excel_interest_as_of(pair_plans, pair_facts, days, INTEREST_RATE))
+    current = run_sharded(current_interest_as_of, (pair_plans, pair_facts), (days,), workers=WORKERS)
+
+    # суммы заказа на каждую дату (копейки) для каждой строки отчёта: (строка, дата)
+    orders = grouped["Заказ"]
+    by_order = df["Заказ"].to_numpy()
+    plan = pd.DataFrame(schedule_totals_at(plan_ev, n, days)[0]).groupby(by_order).sum().reindex(orders).to_numpy()
+    fact = pd.DataFrame(schedule_totals_at(fact_ev, n, days)[0]).groupby(by_order).sum().reindex(orders).to_numpy()
+
+    # строки отчёта в исходном порядке, внутри строки — даты по возрастанию
+    hist = pd.DataFrame({
+        "Заказ": np.repeat(orders.to_numpy(), k),
+        "Дата оценки": np.tile(np.array(dates, dtype=object), len(orders)),
+        "План на дату, руб.": from_kopeks(plan.ravel()),
+        "Оплачено на дату, руб.": from_kopeks(fact.ravel()),
+        "Агрегированный долг, руб.": from_kopeks(np.maximum(plan - fact, 0).ravel()),
+        "Проценты, руб.": interest[pair_of_row].ravel(),
+        "Проценты на текущий момент, руб.": current[pair_of_row].ravel(),
+    })
+    for c in ["План на дату, руб.", "Оплачено на дату, руб.", "Агрегированный долг, руб."]:
+        hist[c] = hist[c].round(2)
+    return hist
 
 # ---------- MAIN ----------
 
@@ -173,92 +164,27 @@ if __name__ == "__main__":
     input_file = r"\\192.168.1.211\дебиторская задолженность\Отчеты\Выгрузка 1С\ДЗ_1С_НОВЫЙ (XLSX).xlsx"
     output_file = r"C:\Users\nkazakov\Downloads\Расчёт процентов за дни просрочки1.xlsx"
 
-    df = pd.read_excel(input_file, header=2)
-    df.columns = df.columns.str.strip()
-    df = df.loc[:, ~df.columns.duplicated()]
+    df = read_1c_export(input_file)
 
     df["Заказ"] = df["Заказ клиента"].astype(str).str.strip()
     col_plan = find_column_by_keywords(df, ["по дням", "план"])
     col_fact = find_column_by_keywords(df, ["по дням", "факт"])
 
+    # Графики разбираются один раз: таблицы событий (row_id, date, amount в копейках)
+    n = len(df)
+    plan_ev = parse_schedule(df[col_plan], kopeks=True)
+    fact_ev = parse_schedule(df[col_fact], kopeks=True)
+
     # Служебные поля
-    df[["PlanAmountPast", "PlanDatePast"]] = df[col_plan].apply(
-        lambda x: pd.Series(parse_payment_info(x, "plan", True, today))
-    )
-    df[["PlanAmountFull", "PlanDateFull"]] = df[col_plan].apply(
-        lambda x: pd.Series(parse_payment_info(x, "plan", False))
-    )
-    df[["FactAmountTotal", "FactDateMax"]] = df[col_fact].apply(
-        lambda x: pd.Series(parse_payment_info(x, "fact"))
-    )
+    df["PlanAmountPast"], df["PlanDatePast"] = schedule_totals(plan_ev, n, "min", until=today)
+    df["PlanAmountFull"], df["PlanDateFull"] = schedule_totals(plan_ev, n, "min")
+    df["FactAmountTotal"], df["FactDateMax"] = schedule_totals(fact_ev, n, "max")
 
     df["Долг"] = (df["PlanAmountPast"] - df["FactAmountTotal"]).clip(lower=0)
     df["Оплата по дням (факт).руб."] = df["FactAmountTotal"]
 
-    # Привязка регионов к дивизионам (как у вас)
-    region_to_division = {
-        "Азербайджан": "СНГ",
-        "Алтайский край": "Дивизион СИБИРЬ",
-        "Амурская область": "Дивизион ДАЛЬНИЙ ВОСТОК",
-        "Астраханская область": "Дивизион ЮГ",
-        "Белгородская область": "Дивизион ЦЕНТР",
-        "Белоруссия": "СНГ",
-        "Беларусь": "СНГ",
-        "Брянская область": "Дивизион ЦЕНТР",
-        "Владимирская область": "Дивизион ЦЕНТР",
-        "Волгоградская область": "Дивизион ЮГ",
-        "Воронежская область": "Дивизион ЦЕНТР",
-        "Грузия": "СНГ",
-        "ДНР": "Дивизион ЦЕНТР",
-        "Запорожье/Херсон": "Дивизион ЮГ",
-        "Иркутская область": "Дивизион СИБИРЬ",
-        "Казахстан": "СНГ",
-        "Калининградская область": "Дивизион ЦЕНТР",
-        "Кемеровская область": "Дивизион СИБИРЬ",
-        "Кировская область": "Дивизион ПОВОЛЖЬЕ",
-        "Краснодарский край 1": "Дивизион ЮГ",
-        "Краснодарский край 2": "Дивизион ЮГ",
-        "Краснодарский край": "Дивизион ЮГ",
-        "Красноярский край": "Дивизион СИБИРЬ",
-        "Курганская область": "Дивизион УРАЛ",
-        "Курская область": "Дивизион ЦЕНТР",
-        "Липецкая область": "Дивизион ЦЕНТР",
-        "ЛНР": "Дивизион ЦЕНТР",
-        "ЛНР/ДНР": "Дивизион ЦЕНТР",
-        "Московская область": "Дивизион ЦЕНТР",
-        "Нижегородская область": "Дивизион ПОВОЛЖЬЕ",
-        "Новосибирская область": "Дивизион СИБИРЬ",
-        "Омская область": "Дивизион СИБИРЬ",
-        "Оренбургская область": "Дивизион ПОВОЛЖЬЕ",
-        "Орловская область": "Дивизион ЦЕНТР",
-        "Пензенская область": "Дивизион ПОВОЛЖЬЕ",
-        "Приморский край": "Дивизион ДАЛЬНИЙ ВОСТОК",
-        "Республика Башкортостан": "Дивизион ПОВОЛЖЬЕ",
-        "Республика Дагестан": "Дивизион ЮГ",
-        "Республика Калмыкия": "Дивизион ЮГ",
-        "Республика Крым": "Дивизион ЮГ",
-        "Республика Мордовия": "Дивизион ПОВОЛЖЬЕ",
-        "Республика Татарстан": "Дивизион ПОВОЛЖЬЕ",
-        "Республика Чувашия": "Дивизион ПОВОЛЖЬЕ",
-        "Ростовская область 1": "Дивизион ЮГ",
-        "Ростовская область 2": "Дивизион ЮГ",
-        "Ростовская область": "Дивизион ЮГ",
-        "Рязанская область": "Дивизион ЦЕНТР",
-        "Самарская область": "Дивизион ПОВОЛЖЬЕ",
-        "Саратовская область": "Дивизион ПОВОЛЖЬЕ",
-        "Свердловская область": "Дивизион УРАЛ",
-        "Ставропольский край": "Дивизион ЮГ",
-        "Тамбовская область": "Дивизион ЦЕНТР",
-        "Томская область": "Дивизион СИБИРЬ",
-        "Тульская область": "Дивизион ЦЕНТР",
-        "Тюменская область": "Дивизион УРАЛ",
-        "Ульяновская область": "Дивизион ПОВОЛЖЬЕ",
-        "Челябинская область": "Дивизион УРАЛ",
-        "Армения": "СНГ",
-        "Алтайский край 1": "Дивизион СИБИРЬ",
-        "Алтайский край 2": "Дивизион СИБИРЬ"
-    }
-    df["Дивизион"] = df["Регион.Наименование"].map(region_to_division).fillna("Неизвестно")
+    # Привязка регионов к дивизионам (общий справочник regions.py)
+    df["Дивизион"] = division_of(df["Регион.Наименование"], default="Неизвестно")
 
     # Агрегация по заказам
     grouped = df.groupby("Заказ", as_index=False).agg({
@@ -279,17 +205,50 @@ if __name__ == "__main__":
     })
 
     grouped["Агрегированный долг"] = (grouped["PlanAmountPast"] - grouped["FactAmountTotal"]).clip(lower=0)
+    for c in ["PlanAmountPast", "FactAmountTotal", "Оплата по дням (факт).руб.", "Агрегированный долг"]:
+        grouped[c] = from_kopeks(grouped[c])
 
     # сырьё для процентов
-    grouped = grouped.merge(df[["Заказ", col_plan, col_fact]], on="Заказ", how="left")
-
-    # 1) Исторические проценты — excel-логика (исправленный carry)
-    grouped["Проценты"] = grouped.apply(lambda r: calculate_interest_excel_style(r, today), axis=1)
+    df["_row"] = range(n)
+    grouped = grouped.merge(df[["Заказ", "_row", col_plan, col_fact]], on="Заказ", how="left")
+    plans = Schedules.from_events(plan_ev, n)
+    facts = Schedules.from_events(fact_ev, n)
+    today_day = day_number(today)
+
+    # Строки с одинаковой парой графиков (план, факт) считаются один раз
+    pair = df.groupby([col_plan, col_fact], dropna=False, sort=False).ngroup().to_numpy()
+    _, first_row = np.unique(pair, return_index=True)
+    pair_of_row = pair[grouped["_row"].to_numpy()]
+
+    # 1) Исторические проценты — excel-логика (исправленный carry), пакетно по всем парам;
+    #    основная ставка и сценарии — за один расчёт (столбцы матрицы)
+    rates = [INTEREST_RATE, *RATE_SCENARIOS.values()]
+    if INCREMENTAL:
+        # ключ пары: заказ + номер пары внутри заказа
+        orders = df["Заказ"].to_numpy()[first_row]
+        keys = pd.Series(orders).astype(str) + "#" + pd.Series(orders).groupby(orders).cumcount().astype(str)
+        interest, stats = excel_interest_incremental(
+            keys, plans.take(first_row), facts.take(first_row), today_day, rates, STATE_FILE
+        )
+        print(f"Проценты: полный расчёт {stats['full']}, дописано {stats['advanced']}, без изменений {stats['reused']}")
+    else:
+        interest = run_sharded(excel_interest, (plans.take(first_row), facts.take(first_row)), (today_day, rates),
+                               workers=WORKERS)
+    interest = from_kopeks(interest)
+    grouped["Проценты"] = interest[pair_of_row, 0]
+    for j, name in enumerate(RATE_SCENARIOS, start=1):
+        grouped[name] = interest[pair_of_row, j]
 
     # 2) Проценты на текущий момент — старая логика
-    grouped["Проценты на текущий момент"] = grouped.apply(
-        lambda r: calculate_current_overdue_interest(r, today), axis=1
-    )
+    current = run_sharded(current_interest, (plans.take(first_row), facts.take(first_row)), (today_day,),
+                          workers=WORKERS)
+    grouped["Проценты на текущий момент"] = current[pair_of_row]
+
+    # 3) История на даты оценки
+    history = None
+    if AS_OF_DATES:
+        dates = sorted(pd.to_datetime(pd.Series(AS_OF_DATES), dayfirst=True).dt.date)
+        history = history_table(df, grouped, plan_ev, fact_ev, plans, facts, first_row, pair_of_row, dates)
 
     # Финальные столбцы + русские заголовки
     final_columns = [
@@ -299,7 +258,7 @@ if __name__ == "__main__":
         "Сумма оплаты по заказу, (руб.)", "Оплата по дням (факт).руб.",
         "PlanAmountPast", "FactAmountTotal",
         "PlanDatePast", "FactDateMax", "PlanDateFull",
-        "Агрегированный долг", "Проценты", "Проценты на текущий момент",
+        "Агрегированный долг", "Проценты", *RATE_SCENARIOS, "Проценты на текущий момент",
         "Заказ", col_plan, col_fact
     ]
     grouped = grouped[final_columns].rename(columns={
@@ -332,5 +291,10 @@ if __name__ == "__main__":
         if c in grouped.columns:
             grouped[c] = grouped[c].round(2)
 
-    grouped.to_excel(output_file, index=False)
+    if history is None:
+        grouped.to_excel(output_file, index=False)
+    else:
+        with pd.ExcelWriter(output_file) as writer:
+            grouped.to_excel(writer, sheet_name="Sheet1", index=False)
+            history.to_excel(writer, sheet_name="История", index=False)
     print("✅ Файл успешно сохранён:", output_file)
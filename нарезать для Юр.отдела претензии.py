@@ -1,11 +1,12 @@
 import os
 import re
-from decimal import Decimal, ROUND_HALF_UP
 
 import pandas as pd
 from docx import Document
 from num2words import num2words
 
+from money import split_rubles, to_kopeks
+
 
 # =========================
 # НАСТРОЙКИ ВХОДА/ВЫХОДА
@@ -41,9 +42,9 @@ def ru_plural(n: int, forms: tuple[str, str, str]) -> str:
     return forms[2]
 
 
-def amount_parts(amount) -> dict:
+def amount_parts(kop) -> dict:
     """
-    Возвращает части суммы:
+    Части суммы, заданной в копейках (int, см. money.py):
       - rubles: целые рубли (int)
       - kopeks: копейки (00..99)
       - number_text: '12 345'
@@ -52,9 +53,7 @@ def amount_parts(amount) -> dict:
       - combined_full:  '12 345 (Двенадцать тысяч триста сорок пять) рублей 00 копеек'
                          (с правильными падежами для рублей/копеек)
     """
-    dec = Decimal(str(amount)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-    rubles = int(dec // 1)
-    kopeks = int((dec - rubles) * 100)
+    rubles, kopeks = (int(x) for x in split_rubles(kop))
 
     number_text = f"{rubles:,.0f}".replace(",", " ")
     words_text = num2words(rubles, lang='ru').capitalize()
@@ -136,7 +135,7 @@ def set_tnr_font(doc: Document):
 def fill_word_template(row, template_path: str, save_path: str):
     doc = Document(template_path)
 
-    amt = amount_parts(row['ПДЗ, руб'])
+    amt = amount_parts(row['ПДЗ, коп'])
     # Для {{СуммаПДЗ}} используем ПОЛНУЮ форму (с "рублей ХХ копеек"),
     # а для «пропусков» ______(______) используем BASIC без валют.
     amount_basic = amt['combined_basic']
@@ -183,8 +182,10 @@ def main():
     # 1) Читаем Excel
     df = pd.read_excel(EXCEL_FILE, sheet_name=SHEET_NAME, skiprows=9)
 
-    # 2) Приводим сумму к числу
+    # 2) Приводим сумму к числу; для претензий — в копейках (округление до копейки
+    #    половина вверх — один раз, при чтении), суммы по договору складываются точно
     df['ПДЗ, руб'] = pd.to_numeric(df['ПДЗ, руб'], errors='coerce').fillna(0)
+    df['ПДЗ, коп'] = to_kopeks(df['ПДЗ, руб'])
 
     # 3) Фильтруем > 0
     df_filtered = df[df['ПДЗ, руб'] > 0]
@@ -193,7 +194,7 @@ def main():
     grouped_df = (
         df_filtered
         .groupby(['Контрагент', 'Договор'], dropna=False)
-        .agg({'ПДЗ, руб': 'sum', 'Адрес': 'first', 'ИНН': 'first'})
+        .agg({'ПДЗ, руб': 'sum', 'ПДЗ, коп': 'sum', 'Адрес': 'first', 'ИНН': 'first'})
         .reset_index()
     )
 